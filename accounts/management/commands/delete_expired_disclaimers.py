@@ -20,37 +20,51 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = "Delete any disclaimers over 6 years old"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of disclaimers to delete at a time'
+        )
+
     def handle(self, *args, **options):
 
         # get relevant users
         expire_date = timezone.now() - relativedelta(years=6)
 
-        old_online_disclaimers_to_delete = OnlineDisclaimer.objects\
-            .select_related('user').filter(
+        old_online_disclaimers_to_delete = OnlineDisclaimer.objects.filter(
             Q(date__lt=expire_date) & (Q(date_updated__isnull=True) | Q(date_updated__lt=expire_date))
         )
         online_disclaimer_users = [
-            '{} {}'.format(disc.user.first_name, disc.user.last_name)
-            for disc in old_online_disclaimers_to_delete
-            ]
+            '{} {}'.format(first_name, last_name)
+            for first_name, last_name in old_online_disclaimers_to_delete.values_list(
+                "user__first_name", "user__last_name"
+            )
+        ]
 
         old_non_registered_disclaimers_to_delete = NonRegisteredDisclaimer.objects.filter(
             date__lt=expire_date
         )
         non_registered_disclaimer_users = [
-            '{} {}'.format(disc.first_name, disc.last_name)
-            for disc in old_non_registered_disclaimers_to_delete
-            ]
+            '{} {}'.format(first_name, last_name)
+            for first_name, last_name in old_non_registered_disclaimers_to_delete.values_list(
+                "first_name", "last_name"
+            )
+        ]
 
         old_archieved_disclaimers_to_delete = ArchivedDisclaimer.objects.filter(
             Q(date__lt=expire_date) &
             (Q(date_updated__isnull=True) | Q(date_updated__lt=expire_date))
         )
-        archive_disclaimer_users = [disc.name for disc in old_archieved_disclaimers_to_delete]
+        archive_disclaimer_users = list(
+            old_archieved_disclaimers_to_delete.values_list("name", flat=True)
+        )
 
-        old_online_disclaimers_to_delete.delete()
-        old_non_registered_disclaimers_to_delete.delete()
-        old_archieved_disclaimers_to_delete.delete()
+        # delete in chunks, clearing cached disclaimer status for online disclaimers
+        old_online_disclaimers_to_delete.purge(chunk_size=options["chunk_size"])
+        old_non_registered_disclaimers_to_delete.purge(chunk_size=options["chunk_size"])
+        old_archieved_disclaimers_to_delete.purge(chunk_size=options["chunk_size"])
 
         if online_disclaimer_users:
             ActivityLog.objects.create(
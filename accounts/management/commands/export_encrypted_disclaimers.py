@@ -1,4 +1,5 @@
 import csv
+import io
 import logging
 import os
 
@@ -7,15 +8,83 @@ from django.conf import settings
 from django.core.mail.message import EmailMessage
 from django.utils.encoding import smart_str
 
-from simplecrypt import encrypt
-
 from activitylog.models import ActivityLog
 from accounts.models import OnlineDisclaimer, DisclaimerContent
+from common.encryption import encrypt_chunks
 
 logger = logging.getLogger(__name__)
 
 PASSWORD = os.environ.get('SIMPLECRYPT_PASSWORD')
 
+HEADER = [
+    smart_str(u"ID"),
+    smart_str(u"Disclaimer Version"),
+    smart_str(u"User"),
+    smart_str(u"Date"),
+    smart_str(u"Date Updated"),
+    smart_str(u"Name (as stated on disclaimer)"),
+    smart_str(u"DOB"),
+    smart_str(u"Address"),
+    smart_str(u"Postcode"),
+    smart_str(u"Home Phone"),
+    smart_str(u"Mobile Phone"),
+    smart_str(u"Emergency Contact 1: Name"),
+    smart_str(u"Emergency Contact 1: Relationship"),
+    smart_str(u"Emergency Contact 1: Phone"),
+    smart_str(u"Emergency Contact 2: Name"),
+    smart_str(u"Emergency Contact 2: Relationship"),
+    smart_str(u"Emergency Contact 2: Phone"),
+    smart_str(u"Medical Conditions"),
+    smart_str(u"Medical Conditions Details"),
+    smart_str(u"Joint Problems"),
+    smart_str(u"Joint Problems Details"),
+    smart_str(u"Allergies"),
+    smart_str(u"Allergies Details"),
+    smart_str(u"Medical Treatment Terms"),
+    smart_str(u"Medical Treatment Accepted"),
+    smart_str(u"Disclaimer Terms"),
+    smart_str(u"Disclaimer Terms Accepted"),
+    smart_str(u"Over 18 Statement"),
+    smart_str(u"Over 18 Confirmed"),
+]
+
+
+def disclaimer_row(obj, disclaimer_content):
+    return [
+        smart_str(obj.pk),
+        smart_str(obj.version),
+        smart_str(obj.user),
+        smart_str(obj.date.strftime('%Y-%m-%d %H:%M:%S:%f %z')),
+        smart_str(obj.date_updated.strftime(
+            '%Y-%m-%d %H:%M:%S:%f %z') if obj.date_updated else ''
+        ),
+        smart_str(obj.name),
+        smart_str(obj.dob.strftime('%Y-%m-%d')),
+        smart_str(obj.address),
+        smart_str(obj.postcode),
+        smart_str(obj.home_phone),
+        smart_str(obj.mobile_phone),
+        smart_str(obj.emergency_contact1_name),
+        smart_str(obj.emergency_contact1_relationship),
+        smart_str(obj.emergency_contact1_phone),
+        smart_str(obj.emergency_contact2_name),
+        smart_str(obj.emergency_contact2_relationship),
+        smart_str(obj.emergency_contact2_phone),
+        smart_str('Yes' if obj.medical_conditions else 'No'),
+        smart_str(obj.medical_conditions_details),
+        smart_str('Yes' if obj.joint_problems else 'No'),
+        smart_str(obj.joint_problems_details),
+        smart_str('Yes' if obj.allergies else 'No'),
+        smart_str(obj.allergies_details),
+        smart_str(disclaimer_content.medical_treatment_terms),
+        smart_str('Yes' if obj.medical_treatment_permission else 'No'),
+        smart_str(disclaimer_content.disclaimer_terms),
+        smart_str('Yes' if obj.terms_accepted else 'No'),
+        smart_str(disclaimer_content.over_18_statement),
+        smart_str('Yes' if obj.age_over_18_confirmed else 'No'),
+    ]
+
+
 class Command(BaseCommand):
     help = 'Encrypt and export disclaimers data'
 
@@ -26,119 +95,69 @@ class Command(BaseCommand):
             help='File path of output file; if not provided, '
                  'will be stored in log folder as "disclaimers.bu"'
         )
-
-    def handle(self, *args, **options):
-        outputfile = options.get('file')
-        output_text = []
-
-        output_text.append(
-            '@@@@@'.join(
-                [
-                    smart_str(u"ID"),
-                    smart_str(u"Disclaimer version"),
-                    smart_str(u"User"),
-                    smart_str(u"Date"),
-                    smart_str(u"Date Updated"),
-                    smart_str(u"Name (as stated on disclaimer)"),
-                    smart_str(u"DOB"),
-                    smart_str(u"Address"),
-                    smart_str(u"Postcode"),
-                    smart_str(u"Home Phone"),
-                    smart_str(u"Mobile Phone"),
-                    smart_str(u"Emergency Contact 1: Name"),
-                    smart_str(u"Emergency Contact 1: Relationship"),
-                    smart_str(u"Emergency Contact 1: Phone"),
-                    smart_str(u"Emergency Contact 2: Name"),
-                    smart_str(u"Emergency Contact 2: Relationship"),
-                    smart_str(u"Emergency Contact 2: Phone"),
-                    smart_str(u"Medical Conditions"),
-                    smart_str(u"Medical Conditions Details"),
-                    smart_str(u"Joint Problems"),
-                    smart_str(u"Joint Problems Details"),
-                    smart_str(u"Allergies"),
-                    smart_str(u"Allergies Details"),
-                    smart_str(u"Medical Treatment Terms"),
-                    smart_str(u"Medical Treatment Accepted"),
-                    smart_str(u"Disclaimer Terms"),
-                    smart_str(u"Disclaimer Terms Accepted"),
-                    smart_str(u"Over 18 Statement"),
-                    smart_str(u"Over 18 Confirmed")
-                ]
-            )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of disclaimer records to fetch and encrypt at a time'
         )
 
-        for obj in OnlineDisclaimer.objects.all():
-            disclaimer_content = DisclaimerContent.objects.get(version=obj.version)
-            output_text.append(
-                '@@@@@'.join(
-                    [
-                        smart_str(obj.pk),
-                        smart_str(obj.version),
-                        smart_str(obj.user),
-                        smart_str(obj.date.strftime('%Y-%m-%d %H:%M:%S:%f %z')),
-                        smart_str(obj.date_updated.strftime(
-                            '%Y-%m-%d %H:%M:%S:%f %z') if obj.date_updated else ''
-                        ),
-                        smart_str(obj.name),
-                        smart_str(obj.dob.strftime('%Y-%m-%d')),
-                        smart_str(obj.address),
-                        smart_str(obj.postcode),
-                        smart_str(obj.home_phone),
-                        smart_str(obj.mobile_phone),
-                        smart_str(obj.emergency_contact1_name),
-                        smart_str(obj.emergency_contact1_relationship),
-                        smart_str(obj.emergency_contact1_phone),
-                        smart_str(obj.emergency_contact2_name),
-                        smart_str(obj.emergency_contact2_relationship),
-                        smart_str(obj.emergency_contact2_phone),
-                        smart_str('Yes' if obj.medical_conditions else 'No'),
-                        smart_str(obj.medical_conditions_details),
-                        smart_str('Yes' if obj.joint_problems else 'No'),
-                        smart_str(obj.joint_problems_details),
-                        smart_str('Yes' if obj.allergies else 'No'),
-                        smart_str(obj.allergies_details),
-                        smart_str(disclaimer_content.medical_treatment_terms),
-                        smart_str('Yes' if obj.medical_treatment_permission else 'No'),
-                        smart_str(disclaimer_content.disclaimer_terms),
-                        smart_str('Yes' if obj.terms_accepted else 'No'),
-                        smart_str(disclaimer_content.over_18_statement),
-                        smart_str('Yes' if obj.age_over_18_confirmed else 'No'),
-                    ]
-                )
-            )
+    def csv_chunks(self, chunk_size):
+        """
+        Yield the disclaimer data as csv, encoded in chunks of chunk_size records.
+        Disclaimers are fetched from the db in chunks, so only one chunk is held in
+        memory at a time.
+        """
+        contents = {
+            content.version: content for content in DisclaimerContent.objects.all()
+        }
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(HEADER)
+        rows_in_chunk = 0
+        for obj in OnlineDisclaimer.objects.select_related("user").order_by("id").iterator(
+            chunk_size=chunk_size
+        ):
+            writer.writerow(disclaimer_row(obj, contents[obj.version]))
+            self.count += 1
+            rows_in_chunk += 1
+            if rows_in_chunk == chunk_size:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                rows_in_chunk = 0
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
 
-        output_str = '&&&&&'.join(output_text)
+    def handle(self, *args, **options):
+        outputfile = options.get('file')
+        self.count = 0
 
         with open(outputfile, 'wb') as out:
-            out.write(encrypt(PASSWORD, output_str))
-
-        with open(outputfile, 'rb') as file:
-            filename = os.path.split(outputfile)[1]
-            msg = EmailMessage(
-                '{} disclaimer backup'.format(
-                    settings.ACCOUNT_EMAIL_SUBJECT_PREFIX
-                ),
-                'Encrypted disclaimer back up file attached. '
-                '{} records.'.format(OnlineDisclaimer.objects.count()),
-                settings.DEFAULT_FROM_EMAIL,
-                to=[settings.SUPPORT_EMAIL],
-                attachments=[(filename, file.read(), 'bytes/bytes')]
-            )
-            msg.send(fail_silently=False)
+            for encrypted in encrypt_chunks(PASSWORD, self.csv_chunks(options['chunk_size'])):
+                out.write(encrypted)
+
+        msg = EmailMessage(
+            '{} disclaimer backup'.format(
+                settings.ACCOUNT_EMAIL_SUBJECT_PREFIX
+            ),
+            'Encrypted disclaimer back up file attached. '
+            '{} records.'.format(self.count),
+            settings.DEFAULT_FROM_EMAIL,
+            to=[settings.SUPPORT_EMAIL],
+        )
+        msg.attach_file(outputfile, 'bytes/bytes')
+        msg.send(fail_silently=False)
 
         self.stdout.write(
             '{} disclaimer records encrypted and written to {}'.format(
-                OnlineDisclaimer.objects.count(), outputfile
+                self.count, outputfile
             )
         )
 
         logger.info(
-            '{} disclaimer records encrypted and backed up'.format(
-                OnlineDisclaimer.objects.count()
-            )
+            '{} disclaimer records encrypted and backed up'.format(self.count)
         )
         ActivityLog.objects.create(
-            log='{} disclaimer records encrypted and backed up'.format(
-                OnlineDisclaimer.objects.count()
-            )
+            log='{} disclaimer records encrypted and backed up'.format(self.count)
         )
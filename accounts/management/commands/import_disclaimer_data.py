@@ -1,12 +1,16 @@
 import csv
+import io
 from datetime import datetime
 from decimal import Decimal
+from itertools import chain, islice
 import logging
 
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 
+from accounts.management.commands.export_encrypted_disclaimers import PASSWORD
 from accounts.models import DisclaimerContent, OnlineDisclaimer
+from common.encryption import decrypt_chunks
 
 
 
@@ -14,25 +18,66 @@ logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
-    help = 'Import disclaimer data from decrypted csv backup file'
+    help = 'Import disclaimer data from csv backup file, or encrypted backup ' \
+           'file created by export_encrypted_disclaimers'
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--file',
             help='File path of input file'
         )
+        parser.add_argument(
+            '--encrypted',
+            action='store_true',
+            help='Input file is an encrypted backup file'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of rows to read and import at a time'
+        )
+
+    def read_rows(self, inputfilepath, encrypted):
+        if encrypted:
+            with open(inputfilepath, 'rb') as file:
+                # each decrypted chunk contains complete csv rows
+                lines = chain.from_iterable(
+                    io.StringIO(chunk.decode("utf-8"), newline='')
+                    for chunk in decrypt_chunks(PASSWORD, file)
+                )
+                yield from csv.DictReader(lines)
+        else:
+            with open(inputfilepath, 'r', newline='') as file:
+                yield from csv.DictReader(file)
 
     def handle(self, *args, **options):
 
         inputfilepath = options.get('file')
-
-        with open(inputfilepath, 'r') as file:
-            reader = csv.DictReader(file)
-
-            for i, row in enumerate(reader):
-                try:
-                    user = User.objects.get(username=row["User"])
-                except User.DoesNotExist:
+        rows = enumerate(self.read_rows(inputfilepath, options['encrypted']))
+        contents = {
+            content.version: content for content in DisclaimerContent.objects.all()
+        }
+
+        while True:
+            batch = list(islice(rows, options['batch_size']))
+            if not batch:
+                break
+            # look up users and their existing disclaimers for the whole batch
+            users = User.objects.in_bulk(
+                {row["User"] for _, row in batch}, field_name="username"
+            )
+            existing_disclaimers = {
+                (disclaimer.user_id, disclaimer.version): disclaimer
+                for disclaimer in OnlineDisclaimer.objects.filter(
+                    user__in=users.values(),
+                    version__in={Decimal(row["Disclaimer Version"]) for _, row in batch}
+                )
+            }
+
+            for i, row in batch:
+                user = users.get(row["User"])
+                if user is None:
                     self.stdout.write(
                         "Unknown user {} in backup data; data on "
                         "row {} not imported".format(row["User"], i)
@@ -45,10 +90,9 @@ class Command(BaseCommand):
                     row["Date Updated"], '%Y-%m-%d %H:%M:%S:%f %z'
                 ) if row["Date Updated"] else None
 
-                try:
-                    disclaimer = OnlineDisclaimer.objects.get(user=user, version=Decimal(row["Disclaimer Version"]))
-                except OnlineDisclaimer.DoesNotExist:
-                    disclaimer = None
+                disclaimer = existing_disclaimers.get(
+                    (user.id, Decimal(row["Disclaimer Version"]))
+                )
 
                 if disclaimer:
                     if disclaimer.date == datetime.strptime(
@@ -68,17 +112,15 @@ class Command(BaseCommand):
                     logger.warning(log_msg)
 
                 else:
-                    try:
-                        content = DisclaimerContent.objects.get(
-                            version=Decimal(row["Disclaimer Version"])
-                        )
-                    except DisclaimerContent.DoesNotExist:
+                    content = contents.get(Decimal(row["Disclaimer Version"]))
+                    if content is None:
                         content = DisclaimerContent.objects.create(
                             version=Decimal(row["Disclaimer Version"]),
                             medical_treatment_terms=row["Medical Treatment Terms"],
                             disclaimer_terms=row["Disclaimer Terms"],
                             over_18_statement=row["Over 18 Statement"]
                         )
+                        contents[content.version] = content
 
                     if not (
                         content.medical_treatment_terms ==  row["Medical Treatment Terms"] and
@@ -93,7 +135,7 @@ class Command(BaseCommand):
                         self.stdout.write(log_msg)
                         logger.warning(log_msg)
                     else:
-                        OnlineDisclaimer.objects.create(
+                        disclaimer = OnlineDisclaimer.objects.create(
                             user=user,
                             date=datetime.strptime(
                                 row["Date"], '%Y-%m-%d %H:%M:%S:%f %z'
@@ -122,6 +164,7 @@ class Command(BaseCommand):
                             age_over_18_confirmed=True if row["Over 18 Confirmed"] == "Yes" else False,
                             version=Decimal(row["Disclaimer Version"])
                         )
+                        existing_disclaimers[(user.id, disclaimer.version)] = disclaimer
                         log_msg = "Disclaimer for {} imported from " \
                                    "backup.".format(user.username)
                         self.stdout.write(log_msg)
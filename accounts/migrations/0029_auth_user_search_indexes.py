@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+# Indexes on auth_user for the studioadmin user list.  The upper() indexes
+# match the SQL that Django generates for istartswith lookups (the first name
+# initial filter) and the first name initials query; the (first_name, id)
+# index is used for the ordered, paginated list.
+USER_INDEXES = {
+    "auth_user_first_name_upper_idx": "(UPPER(first_name) text_pattern_ops)",
+    "auth_user_last_name_upper_idx": "(UPPER(last_name) text_pattern_ops)",
+    "auth_user_username_upper_idx": "(UPPER(username) text_pattern_ops)",
+    "auth_user_email_upper_idx": "(UPPER(email) text_pattern_ops)",
+    "auth_user_first_name_id_idx": "(first_name, id)",
+}
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0028_delete_printdisclaimer"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=f"CREATE INDEX IF NOT EXISTS {index_name} ON auth_user {index_def};",
+            reverse_sql=f"DROP INDEX IF EXISTS {index_name};",
+        )
+        for index_name, index_def in USER_INDEXES.items()
+    ]
@@ -9,7 +9,8 @@ from math import floor
 
 from dateutil.relativedelta import relativedelta
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Left, Lower
 from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 
@@ -230,6 +231,44 @@ class DisclaimerContent(models.Model):
             log='Disclaimer Content version {} created'.format(self.version)
         )
 
+
+class DisclaimerQuerySet(models.QuerySet):
+
+    def purge(self, chunk_size=500):
+        """
+        Delete disclaimers in chunks, archiving any that are less than 6 years
+        old, as the model's delete() does.  Archives and activity logs are
+        bulk created and cached disclaimer status is cleared for each chunk.
+        Returns the number of disclaimers deleted.
+        """
+        ids = list(self.order_by("id").values_list("id", flat=True))
+        expiry = timezone.now() - relativedelta(years=6)
+        current_version = DisclaimerContent.current_version()
+        queryset = self.model.objects.all()
+        if hasattr(self.model, "user"):
+            queryset = queryset.select_related("user")
+        for start in range(0, len(ids), chunk_size):
+            with transaction.atomic():
+                disclaimers = list(queryset.filter(id__in=ids[start:start + chunk_size]))
+                to_archive = [
+                    disclaimer for disclaimer in disclaimers if disclaimer.needs_archive(expiry)
+                ]
+                ArchivedDisclaimer.objects.bulk_create(
+                    [disclaimer.archived_disclaimer() for disclaimer in to_archive]
+                )
+                ActivityLog.objects.bulk_create(
+                    [ActivityLog(log=disclaimer.archived_log()) for disclaimer in to_archive]
+                )
+                cache.delete_many(
+                    [
+                        key for disclaimer in disclaimers
+                        for key in disclaimer.cache_keys(current_version)
+                    ]
+                )
+                self.model.objects.filter(id__in=[disclaimer.id for disclaimer in disclaimers]).delete()
+        return len(ids)
+
+
 @has_readonly_fields
 class BaseOnlineDisclaimer(models.Model):
     read_only_fields = ('date', 'version')
@@ -280,9 +319,31 @@ class BaseOnlineDisclaimer(models.Model):
 
     expired = models.BooleanField(default=False)
 
+    objects = DisclaimerQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
+    def needs_archive(self, expiry):
+        """Disclaimers less than 6 yrs old are archived when they are deleted"""
+        return self.date > expiry
+
+    def cache_keys(self, current_version=None):
+        return []
+
+    def _archive_field_values(self, exclude):
+        return {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields if field.attname not in exclude
+        }
+
+    def delete(self, using=None, keep_parents=False):
+        cache.delete_many(self.cache_keys())
+        if self.needs_archive(timezone.now() - relativedelta(years=6)):
+            self.archived_disclaimer().save()
+            ActivityLog.objects.create(log=self.archived_log())
+        super().delete(using=using, keep_parents=keep_parents)
+
 
 @has_readonly_fields
 class OnlineDisclaimer(BaseOnlineDisclaimer):
@@ -346,22 +407,23 @@ class OnlineDisclaimer(BaseOnlineDisclaimer):
         cache.delete(expired_disclaimer_cache_key(self.user))
         super().save(**kwargs)
 
-    def delete(self, using=None, keep_parents=False):
-        # clear cache if there is any
-        cache.delete(active_disclaimer_cache_key(self.user))
-        cache.delete(active_online_disclaimer_cache_key(self.user))
-        cache.delete(expired_disclaimer_cache_key(self.user))
-        expiry = timezone.now() - relativedelta(years=6)
-        if self.date > expiry or (self.date_updated and self.date_updated > expiry):
-            ignore_fields = ['id', 'user_id', '_state']
-            fields = {key: value for key, value in self.__dict__.items() if key not in ignore_fields and not key.endswith('_oldval')}
-            ArchivedDisclaimer.objects.create(**fields)
-            ActivityLog.objects.create(
-                log="Online disclaimer deleted; archive created for user {} {}".format(
-                    self.user.first_name, self.user.last_name
-                )
-            )
-        super().delete(using, keep_parents)
+    def needs_archive(self, expiry):
+        return self.date > expiry or bool(self.date_updated and self.date_updated > expiry)
+
+    def cache_keys(self, current_version=None):
+        return [
+            active_disclaimer_cache_key(self.user, current_version),
+            active_online_disclaimer_cache_key(self.user, current_version),
+            expired_disclaimer_cache_key(self.user),
+        ]
+
+    def archived_disclaimer(self):
+        return ArchivedDisclaimer(**self._archive_field_values(exclude=['id', 'user_id']))
+
+    def archived_log(self):
+        return "Online disclaimer deleted; archive created for user {} {}".format(
+            self.user.first_name, self.user.last_name
+        )
 
 
 @has_readonly_fields
@@ -391,19 +453,18 @@ class NonRegisteredDisclaimer(BaseOnlineDisclaimer):
             self.version,
             self.date.astimezone(pytz.timezone('Europe/London')).strftime('%d %b %Y, %H:%M'))
 
-    def delete(self, using=None, keep_parents=False):
-        expiry = timezone.now() - relativedelta(years=6)
-        if self.date > expiry:
-            ignore_fields = ['id', '_state', 'first_name', 'last_name', 'email', 'user_uuid']
-            fields = {key: value for key, value in self.__dict__.items() if key not in ignore_fields and not key.endswith('_oldval')}
-
-            ArchivedDisclaimer.objects.create(name='{} {}'.format(self.first_name, self.last_name), **fields)
-            ActivityLog.objects.create(
-                log="Event disclaimer < 6years old deleted; archive created for user {} {}".format(
-                    self.first_name, self.last_name
-                )
+    def archived_disclaimer(self):
+        return ArchivedDisclaimer(
+            name='{} {}'.format(self.first_name, self.last_name),
+            **self._archive_field_values(
+                exclude=['id', 'first_name', 'last_name', 'email', 'user_uuid']
             )
-        super().delete(using=using, keep_parents=keep_parents)
+        )
+
+    def archived_log(self):
+        return "Event disclaimer < 6years old deleted; archive created for user {} {}".format(
+            self.first_name, self.last_name
+        )
 
 
 class ArchivedDisclaimer(BaseOnlineDisclaimer):
@@ -414,6 +475,10 @@ class ArchivedDisclaimer(BaseOnlineDisclaimer):
     date_archived = models.DateTimeField(default=timezone.now)
     event_date = models.DateField(blank=True, null=True)
 
+    def needs_archive(self, expiry):
+        # already archived
+        return False
+
     def __str__(self):
         return '{} - V{} - {} (archived {})'.format(
             self.name,
@@ -452,12 +517,16 @@ class UserProfile(models.Model):
 
 # CACHING
 
-def active_disclaimer_cache_key(user):
-    return f'user_{user.id}_active_disclaimer_v{DisclaimerContent.current_version()}'
+def active_disclaimer_cache_key(user, current_version=None):
+    if current_version is None:
+        current_version = DisclaimerContent.current_version()
+    return f'user_{user.id}_active_disclaimer_v{current_version}'
 
 
-def active_online_disclaimer_cache_key(user):
-    return f'user_{user.id}_active_online_disclaimer_v{DisclaimerContent.current_version()}'
+def active_online_disclaimer_cache_key(user, current_version=None):
+    if current_version is None:
+        current_version = DisclaimerContent.current_version()
+    return f'user_{user.id}_active_online_disclaimer_v{current_version}'
 
 
 def expired_disclaimer_cache_key(user):
@@ -516,3 +585,23 @@ def has_active_data_privacy_agreement(user):
     else:
         has_active_agreement = bool(cache.get(key))
     return has_active_agreement
+
+
+USER_INITIALS_CACHE_KEY = "user_first_name_initials"
+
+
+def get_first_name_initials(queryset=None):
+    """
+    Return the set of (lowercased) first letters of users' first names.  The
+    initials for all users are cached and cleared when a user is saved or deleted.
+    """
+    if queryset is None:
+        initials = cache.get(USER_INITIALS_CACHE_KEY)
+        if initials is None:
+            initials = get_first_name_initials(User.objects.all())
+            cache.set(USER_INITIALS_CACHE_KEY, initials, timeout=60 * 60)
+        return initials
+    initials = queryset.annotate(initial=Lower(Left("first_name", 1))) \
+        .order_by().values_list("initial", flat=True).distinct()
+    return {initial for initial in initials if initial}
+
@@ -23,6 +23,7 @@ from accounts.management.commands.export_encrypted_disclaimers import EmailMessa
 from accounts.models import ArchivedDisclaimer, DisclaimerContent, NonRegisteredDisclaimer, OnlineDisclaimer
 from activitylog.models import ActivityLog
 from booking.models import Booking
+from common.encryption import DecryptionError
 from common.tests.helpers import TestSetupMixin, PatchRequestMixin
 
 
@@ -143,6 +144,45 @@ def test_export_encrypted_disclaimers(settings, tmp_path):
     assert email.to == [settings.SUPPORT_EMAIL]
 
 
+
+@pytest.mark.django_db
+def test_export_and_import_encrypted_disclaimers(settings, tmp_path):
+    settings.LOG_FOLDER=tmp_path
+    content = baker.make(DisclaimerContent, version=None, disclaimer_terms="Terms, with a comma")
+    disclaimers = baker.make(
+        OnlineDisclaimer, version=content.version, address="1 Test Rd,\nTest Town", _quantity=5
+    )
+    content_count = DisclaimerContent.objects.count()
+    bu_file = settings.LOG_FOLDER / 'test_file.bu'
+    management.call_command('export_encrypted_disclaimers', file=bu_file, chunk_size=2)
+    assert "5 records" in mail.outbox[0].body
+    assert b"Test Town" not in bu_file.read_bytes()
+
+    OnlineDisclaimer.objects.filter(id__in=[disclaimer.id for disclaimer in disclaimers[:3]]).delete()
+    management.call_command('import_disclaimer_data', file=bu_file, encrypted=True, batch_size=2)
+    assert OnlineDisclaimer.objects.count() == 5
+    for disclaimer in disclaimers:
+        restored = OnlineDisclaimer.objects.get(user=disclaimer.user)
+        assert restored.address == "1 Test Rd,\nTest Town"
+        assert restored.name == disclaimer.name
+        assert restored.dob == disclaimer.dob
+        assert restored.date == disclaimer.date
+    assert DisclaimerContent.objects.count() == content_count
+
+
+@pytest.mark.django_db
+def test_import_truncated_encrypted_disclaimers(settings, tmp_path):
+    settings.LOG_FOLDER=tmp_path
+    content = baker.make(DisclaimerContent, version=None)
+    disclaimers = baker.make(OnlineDisclaimer, version=content.version, _quantity=4)
+    bu_file = settings.LOG_FOLDER / 'test_file.bu'
+    management.call_command('export_encrypted_disclaimers', file=bu_file, chunk_size=2)
+    bu_file.write_bytes(bu_file.read_bytes()[:-10])
+
+    OnlineDisclaimer.objects.all().delete()
+    with pytest.raises(DecryptionError):
+        management.call_command('import_disclaimer_data', file=bu_file, encrypted=True)
+
 class ImportDisclaimersTests(TestCase):
 
     def call_import_disclaimers(self):
@@ -14,7 +14,7 @@ from django.utils import timezone
 
 from accounts.models import AccountBan, CookiePolicy, DataPrivacyPolicy, DisclaimerContent, SignedDataPrivacy, \
     OnlineDisclaimer, NonRegisteredDisclaimer, ArchivedDisclaimer, has_active_data_privacy_agreement, \
-    active_data_privacy_cache_key
+    active_data_privacy_cache_key, active_online_disclaimer_cache_key
 from common.tests.helpers import make_data_privacy_agreement
 
 
@@ -288,6 +288,34 @@ class DisclaimerModelTests(TestCase):
         self.assertFalse(ArchivedDisclaimer.objects.exists())
 
 
+    def test_purge_disclaimers(self):
+        recent = baker.make(OnlineDisclaimer, _quantity=3)
+        old = baker.make(OnlineDisclaimer, date=timezone.now() - timedelta(2200), _quantity=2)
+        non_registered = baker.make(NonRegisteredDisclaimer, first_name='Test', last_name='User')
+        for disclaimer in recent + old:
+            cache.set(active_online_disclaimer_cache_key(disclaimer.user), True)
+
+        with self.assertNumQueries(12):
+            # ids, current disclaimer version, then for each chunk: savepoint,
+            # fetch, archives and activity logs (only for the first chunk with the
+            # recent disclaimers), delete, release savepoint
+            assert OnlineDisclaimer.objects.purge(chunk_size=3) == 5
+        assert not OnlineDisclaimer.objects.exists()
+        # only disclaimers < 6yrs old are archived
+        assert sorted(ArchivedDisclaimer.objects.values_list("name", flat=True)) == sorted(
+            disclaimer.name for disclaimer in recent
+        )
+        for disclaimer in recent + old:
+            assert cache.get(active_online_disclaimer_cache_key(disclaimer.user)) is None
+
+        assert NonRegisteredDisclaimer.objects.purge() == 1
+        assert ArchivedDisclaimer.objects.filter(name="Test User", date=non_registered.date).exists()
+        assert ArchivedDisclaimer.objects.count() == 4
+
+        # archived disclaimers aren't archived again
+        assert ArchivedDisclaimer.objects.purge() == 4
+        assert not ArchivedDisclaimer.objects.exists()
+
 class DataPrivacyPolicyModelTests(TestCase):
 
     def test_no_policy_version(self):
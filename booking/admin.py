@@ -482,6 +482,9 @@ class TicketBookingAdmin(admin.ModelAdmin):
 class TicketedEventAdmin(admin.ModelAdmin):
     list_display = ('name', 'date', 'tickets_left')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_tickets_booked()
+
 
 class TicketAdmin(admin.ModelAdmin):
     list_display = (
@@ -518,7 +521,7 @@ class EventVoucherAdmin(admin.ModelAdmin):
     ev_types.short_description = 'Event types'
 
     def times_used(self, obj):
-        return UsedEventVoucher.objects.filter(voucher=obj).count()
+        return obj.times_used
 
 
 class BlockVoucherAdmin(admin.ModelAdmin):
@@ -532,7 +535,7 @@ class BlockVoucherAdmin(admin.ModelAdmin):
     get_block_types.short_description = 'Block types'
 
     def times_used(self, obj):
-        return UsedBlockVoucher.objects.filter(voucher=obj).count()
+        return obj.times_used
 
 
 class UsedEventVoucherAdmin(admin.ModelAdmin):
@@ -1,7 +1,10 @@
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import send_mail
 from django.core.mail.message import EmailMultiAlternatives
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from django.template.loader import get_template
 
 from activitylog.models import ActivityLog
@@ -26,32 +29,70 @@ def send_support_email(e, module_name="", extra_subject=""):
         )
 
 
+# a space becoming available is only emailed to the waiting list once in this
+# many seconds, so several cancellations for the same event in quick succession
+# don't each send an email to everyone on the list
+WAITING_LIST_EMAIL_DEBOUNCE_SECONDS = 120
+
+
+def waiting_list_email_cache_key(event):
+    return f"waiting_list_email_sent_{event.id}"
+
+
+def _get_auto_book_user(event, user_emails):
+    """
+    Find the first user in settings.AUTO_BOOK_EMAILS who is on the waiting list
+    (user_emails) and isn't already booked for the event.  Auto-book users who
+    already have an open booking are removed from user_emails and from the
+    waiting list.
+    Returns the user (or None) and whether they have a cancelled booking for
+    the event that needs to be reopened.
+    """
+    auto_book_emails = [email for email in settings.AUTO_BOOK_EMAILS if email in user_emails]
+    if not auto_book_emails:
+        return None, False
+
+    auto_book_users = {}
+    for user in User.objects.filter(email__in=auto_book_emails).annotate(
+        booking_status=Subquery(
+            Booking.objects.filter(event=event, user=OuterRef("pk")).values("status")[:1]
+        )
+    ).order_by("id"):
+        auto_book_users.setdefault(user.email, user)
+
+    already_booked = []
+    auto_book_user = None
+    for email in auto_book_emails:
+        user = auto_book_users.get(email)
+        if user is None:
+            continue
+        if user.booking_status == 'OPEN':
+            already_booked.append(user)
+            user_emails.remove(user.email)
+        else:
+            auto_book_user = user
+            break
+
+    if already_booked:
+        WaitingListUser.objects.filter(user__in=already_booked, event=event).delete()
+    if auto_book_user is None:
+        return None, False
+    return auto_book_user, auto_book_user.booking_status is not None
+
+
 def send_waiting_list_email(
     event, users, host="http://booking.thewatermelonstudio.co.uk"
 ):
+    """
+    Auto-book the first available auto-book user on the waiting list, or if
+    there isn't one, email everyone on the waiting list (unless they've been
+    emailed about this event in the last WAITING_LIST_EMAIL_DEBOUNCE_SECONDS).
+    Returns True if an email was sent.
+    """
     ev_type = 'classes' if event.event_type.event_type == 'CL' else 'events'
     user_emails = [user.email for user in users]
 
-    auto_book_user = None
-    already_booked_cancelled = False
-    for email in settings.AUTO_BOOK_EMAILS:
-        if email in user_emails.copy():
-            auto_book_user = User.objects.get(email=email)
-            already_booked = Booking.objects.filter(
-                event=event, user=auto_book_user
-            )
-            if already_booked.exists():
-                if already_booked[0].status == 'OPEN':
-                    user_emails.remove(auto_book_user.email)
-                    waiting_list_user = WaitingListUser.objects.filter(
-                        user=auto_book_user, event=event
-                    ).delete()
-                    auto_book_user = None
-                else:
-                    already_booked_cancelled = True
-
-            if auto_book_user:
-                break
+    auto_book_user, already_booked_cancelled = _get_auto_book_user(event, user_emails)
 
     if auto_book_user:
         # retrieve event from db again to refresh cached properties
@@ -85,11 +126,7 @@ def send_waiting_list_email(
         )
         msg.send(fail_silently=False)
 
-
-        waiting_list_user = WaitingListUser.objects.get(
-                user=auto_book_user, event=event
-            )
-        waiting_list_user.delete()
+        WaitingListUser.objects.filter(user=auto_book_user, event=event).delete()
         ActivityLog.objects.create(
             log='Booking autocreated for User {}, {}'.format(
                 auto_book_user.username, event
@@ -100,7 +137,11 @@ def send_waiting_list_email(
             'for {}'.format(auto_book_user.username, event)
         )
 
-    elif user_emails:
+        return True
+
+    elif user_emails and cache.add(
+        waiting_list_email_cache_key(event), True, WAITING_LIST_EMAIL_DEBOUNCE_SECONDS
+    ):
         # only send the waiting list email if we didn't autobook
         # check user emails in case the autobook user was already booked and
         # was the only one on the waiting list
@@ -119,4 +160,47 @@ def send_waiting_list_email(
             ),
             "text/html"
         )
-        msg.send(fail_silently=False)
+        try:
+            msg.send(fail_silently=False)
+        except Exception:
+            # not sent, so don't hold back the next one
+            cache.delete(waiting_list_email_cache_key(event))
+            raise
+        return True
+
+    return False
+
+
+def notify_waiting_list(
+    event, host="http://booking.thewatermelonstudio.co.uk", source="waiting list"
+):
+    """
+    Let the waiting list for an event know that a space has become available
+    (see send_waiting_list_email).  This is done once the current transaction
+    is committed, so the email isn't sent for a cancellation that's rolled back.
+    Outside a transaction (the callers don't currently open one) it's sent
+    immediately, so it's still sent within the cancelling request.  Errors are
+    emailed to support, with source in the subject.
+    """
+    transaction.on_commit(lambda: _notify_waiting_list(event, host, source))
+
+
+def _notify_waiting_list(event, host, source):
+    waiting_list_users = list(
+        WaitingListUser.objects.filter(event=event).select_related("user")
+    )
+    if not waiting_list_users:
+        return
+    try:
+        if send_waiting_list_email(
+            event, [wluser.user for wluser in waiting_list_users], host=host
+        ):
+            ActivityLog.objects.create(
+                log='Waiting list email sent to user(s) {} for event {}'.format(
+                    ', '.join([wluser.user.username for wluser in waiting_list_users]),
+                    event
+                )
+            )
+    except Exception as e:
+        # send mail to tech support with Exception
+        send_support_email(e, __name__, f"{source} - waiting list email")
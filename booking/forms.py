@@ -152,7 +152,8 @@ def get_quantity_choices(ticketed_event, ticket_booking):
         tickets_left_this_booking = ticketed_event.tickets_left() + \
                                     current_tickets
     else:
-        tickets_left_this_booking = ticketed_event.tickets_left()
+        tickets_left_this_booking = ticketed_event.tickets_left() + \
+                                    ticket_booking.tickets_held()
 
     if ticketed_event.max_ticket_purchase:
         if tickets_left_this_booking > ticketed_event.max_ticket_purchase:
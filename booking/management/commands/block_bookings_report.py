@@ -13,123 +13,153 @@ payment, in which case it won't be cancelled and won't count towards the block
 which it probably should
 If paid, check that it also has an associated paypal txn id; if not, it's likely
 been unassigned by an unidentified bug
+
+Active blocks, the bookings made without them and their paypal transactions
+are each fetched in a single query, and support get one summary email covering
+all users with issues
 '''
+from collections import defaultdict
+
 from django.conf import settings
 from django.core.mail import send_mail
+from django.db.models import Exists, OuterRef
 
 from django.core.management.base import BaseCommand
-from django.core import management
 
 from booking.models import Block, Booking
 from activitylog.models import ActivityLog
 from payments.models import PaypalBookingTransaction
 
+
+def _plural(count, singular, plural):
+    return singular if count == 1 else plural
+
+
 class Command(BaseCommand):
     help = 'run reports on users with active blocks'
 
-    def handle(self, *args, **options):
-
-        active_blocks = [
-            block for block in Block.objects.all() if block.active_block()
-        ]
+    def get_bookings_without_block(self, active_blocks):
+        """
+        Return a dict of block: [bookings] for open, non-free bookings made
+        without a block since the start of an active block of the same class
+        type for the same user
+        """
+        blocks_by_user_and_subtype = defaultdict(list)
+        for block in active_blocks:
+            blocks_by_user_and_subtype[
+                (block.user_id, block.block_type.event_type.subtype)
+            ].append(block)
+
+        active_block_for_booking = Block.objects.filter(
+            id__in=[block.id for block in active_blocks],
+            user_id=OuterRef("user_id"),
+            block_type__event_type__subtype=OuterRef("event__event_type__subtype"),
+            start_date__lte=OuterRef("date_booked"),
+        )
+        bookings = Booking.objects.filter(
+            Exists(active_block_for_booking),
+            block__isnull=True, free_class=False, status='OPEN',
+        ).select_related("event__event_type").order_by("id")
+
+        bookings_by_block = defaultdict(list)
+        for booking in bookings:
+            for block in blocks_by_user_and_subtype[
+                (booking.user_id, booking.event.event_type.subtype)
+            ]:
+                if booking.date_booked >= block.start_date:
+                    bookings_by_block[block].append(booking)
+        return bookings_by_block
 
-        blocks_with_issues = []
+    def handle(self, *args, **options):
+        active_blocks = list(
+            Block.objects.active().select_related("user", "block_type__event_type")
+        )
+        bookings_by_block = self.get_bookings_without_block(active_blocks)
+
+        paid_booking_ids = {
+            booking.id for bookings in bookings_by_block.values()
+            for booking in bookings if booking.paid
+        }
+        paid_with_paypal_ids = set(
+            PaypalBookingTransaction.objects.filter(
+                booking_id__in=paid_booking_ids, transaction_id__isnull=False
+            ).values_list("booking_id", flat=True)
+        )
+
+        email_sections = []
+        activity_logs = []
         for block in active_blocks:
+            bookings_without_block = bookings_by_block.get(block)
+            if not bookings_without_block:
+                continue
             block_subtype = block.block_type.event_type.subtype
 
-            open_user_bookings_since_block_start = Booking.objects.filter(
-                user=block.user, date_booked__gte=block.start_date,
-                status='OPEN', event__event_type__subtype=block_subtype
+            self.stdout.write(
+                'User {} ({}) has {} booking{} made for class '
+                'type {} without using the active block {}'.format(
+                    block.user.username, block.user.id,
+                    len(bookings_without_block),
+                    _plural(len(bookings_without_block), '', 's'),
+                    block_subtype, block.id
+                )
             )
 
-            bookings_without_block = [
-                booking for booking in open_user_bookings_since_block_start
-                if booking.block == None and not booking.free_class
+            unpaid_bookings = [
+                str(booking.id) for booking in bookings_without_block if
+                not booking.paid or not booking.payment_confirmed
             ]
-
-            if bookings_without_block:
-                blocks_with_issues.append(block.id)
-
+            paid_bookings = [
+                str(booking.id) for booking in bookings_without_block if
+                booking.paid
+            ]
+            paid_with_paypal = [
+                str(booking.id) for booking in bookings_without_block if
+                booking.id in paid_with_paypal_ids
+            ]
+            if unpaid_bookings:
                 self.stdout.write(
-                    'User {} ({}) has {} booking{} made for class '
-                    'type {} without using the active block {}'.format(
-                        block.user.username, block.user.id,
-                        len(bookings_without_block), ''
-                        if len(bookings_without_block) == 1 else 's',
-                        block_subtype, block.id
+                    '{} booking{} unpaid or not marked as '
+                    'payment_confirmed (ids {})'.format(
+                        len(unpaid_bookings),
+                        _plural(len(unpaid_bookings), ' is', 's are'),
+                        ', '.join(unpaid_bookings)
                     )
                 )
-
-                unpaid_bookings = sorted([
-                    str(booking.id) for booking in bookings_without_block if
-                    not booking.paid or not booking.payment_confirmed
-                ])
-                paid_booking_ids = sorted([
-                    booking.id for booking in bookings_without_block if
-                    booking.paid
-                ])
-                paid_bookings = sorted([
-                    str(id) for id in paid_booking_ids
-                ])
-
-                ppbs = PaypalBookingTransaction.objects.filter(
-                    booking_id__in=paid_booking_ids
-                )
-                paid_with_paypal = [str(ppb.booking_id) for ppb in ppbs if
-                                    ppb.transaction_id is not None]
-                if unpaid_bookings:
-                    self.stdout.write(
-                        '{} booking{} unpaid or not marked as '
-                        'payment_confirmed (ids {})'.format(
-                            len(unpaid_bookings),
-                            ' is' if len(unpaid_bookings) == 1 else 's are',
-                            ', '.join(unpaid_bookings)
-                        )
-                    )
-                if paid_bookings:
-                    self.stdout.write(
-                        '{} booking{} paid (ids {})'.format(
-                            len(paid_bookings),
-                            ' is' if len(paid_bookings) == 1 else 's are',
-                            ', '.join(paid_bookings)
-                        )
-                    )
-                if paid_with_paypal:
-                    self.stdout.write(
-                        'Paid booking ids that have been paid directly with '
-                        'paypal: {}'.format(
-                            ', '.join(paid_with_paypal)
-                        )
+            if paid_bookings:
+                self.stdout.write(
+                    '{} booking{} paid (ids {})'.format(
+                        len(paid_bookings),
+                        _plural(len(paid_bookings), ' is', 's are'),
+                        ', '.join(paid_bookings)
                     )
-
-                send_mail('{} Block issues report for user {}'.format(
-                    settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, block.user.username),
-                    'Possible issues for user {block_user}: \n'
-                    'Has block: {blockstr} (id {blockid})\n'
-                    '{num_unpaid} unpaid/unconfirmed bookings booked since '
-                    'the block start date but not using block: '
-                    'ids {unpaid_ids}\n'
-                    '{num_paid} paid bookings booked since the block start '
-                    'date but not using block: ids {paid_ids}\n'
-                    'Paid bookings that were paid directly with paypal: '
-                    'ids {paypal_paid_ids}\n'
-                    'Check bookings for the users associated with these '
-                    ' blocks'.format(
-                        block_user=block.user.username,
-                        blockstr=block, blockid=block.id,
-                        num_unpaid=len(unpaid_bookings),
-                        unpaid_ids=',' .join(unpaid_bookings),
-                        num_paid=len(paid_bookings),
-                        paid_ids=', '.join(paid_bookings),
-                        paypal_paid_ids=', '.join(paid_with_paypal)
-                    ),
-                    settings.DEFAULT_FROM_EMAIL,
-                    [settings.SUPPORT_EMAIL],
-                    fail_silently=True
+                )
+            if paid_with_paypal:
+                self.stdout.write(
+                    'Paid booking ids that have been paid directly with '
+                    'paypal: {}'.format(', '.join(paid_with_paypal))
                 )
 
-
-                ActivityLog.objects.create(
+            email_sections.append(
+                'Possible issues for user {block_user}: \n'
+                'Has block: {blockstr} (id {blockid})\n'
+                '{num_unpaid} unpaid/unconfirmed bookings booked since '
+                'the block start date but not using block: '
+                'ids {unpaid_ids}\n'
+                '{num_paid} paid bookings booked since the block start '
+                'date but not using block: ids {paid_ids}\n'
+                'Paid bookings that were paid directly with paypal: '
+                'ids {paypal_paid_ids}\n'.format(
+                    block_user=block.user.username,
+                    blockstr=block, blockid=block.id,
+                    num_unpaid=len(unpaid_bookings),
+                    unpaid_ids=', '.join(unpaid_bookings),
+                    num_paid=len(paid_bookings),
+                    paid_ids=', '.join(paid_bookings),
+                    paypal_paid_ids=', '.join(paid_with_paypal)
+                )
+            )
+            activity_logs.append(
+                ActivityLog(
                     log='Possible issues with bookings for user {}. Check '
                         'bookings since {} block ({}) start that are not '
                         'assigned to the block (support notified by '
@@ -137,6 +167,23 @@ class Command(BaseCommand):
                         block.user.username, block_subtype, block.id
                     )
                 )
+            )
 
-        if not blocks_with_issues:
+        if not email_sections:
             self.stdout.write('No issues to report for users with blocks')
+            return
+
+        send_mail(
+            '{} Block issues report'.format(settings.ACCOUNT_EMAIL_SUBJECT_PREFIX),
+            '{} active block{} with bookings made since the block start date '
+            'but not using the block:\n\n{}\n'
+            'Check bookings for the users associated with these '
+            'blocks'.format(
+                len(email_sections), _plural(len(email_sections), '', 's'),
+                '\n'.join(email_sections)
+            ),
+            settings.DEFAULT_FROM_EMAIL,
+            [settings.SUPPORT_EMAIL],
+            fail_silently=True
+        )
+        ActivityLog.objects.bulk_create(activity_logs)
@@ -26,8 +26,9 @@ from django.core.mail import send_mail
 from django.template.loader import get_template
 from django.core.management.base import BaseCommand
 
-from booking.models import Booking, WaitingListUser
-from booking.email_helpers import send_waiting_list_email
+from booking.models import Booking
+from booking.email_helpers import notify_waiting_list
+from payments.helpers import reconcile_paypal_bookings
 from common.management import write_command_name
 from activitylog.models import ActivityLog
 
@@ -68,7 +69,7 @@ class Command(BaseCommand):
         ).exclude(
             # exclude bookings with checkout time within past 5 mins
             checkout_time__gte=timezone.now() - timedelta(seconds=checkout_buffer_seconds)
-        )
+        ).select_related("event", "user")
         for booking in bookings_qset:
             if (booking.event.date - timedelta(hours=booking.event.cancellation_period)) < now:
                 if booking.warning_sent:
@@ -92,7 +93,15 @@ class Command(BaseCommand):
         bookings_for_studio_email = []
         cancelled_count = 0
         send_waiting_list = set()
-        for booking in self.get_bookings_to_cancel(now):
+        # a booking can meet more than one of the cancellation conditions; only cancel it once
+        bookings_to_cancel = list(dict.fromkeys(self.get_bookings_to_cancel(now)))
+        # Double-check none of the bookings have been paid by paypal
+        unpaid_bookings = reconcile_paypal_bookings(bookings_to_cancel)
+        already_paid = set(bookings_to_cancel) - set(unpaid_bookings)
+        if already_paid:
+            self.stdout.write(f"Bookings set to paid: {', '.join(str(bk.id) for bk in already_paid)}")
+
+        for booking in unpaid_bookings:
             ctx = {
                   'booking': booking,
                   'event': booking.event,
@@ -128,20 +137,7 @@ class Command(BaseCommand):
             send_waiting_list.add(booking.event)
 
         for event in send_waiting_list:
-            waiting_list_users = WaitingListUser.objects.filter(event=event)
-            if waiting_list_users.exists():
-                send_waiting_list_email(
-                    event, [user.user for user in waiting_list_users]
-                )
-                ActivityLog.objects.create(
-                    log='Waiting list email sent to user(s) {} for '
-                    'event {}'.format(
-                        ', '.join(
-                            [wluser.user.username for wluser in waiting_list_users]
-                        ),
-                        event
-                    )
-                )
+            notify_waiting_list(event, source="cancel_unpaid_bookings")
 
         self.stdout.write(f"{cancelled_count} bookings cancelled")
 
@@ -31,6 +31,7 @@ from django.core.management.base import BaseCommand
 
 from booking.models import TicketedEvent
 from booking.email_helpers import send_support_email
+from payments.helpers import reconcile_paypal_ticket_bookings
 from activitylog.models import ActivityLog
 from common.management import write_command_name
 
@@ -72,7 +73,7 @@ class Command(BaseCommand):
             ).exclude(
                 # exclude bookings with checkout time within past 5 mins
                 checkout_time__gte=timezone.now() - timedelta(seconds=checkout_buffer_seconds)
-            )
+            ).select_related("user")
 
             # if payment due date is past and warning has been sent, cancel
             if event.payment_due_date and event.payment_due_date < now:
@@ -92,7 +93,16 @@ class Command(BaseCommand):
 
         ticket_bookings_for_studio_email = [] if settings.SEND_ALL_STUDIO_EMAILS else None
 
-        for ticket_booking in self.get_ticket_bookings_to_cancel(now):
+        ticket_bookings_to_cancel = list(self.get_ticket_bookings_to_cancel(now))
+        # Double-check none of the ticket bookings have been paid by paypal
+        unpaid_ticket_bookings = reconcile_paypal_ticket_bookings(ticket_bookings_to_cancel)
+        already_paid = set(ticket_bookings_to_cancel) - set(unpaid_ticket_bookings)
+        if already_paid:
+            self.stdout.write(
+                f"Ticket bookings set to paid: {', '.join(tb.booking_reference for tb in already_paid)}"
+            )
+
+        for ticket_booking in unpaid_ticket_bookings:
             ctx = {
                   'ticket_booking': ticket_booking,
                   'ticketed_event': ticket_booking.ticketed_event,
@@ -3,6 +3,8 @@ Check for unpaid ticket bookings without 'purchase confirmed' and delete if
 more than 1 hr since booking
 No need to email users since this is just cleaning up aborted bookings
 ('confirm purchase' not clicked during booking process)
+Also deletes expired ticket reservations; these no longer hold any tickets,
+so this is just to keep the reservations table small
 '''
 import logging
 from datetime import timedelta
@@ -10,7 +12,7 @@ from datetime import timedelta
 from django.utils import timezone
 from django.core.management.base import BaseCommand
 
-from booking.models import TicketBooking
+from booking.models import TicketBooking, TicketReservation
 from common.management import write_command_name
 from activitylog.models import ActivityLog
 
@@ -26,29 +28,35 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         write_command_name(self, __file__)
-        # get relevant ticket_bookings
-        bookings_to_delete = TicketBooking.objects.filter(
-            purchase_confirmed=False,
-            paid=False,
-            date_booked__lt=timezone.now() - timedelta(hours=1),
+        now = timezone.now()
+        # get relevant ticket_bookings; uses the partial index on unconfirmed
+        # ticket bookings
+        bookings_to_delete = list(
+            TicketBooking.objects.filter(
+                purchase_confirmed=False,
+                paid=False,
+                date_booked__lt=now - timedelta(hours=1),
+            ).select_related("ticketed_event", "user")
         )
-
-        for ticket_booking in bookings_to_delete:
-
-            ticket_booking.delete()
-
-            ActivityLog.objects.create(
-                log='Aborted (purchase unconfirmed) ticket booking ref {} '
-                    'for event {}, user {} automatically deleted '
-                    'after 1 hr'.format(
-                    ticket_booking.booking_reference,
-                    ticket_booking.ticketed_event,
-                    ticket_booking.user.username
-                )
-            )
-
         if bookings_to_delete:
-            # send single mail to Studio
+            # tickets and reservations are deleted with their bookings
+            TicketBooking.objects.filter(
+                id__in=[ticket_booking.id for ticket_booking in bookings_to_delete]
+            ).delete()
+            ActivityLog.objects.bulk_create(
+                [
+                    ActivityLog(
+                        log='Aborted (purchase unconfirmed) ticket booking ref {} '
+                            'for event {}, user {} automatically deleted '
+                            'after 1 hr'.format(
+                            ticket_booking.booking_reference,
+                            ticket_booking.ticketed_event,
+                            ticket_booking.user.username
+                        )
+                    )
+                    for ticket_booking in bookings_to_delete
+                ]
+            )
             self.stdout.write(
                 'Aborted ticket booking refs {} deleted'.format(
                     ', '.join(
@@ -59,3 +67,7 @@ class Command(BaseCommand):
             )
         else:
             self.stdout.write('No unconfirmed ticket bookings to delete')
+
+        expired_count, _ = TicketReservation.objects.filter(expires_at__lt=now).delete()
+        if expired_count:
+            self.stdout.write(f'{expired_count} expired ticket reservation(s) deleted')
@@ -20,12 +20,9 @@ from django.template.loader import get_template
 from django.core.management.base import BaseCommand
 from django.db.models import Q
 
-from paypal.standard.ipn.models import PayPalIPN
-from paypal.standard.models import ST_PP_COMPLETED
-
 from booking.models import Booking, Event
 from activitylog.models import ActivityLog
-from payments.models import PaypalBookingTransaction
+from payments.helpers import reconcile_paypal_bookings
 from common.management import write_command_name
 
 
@@ -68,7 +65,7 @@ def get_bookings():
         paid=False,
         payment_confirmed=False,
         warning_sent=False,
-        ).exclude(checkout_time__gte=checkout_cutoff)
+        ).exclude(checkout_time__gte=checkout_cutoff).select_related("event__event_type", "user")
 
 
 def send_warning_email(self, upcoming_bookings):
@@ -125,28 +122,14 @@ def _make_paid(booking):
 
 
 def check_paypal(bookings):
-    bookings_to_warn = []
+    bookings_to_check = []
     for booking in bookings:
         if booking.block:
             # this should never happen because the model save method should always make
             # bookings with blocks paid
             _make_paid(booking)
         else:
-            pptxns = PaypalBookingTransaction.objects.filter(booking=booking)
-            if not pptxns.exists():
-                # all bookings that went through paypal should have a transaction associated
-                # but if it doesn't, we definitely need to warn
-                bookings_to_warn.append(booking)
-            else:
-                pptxn = pptxns.order_by("-transaction_id").first()
-                # It has at least one matching completed PayPalIPN associated
-                ppipns = PayPalIPN.objects.filter(invoice=pptxn.invoice_id, payment_status=ST_PP_COMPLETED)
-                if ppipns.exists():
-                    ppipn = ppipns.first()
-                    _make_paid(booking)
-                    # ensure the transaction ID is set
-                    pptxn.transaction_id = ppipn.txn_id
-                    pptxn.save()
-                else:  # pragma: no cover
-                    bookings_to_warn.append(booking)
-    return bookings_to_warn
+            bookings_to_check.append(booking)
+    # all bookings that went through paypal should have a transaction associated, and
+    # a completed IPN if they were paid; any that don't, we need to warn
+    return reconcile_paypal_bookings(bookings_to_check)
@@ -2,10 +2,8 @@
 Find no-shows
 '''
 from calendar import monthrange
-from collections import Counter
 from datetime import timedelta
 from django.conf import settings
-from django.contrib.auth.models import User
 from django.core.mail import send_mail
 from django.core.management.base import BaseCommand
 from django.utils import timezone
@@ -23,32 +21,24 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         days = options["days"]
-        no_shows = Booking.objects.filter(
-            event__date__gte=timezone.now() - timedelta(days=days),
-            event__date__lt=timezone.now(), status="OPEN", no_show=True,
-            instructor_confirmed_no_show=True, paid=True
-        )
-        no_show_users = no_shows.values_list("user", flat=True)
-        counter = Counter(no_show_users)
+        now = timezone.now()
+        repeat_no_shows = Booking.objects.confirmed_no_shows(
+            now - timedelta(days=days), now
+        ).repeat_no_shows(min_no_shows=3)
 
         header_message = f"==========Users with more than 2 no shows in past {days} days=========="
         email_message = [f"Date run: {timezone.now().strftime('%d %b %Y, %H:%M')} UTC"]
         self.stdout.write(header_message)
-        repeat_no_shows = [
-            (user_id, count) for (user_id, count) in counter.most_common() if count > 2
-        ]
         if repeat_no_shows:
             email_message.append(header_message)
         else:
             email_message.append("No repeated no-shows found")
 
-        for user_id, count in repeat_no_shows:
-            user = User.objects.get(id=user_id)
-            user_message = f"{count}: {user.first_name} {user.last_name} - (id {user_id})"
+        for user, count in repeat_no_shows:
+            user_message = f"{count}: {user.first_name} {user.last_name} - (id {user.id})"
             self.stdout.write(user_message)
             email_message.append(user_message)
-            bookings = no_shows.filter(user_id=user_id)
-            for booking in bookings:
+            for booking in user.no_show_bookings:
                 booking_message = str(booking.event)
                 self.stdout.write(booking_message)
                 email_message.append(booking_message)
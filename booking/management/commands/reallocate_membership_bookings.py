@@ -0,0 +1,69 @@
+'''
+Run every 10 mins
+Reallocate bookings for user memberships that have been flagged by the stripe
+webhook (subscriptions cancelled or scheduled to cancel)
+
+Each user's memberships are processed in a single transaction, with the user row
+locked so that concurrent runs (or a webhook for the same user) can't reallocate the
+same bookings twice.  Memberships are unflagged in the same transaction, so a failed
+or retried run just picks them up again.
+'''
+import logging
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from booking.models import UserMembership
+from common.management import write_command_name
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Reallocate bookings for memberships flagged for reallocation'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit", type=int, default=None, help="Maximum number of users to process in this run"
+        )
+
+    def handle(self, *args, **options):
+        write_command_name(self, __file__)
+        user_ids = (
+            UserMembership.objects.filter(reallocation_pending=True)
+            .order_by("user_id").values_list("user_id", flat=True).distinct()
+        )
+        if options["limit"]:
+            user_ids = user_ids[:options["limit"]]
+        user_ids = list(user_ids)
+
+        if not user_ids:
+            self.stdout.write("No memberships pending reallocation")
+            return
+
+        reallocated = 0
+        for user_id in user_ids:
+            try:
+                reallocated += self.reallocate_for_user(user_id)
+            except Exception as err:
+                # leave this user's memberships flagged; they'll be retried on the next run
+                logger.error("Error reallocating membership bookings for user %s: %s", user_id, str(err))
+        self.stdout.write(f"Bookings reallocated for {reallocated} membership(s)")
+
+    def reallocate_for_user(self, user_id):
+        with transaction.atomic():
+            # lock the user so only one process reallocates this user's bookings at a time;
+            # skip if another process already has it
+            user = User.objects.select_for_update(skip_locked=True).filter(id=user_id).first()
+            if user is None:
+                return 0
+            # re-fetch pending memberships inside the lock, in case they've already been processed
+            pending = list(
+                UserMembership.objects.filter(user=user, reallocation_pending=True).select_related("membership", "user")
+            )
+            for user_membership in pending:
+                user_membership.reallocate_bookings()
+            UserMembership.objects.filter(id__in=[um.id for um in pending]).update(reallocation_pending=False)
+        return len(pending)
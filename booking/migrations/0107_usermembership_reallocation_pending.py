@@ -0,0 +1,24 @@
+# Generated by Django 5.1.10 on 2026-10-19 04:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0106_usermembership_override_start_date_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usermembership',
+            name='reallocation_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='usermembership',
+            index=models.Index(condition=models.Q(('reallocation_pending', True)), fields=['reallocation_pending'], name='usermembership_realloc_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.10 on 2026-10-19 05:04
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def set_times_used(apps, schema_editor):
+    for voucher_model_name, used_voucher_model_name in [
+        ("EventVoucher", "UsedEventVoucher"), ("BlockVoucher", "UsedBlockVoucher")
+    ]:
+        voucher_model = apps.get_model("booking", voucher_model_name)
+        used_voucher_model = apps.get_model("booking", used_voucher_model_name)
+        uses = used_voucher_model.objects.filter(voucher_id=OuterRef("pk")).order_by().values("voucher_id").annotate(
+            count=Count("id")
+        ).values("count")
+        for voucher in voucher_model.objects.annotate(uses=Coalesce(Subquery(uses), 0)).filter(uses__gt=0):
+            voucher_model.objects.filter(pk=voucher.pk).update(times_used=voucher.uses)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0107_usermembership_reallocation_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basevoucher',
+            name='times_used',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(set_times_used, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.10 on 2026-10-19 05:15
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+VOUCHER_MODELS = ["blockvoucher", "eventvoucher", "stripesubscriptionvoucher"]
+
+
+def check_case_insensitive_duplicate_codes(apps, schema_editor):
+    """
+    The constraints below can't be added if any codes differ only in case.  Codes
+    are used by customers, so rather than renaming any automatically, stop here
+    and list the duplicates so they can be fixed by hand before migrating.
+    """
+    duplicates = []
+    for model_name in VOUCHER_MODELS:
+        model = apps.get_model("booking", model_name)
+        codes = (
+            model.objects.annotate(upper_code=django.db.models.functions.text.Upper("code"))
+            .values("upper_code")
+            .annotate(count=models.Count("id"))
+            .filter(count__gt=1)
+            .values_list("upper_code", flat=True)
+        )
+        for upper_code in codes:
+            matching = model.objects.filter(code__iexact=upper_code).order_by("id").values_list("id", "code")
+            duplicates.append(
+                f"{model._meta.verbose_name}: " + ", ".join(f"{code} (id {pk})" for pk, code in matching)
+            )
+    if duplicates:
+        raise RuntimeError(
+            "Voucher codes must be unique ignoring case; rename or delete these duplicate "
+            "vouchers before running this migration:\n" + "\n".join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0108_basevoucher_times_used'),
+        ('stripe_payments', '0006_stripewebhookevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_case_insensitive_duplicate_codes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='blockvoucher',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('code'), name='blockvoucher_code_upper_unique', violation_error_message='Voucher with this code already exists'),
+        ),
+        migrations.AddConstraint(
+            model_name='eventvoucher',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('code'), name='eventvoucher_code_upper_unique', violation_error_message='Voucher with this code already exists'),
+        ),
+        migrations.AddConstraint(
+            model_name='stripesubscriptionvoucher',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('code'), name='stripesubscriptionvoucher_code_upper_unique', violation_error_message='Voucher with this code already exists'),
+        ),
+    ]
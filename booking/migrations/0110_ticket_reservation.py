@@ -0,0 +1,43 @@
+# Generated by Django 5.1.10 on 2026-10-19 06:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0109_voucher_code_upper_unique'),
+        ('stripe_payments', '0007_invoice_items_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ticketbooking',
+            index=models.Index(condition=models.Q(('paid', False), ('purchase_confirmed', False)), fields=['date_booked'], name='ticketbooking_unconfirmed_idx'),
+        ),
+        migrations.AddField(
+            model_name='ticketreservation',
+            name='ticket_booking',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='booking.ticketbooking'),
+        ),
+        migrations.AddField(
+            model_name='ticketreservation',
+            name='ticketed_event',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticket_reservations', to='booking.ticketedevent'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketreservation',
+            index=models.Index(fields=['ticketed_event', 'expires_at'], name='booking_tic_tickete_e1a455_idx'),
+        ),
+    ]
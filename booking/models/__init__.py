@@ -15,14 +15,17 @@ from .booking_models import (
     UsedBlockVoucher,
     UsedEventVoucher,
     GiftVoucherType,
+    VoucherRedemptionError,
     WaitingListUser,
+    shopping_basket_cache_key,
 )
 from .ticket_booking_models import (
     Ticket,
     TicketBooking,
     TicketBookingError,
     TicketedEvent,
-    TicketedEventWaitingListUser
+    TicketedEventWaitingListUser,
+    TicketReservation,
 )
 from .banner_models import Banner
 from .membership_models import Membership, MembershipItem, UserMembership, StripeSubscriptionVoucher
@@ -46,13 +49,16 @@ __all__ = [
     "UsedBlockVoucher",
     "UsedEventVoucher",
     "GiftVoucherType",
+    "VoucherRedemptionError",
     "WaitingListUser",
+    "shopping_basket_cache_key",
     # ticket booking
     "Ticket",
     "TicketBooking",
     "TicketBookingError",
     "TicketedEvent",
     "TicketedEventWaitingListUser",
+    "TicketReservation",
     # banner
     "Banner",
     # membership
@@ -1,16 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import logging
 import pytz
 
 from decimal import Decimal
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.contrib.auth.models import Group, User
 from django.core.exceptions import ValidationError
 from django.urls import reverse
-from django.db.models.signals import pre_save, post_save
+from django.core.cache import cache
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db.models import Case, Count, Exists, F, OuterRef, Prefetch, Q, Value, When
+from django.db.models.functions import Upper
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.functional import cached_property
@@ -31,6 +35,10 @@ class BlockTypeError(Exception):
     pass
 
 
+class VoucherRedemptionError(Exception):
+    pass
+
+
 class AllowedGroup(models.Model):
     group = models.OneToOneField(Group, on_delete=models.CASCADE)
     description = models.CharField(
@@ -89,6 +97,50 @@ class EventTypeManager(models.Manager):
         return self.get_queryset().filter(hide=False)
 
 
+def voucher_code_cache_key(model, code):
+    code_hash = hashlib.md5(str(code).strip().lower().encode("utf-8")).hexdigest()
+    return f"voucher_code_{model._meta.model_name}_{code_hash}"
+
+
+class VoucherManager(models.Manager):
+    # cached value for codes that don't match a voucher
+    UNKNOWN_CODE = 0
+
+    def get_by_code(self, code):
+        """
+        Return the voucher matching code (case-insensitive); like get(), raises DoesNotExist
+        if there isn't one.
+        The voucher id (or the fact that there's no voucher) for a code is cached, so
+        repeated lookups are by primary key, and repeated invalid codes don't query at all.
+        """
+        code = str(code or "").strip()
+        # same message as get(), which is included in payment error emails
+        does_not_exist = self.model.DoesNotExist(
+            f"{self.model._meta.object_name} matching query does not exist."
+        )
+        if not code:
+            raise does_not_exist
+        key = voucher_code_cache_key(self.model, code)
+        voucher_id = cache.get(key)
+        if voucher_id == self.UNKNOWN_CODE:
+            raise does_not_exist
+        if voucher_id is not None:
+            # check the code too, in case it's been changed since it was cached
+            voucher = self.filter(id=voucher_id, code__iexact=code).first()
+            if voucher is not None:
+                return voucher
+        voucher = self.filter(code__iexact=code).first()
+        cache.set(key, voucher.id if voucher else self.UNKNOWN_CODE, timeout=600)
+        if voucher is None:
+            raise does_not_exist
+        return voucher
+
+
+def clear_voucher_code_cache(sender, instance, **kwargs):
+    # clears cached unknown code if a voucher has been created with the code
+    cache.delete(voucher_code_cache_key(sender, instance.code))
+
+
 class EventType(models.Model):
     TYPE_CHOICE = (
         ('CL', 'Class'),
@@ -227,8 +279,11 @@ class Event(models.Model):
         help_text='Run by external instructor; booking and payment to be made '
                   'with instructor directly')
     email_studio_when_booked = models.BooleanField(default=False)
+    # overwrite_on_add=False so that slugs can be set in advance when events
+    # are bulk created
     slug = AutoSlugField(
-        populate_from=['name', 'date'], max_length=40, unique=True
+        populate_from=['name', 'date'], max_length=40, unique=True,
+        overwrite_on_add=False
     )
     cancelled = models.BooleanField(default=False)
     allow_booking_cancellation = models.BooleanField(default=True)
@@ -358,7 +413,11 @@ class Event(models.Model):
         formatted_date = self.date.astimezone(pytz.timezone('Europe/London')).strftime('%d %b %Y, %H:%M')
         return f"{self.name} - {formatted_date}"
 
-    def save(self, *args, **kwargs):
+    def set_payment_and_booking_options(self):
+        """
+        Make payment and booking options consistent with cost, payment due date etc.
+        Called on save, and also when events are bulk created.
+        """
         if not self.cost:
             self.advance_payment_required = False
             self.payment_open = False
@@ -384,6 +443,8 @@ class Event(models.Model):
             self.payment_open = False
             self.booking_open = False
 
+    def save(self, *args, **kwargs):
+        self.set_payment_and_booking_options()
         super(Event, self).save(*args, **kwargs)
 
 
@@ -473,6 +534,18 @@ def check_duplicate_blocktype(sender, instance, **kwargs):
                     )
 
 
+class BlockQuerySet(models.QuerySet):
+
+    def active(self):
+        """
+        Blocks that are active (see Block.active_block): paid, not expired and
+        with fewer bookings than the block size, filtered in the database
+        """
+        return self.filter(paid=True, expiry_date__gte=timezone.now()).annotate(
+            num_bookings=Count("bookings")
+        ).filter(num_bookings__lt=F("block_type__size"))
+
+
 class Block(models.Model):
     """
     Block booking
@@ -505,6 +578,8 @@ class Block(models.Model):
     # payment complete)
     voucher_code = models.CharField(max_length=255, null=True, blank=True)
 
+    objects = BlockQuerySet.as_manager()
+
     class Meta:
         ordering = ['user__username', 'id']
         indexes = [
@@ -593,13 +668,10 @@ class Block(models.Model):
         original_cost = self.block_type.cost
         if self.voucher_code:
             try:
-                voucher = BlockVoucher.objects.get(code=self.voucher_code)
-                return (
-                    Decimal(original_cost) * Decimal((100 - voucher.discount) / 100)
-                ).quantize(Decimal('.01'))
+                return BlockVoucher.objects.get_by_code(self.voucher_code).apply_discount(original_cost)
             except BlockVoucher.DoesNotExist:
-                self.voucher_code = None
-                self.save()
+                # invalid code, it'll be reset next time vouchers are applied
+                pass
         return original_cost
 
     def reset_voucher_code(self):
@@ -658,6 +730,62 @@ class Block(models.Model):
         super(Block, self).save(*args, **kwargs)
 
 
+class BookingQuerySet(models.QuerySet):
+
+    def with_payment_method(self):
+        """
+        Annotate each booking with its payment_method, as returned by
+        Booking.payment_method, without querying per booking
+        """
+        from payments.models import PaypalBookingTransaction
+        paypal_transactions = PaypalBookingTransaction.objects.filter(
+            booking_id=OuterRef("pk"), transaction_id__isnull=False
+        )
+        return self.annotate(
+            payment_method=Case(
+                When(paid=False, then=Value("")),
+                When(membership__isnull=False, then=Value("Membership")),
+                When(block__isnull=False, then=Value("Block")),
+                When(Exists(paypal_transactions), then=Value("PayPal")),
+                When(invoice__paid=True, invoice__amount__gt=0, then=Value("Stripe")),
+                When(invoice__paid=True, then=Value("Voucher")),
+                default=Value(""),
+                output_field=models.CharField(),
+            )
+        )
+
+    def confirmed_no_shows(self, start, end):
+        """
+        Paid bookings for events between start and end that the instructor
+        has confirmed as no-shows
+        """
+        return self.filter(
+            event__date__gte=start, event__date__lt=end, status="OPEN", no_show=True,
+            instructor_confirmed_no_show=True, paid=True
+        )
+
+    def repeat_no_shows(self, min_no_shows=3):
+        """
+        Return a list of (user, number of no-shows) for users with at least
+        min_no_shows bookings in this queryset, most no-shows first.  Each user's
+        bookings (with their events) are prefetched as user.no_show_bookings.
+        """
+        user_counts = dict(
+            self.order_by().values("user").annotate(num_no_shows=Count("id"))
+            .filter(num_no_shows__gte=min_no_shows)
+            .order_by("-num_no_shows", "user")
+            .values_list("user", "num_no_shows")
+        )
+        users = User.objects.prefetch_related(
+            Prefetch(
+                "bookings",
+                queryset=self.select_related("event").order_by("event__date"),
+                to_attr="no_show_bookings"
+            )
+        ).in_bulk(list(user_counts))
+        return [(users[user_id], count) for user_id, count in user_counts.items()]
+
+
 class Booking(models.Model):
     STATUS_CHOICES = (
         ('OPEN', 'Open'),
@@ -728,6 +856,8 @@ class Booking(models.Model):
     # payment complete)
     voucher_code = models.CharField(max_length=255, null=True, blank=True)
 
+    objects = BookingQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'event')
         permissions = (
@@ -802,7 +932,7 @@ class Booking(models.Model):
             (membership for membership in memberships if membership.valid_for_event(self.event)), None
         )
 
-    @property
+    @cached_property
     def has_available_block(self):
         return any(
             [
@@ -823,6 +953,7 @@ class Booking(models.Model):
 
     @cached_property
     def payment_method(self):
+        # Set directly on bookings fetched with Booking.objects.with_payment_method()
         if not self.paid:
             return ""
         if self.membership:
@@ -848,13 +979,10 @@ class Booking(models.Model):
         original_cost = self.event.cost
         if self.voucher_code:
             try:
-                voucher = EventVoucher.objects.get(code=self.voucher_code)
-                return (
-                    Decimal(original_cost) * Decimal((100 - voucher.discount) / 100)
-                ).quantize(Decimal('.01'))
+                return EventVoucher.objects.get_by_code(self.voucher_code).apply_discount(original_cost)
             except EventVoucher.DoesNotExist:
-                self.voucher_code = None
-                self.save()
+                # invalid code, it'll be reset next time vouchers are applied
+                pass
         return original_cost
 
     def reset_voucher_code(self):
@@ -970,6 +1098,19 @@ class Booking(models.Model):
         super(Booking, self).save(*args, **kwargs)
 
 
+def shopping_basket_cache_key(user_id):
+    return f'user_{user_id}_shopping_basket'
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+@receiver(post_save, sender=Block)
+@receiver(post_delete, sender=Block)
+def clear_shopping_basket_cache(sender, instance, **kwargs):
+    # clear the cached basket count for the user; it'll be re-cached on next retrieval
+    cache.delete(shopping_basket_cache_key(instance.user_id))
+
+
 class WaitingListUser(models.Model):
     """
     A model to represent a single user on a waiting list for an event
@@ -1014,12 +1155,53 @@ class BaseVoucher(models.Model):
     # stripe payments
     checkout_time = models.DateTimeField(null=True, blank=True)
 
+    # denormalized count of UsedEventVoucher/UsedBlockVoucher records; kept up to date
+    # by the used voucher signals below and redeem(), only ever with F() updates (it's
+    # not written by save(), so saving a stale instance can't overwrite it)
+    times_used = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return self.code
 
     def mark_checked(self):
+        # the invoice is (re)assigned at checkout, just before this is called
         self.checkout_time = timezone.now()
-        self.save()
+        self.save(update_fields=["invoice", "checkout_time"])
+
+    def apply_discount(self, cost):
+        return (Decimal(cost) * Decimal((100 - self.discount) / 100)).quantize(Decimal('.01'))
+
+    @property
+    def max_vouchers_reached(self):
+        return bool(self.max_vouchers) and self.times_used >= self.max_vouchers
+
+    def times_used_by_user(self, user):
+        return self.used_voucher_model.objects.filter(voucher_id=self.id, user=user).count()
+
+    def redeem(self, user, **kwargs):
+        """
+        Record a use of this voucher by user, enforcing max_vouchers and max_per_user.
+        The total uses count is incremented with a conditional update, which also locks
+        the voucher row until the end of the transaction, so concurrent redemptions can't
+        both take the last use.
+        kwargs are passed to the used voucher (booking_id/block_id)
+        Raises VoucherRedemptionError if the voucher has been used the maximum number of times.
+        """
+        with transaction.atomic():
+            within_limit = Q(max_vouchers__isnull=True) | Q(max_vouchers=0) | Q(times_used__lt=F("max_vouchers"))
+            if not BaseVoucher.objects.filter(within_limit, id=self.id).update(times_used=F("times_used") + 1):
+                raise VoucherRedemptionError(f"Voucher {self.code} has reached its maximum number of uses")
+            if self.max_per_user and self.times_used_by_user(user) >= self.max_per_user:
+                # raising rolls back the increment
+                raise VoucherRedemptionError(
+                    f"Voucher {self.code} has already been used the maximum number of times by {user.username}"
+                )
+            used_voucher = self.used_voucher_model(voucher=self, user=user, **kwargs)
+            # already counted
+            used_voucher._times_used_counted = True
+            used_voucher.save()
+        self.times_used += 1
+        return used_voucher
 
     @cached_property
     def has_expired(self):
@@ -1045,6 +1227,12 @@ class BaseVoucher(models.Model):
                 hour=0, minute=0, second=0, microsecond=0
             )
             self.expiry_date = next_day - timedelta(seconds=1)
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            # leave times_used to the F() updates
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "times_used"
+            ]
         super(BaseVoucher, self).save(*args, **kwargs)
 
 
@@ -1052,12 +1240,26 @@ class EventVoucher(BaseVoucher):
     code = models.CharField(max_length=255, unique=True)
     event_types = models.ManyToManyField(EventType)
 
+    objects = VoucherManager()
+
     # stripe payments
     invoice = models.ForeignKey(
         "stripe_payments.Invoice", on_delete=models.SET_NULL, null=True, blank=True, 
         related_name="event_gift_vouchers"
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                Upper("code"), name="eventvoucher_code_upper_unique",
+                violation_error_message="Voucher with this code already exists"
+            ),
+        ]
+
+    @property
+    def used_voucher_model(self):
+        return UsedEventVoucher
+
     def check_event_type(self, ev_type):
         return bool(ev_type in self.event_types.all())
     
@@ -1082,6 +1284,8 @@ class EventVoucher(BaseVoucher):
 class BlockVoucher(BaseVoucher):
     code = models.CharField(max_length=255, unique=True)
     block_types = models.ManyToManyField(BlockType)
+
+    objects = VoucherManager()
     
     # stripe payments
     invoice = models.ForeignKey(
@@ -1089,6 +1293,18 @@ class BlockVoucher(BaseVoucher):
         related_name="block_gift_vouchers"
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                Upper("code"), name="blockvoucher_code_upper_unique",
+                violation_error_message="Voucher with this code already exists"
+            ),
+        ]
+
+    @property
+    def used_voucher_model(self):
+        return UsedBlockVoucher
+
     def check_block_type(self, block_type):
         return bool(block_type in self.block_types.all())
 
@@ -1105,6 +1321,11 @@ class BlockVoucher(BaseVoucher):
             return gvt
 
 
+for voucher_model in [EventVoucher, BlockVoucher]:
+    post_save.connect(clear_voucher_code_cache, sender=voucher_model)
+    post_delete.connect(clear_voucher_code_cache, sender=voucher_model)
+
+
 class UsedEventVoucher(models.Model):
     voucher = models.ForeignKey(EventVoucher, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -1117,6 +1338,20 @@ class UsedBlockVoucher(models.Model):
     block_id = models.CharField(max_length=20, null=True, blank=True)
 
 
+@receiver(post_save, sender=UsedEventVoucher)
+@receiver(post_save, sender=UsedBlockVoucher)
+def increment_voucher_times_used(sender, instance, created, **kwargs):
+    # vouchers used via BaseVoucher.redeem have already been counted
+    if created and not getattr(instance, "_times_used_counted", False):
+        BaseVoucher.objects.filter(id=instance.voucher_id).update(times_used=F("times_used") + 1)
+
+
+@receiver(post_delete, sender=UsedEventVoucher)
+@receiver(post_delete, sender=UsedBlockVoucher)
+def decrement_voucher_times_used(sender, instance, **kwargs):
+    BaseVoucher.objects.filter(id=instance.voucher_id, times_used__gt=0).update(times_used=F("times_used") - 1)
+
+
 class GiftVoucherType(models.Model):
     block_type = models.ForeignKey(
         BlockType, null=True, blank=True, on_delete=models.SET_NULL, related_name="block_gift_vouchers"
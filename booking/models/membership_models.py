@@ -6,12 +6,15 @@ import re
 
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models.functions import Upper
+from django.db.models.signals import post_delete, post_save
 from django.core.exceptions import ValidationError
 from django.utils.text import slugify
 from django.utils import timezone
 
 from activitylog.models import ActivityLog
 from booking.models import EventType
+from booking.models.booking_models import VoucherManager, clear_voucher_code_cache
 from stripe_payments.utils import StripeConnector, get_first_of_next_month_from_timestamp
 
 logger = logging.getLogger(__name__)
@@ -269,6 +272,10 @@ class UserMembership(models.Model):
     # them in the stripe webhook and move the subscription to active
     pending_setup_intent = models.TextField(null=True, blank=True)
 
+    # Flag set by the stripe webhook when a subscription is cancelled or scheduled to cancel; bookings are
+    # reallocated in bulk by the reallocate_membership_bookings management command rather than in the webhook
+    reallocation_pending = models.BooleanField(default=False)
+
     # stripe status to user-friendly format
     HR_STATUS = {
         "incomplete": "Incomplete",
@@ -283,6 +290,13 @@ class UserMembership(models.Model):
 
     class Meta:
         ordering = ("subscription_status", "-start_date",)
+        indexes = [
+            models.Index(
+                fields=["reallocation_pending"], 
+                condition=models.Q(reallocation_pending=True), 
+                name="usermembership_realloc_idx"
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.user} - {self.membership.name}"
@@ -375,7 +389,7 @@ class UserMembership(models.Model):
             return
         return get_first_of_next_month_from_timestamp(end_date.timestamp())
 
-    def _reallocate_existing_booking(self, booking, other_active_memberships):
+    def _reallocate_existing_booking(self, booking, other_active_memberships, logs):
         # no-show or cancelled bookings are just set to no membership and unpaid
         if booking.no_show or booking.status == "CANCELLED":
             booking.membership = None
@@ -390,8 +404,8 @@ class UserMembership(models.Model):
                 booking.paid = True
                 booking.payment_confirmed = True
                 booking.save()
-                ActivityLog.objects.create(
-                    log=f"Reallocated booking {booking.id} (user {self.user.username}) to membership {membership}"
+                logs.append(
+                    ActivityLog(log=f"Reallocated booking {booking.id} (user {self.user.username}) to membership {membership}")
                 )
                 return booking
         # assign to first valid block
@@ -402,8 +416,8 @@ class UserMembership(models.Model):
             booking.paid = True
             booking.payment_confirmed = True
             booking.save()
-            ActivityLog.objects.create(
-                log=f"Reallocated booking {booking.id} (user {self.user.username}) to block {active_block.id}"
+            logs.append(
+                ActivityLog(log=f"Reallocated booking {booking.id} (user {self.user.username}) to block {active_block.id}")
             )
             return booking
         # no valid membership or block, set to None
@@ -411,8 +425,8 @@ class UserMembership(models.Model):
         booking.paid = False
         booking.payment_confirmed = False
         booking.save()
-        ActivityLog.objects.create(
-            log=f"Booking {booking.id} (user {self.user.username}) for cancelled membership set to unpaid"
+        logs.append(
+            ActivityLog(log=f"Booking {booking.id} (user {self.user.username}) for cancelled membership set to unpaid")
         )
         return booking
 
@@ -430,26 +444,43 @@ class UserMembership(models.Model):
             i.e. after successful set up of a subscription, allocate any unpaid bookings
             - confirm subscription is in active state first and has no end date (set on payment for backdated, and on
             setup intent confirmation for non-backdated)
-        """        
+        """
+        logs = []
         if self.end_date:
             # check for open bookings for events after the end date and reallocate
-            bookings_after_end_date = self.bookings.filter(event__date__gt=self.end_date)
-            other_active_memberships = self.user.memberships.filter(subscription_status="active")
+            bookings_after_end_date = self.bookings.filter(
+                event__date__gt=self.end_date
+            ).select_related("event__event_type", "user")
+            other_active_memberships = list(
+                self.user.memberships.filter(subscription_status="active").select_related("membership")
+            )
             for booking in bookings_after_end_date:
-                booking = self._reallocate_existing_booking(booking, other_active_memberships)
+                booking = self._reallocate_existing_booking(booking, other_active_memberships, logs)
 
         elif self.subscription_status == "active":
             # check for unpaid bookings that this membership is eligible for and assign the membership to it
-            unpaid_bookings = self.user.bookings.filter(event__date__gt=self.start_date, paid=False, status="OPEN", no_show=False)
+            unpaid_bookings = self.user.bookings.filter(
+                event__date__gt=self.start_date, paid=False, status="OPEN", no_show=False
+            ).select_related("event__event_type")
             for booking in unpaid_bookings:
                 if self.valid_for_event(booking.event):
                     booking.membership = self
                     booking.paid = True
                     booking.payment_confirmed = True
                     booking.save()
-                    ActivityLog.objects.create(
-                        log=f"Unpaid booking {booking.id} (user {self.user.username}) allocated to membership"
+                    logs.append(
+                        ActivityLog(log=f"Unpaid booking {booking.id} (user {self.user.username}) allocated to membership")
                     )
+        ActivityLog.objects.bulk_create(logs)
+
+    def schedule_reallocation(self):
+        """
+        Flag this membership for booking reallocation by the reallocate_membership_bookings
+        management command.  Flagging an already-flagged membership (e.g. on a retried 
+        webhook) is a no-op.
+        """
+        UserMembership.objects.filter(id=self.id).update(reallocation_pending=True)
+        self.reallocation_pending = True
 
 
 class StripeSubscriptionVoucher(models.Model):
@@ -488,8 +519,16 @@ class StripeSubscriptionVoucher(models.Model):
         default=True, help_text="Valid for new memberships only"
     )
 
+    objects = VoucherManager()
+
     class Meta:
         ordering = ("-active", "-expiry_date", "-redeem_by")
+        constraints = [
+            models.UniqueConstraint(
+                Upper("code"), name="stripesubscriptionvoucher_code_upper_unique",
+                violation_error_message="Voucher with this code already exists"
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.code
@@ -571,3 +610,7 @@ class StripeSubscriptionVoucher(models.Model):
             return f"£{self.amount_off:.2f}"
         assert self.percent_off
         return f"{self.percent_off:.0f}%"
+
+
+post_save.connect(clear_voucher_code_cache, sender=StripeSubscriptionVoucher)
+post_delete.connect(clear_voucher_code_cache, sender=StripeSubscriptionVoucher)
@@ -6,7 +6,9 @@ import shortuuid
 
 from decimal import Decimal
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
@@ -24,6 +26,32 @@ class TicketBookingError(Exception):
     pass
 
 
+class TicketedEventQuerySet(models.QuerySet):
+
+    def with_tickets_booked(self):
+        """
+        Annotate each event with the number of tickets on confirmed, uncancelled
+        ticket bookings and the number currently held by ticket reservations, so
+        tickets_left() doesn't need to query per event
+        """
+        tickets_booked = Ticket.objects.filter(
+            ticket_booking__ticketed_event_id=OuterRef("pk"),
+            ticket_booking__cancelled=False,
+            ticket_booking__purchase_confirmed=True,
+        ).order_by().values("ticket_booking__ticketed_event_id").annotate(
+            count=Count("id")
+        ).values("count")
+        tickets_held = TicketReservation.objects.active().filter(
+            ticketed_event_id=OuterRef("pk")
+        ).order_by().values("ticketed_event_id").annotate(
+            total=Sum("quantity")
+        ).values("total")
+        return self.annotate(
+            num_tickets_booked=Coalesce(Subquery(tickets_booked), 0),
+            num_tickets_held=Coalesce(Subquery(tickets_held), 0),
+        )
+
+
 class TicketedEvent(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, default="")
@@ -91,11 +119,16 @@ class TicketedEvent(models.Model):
                   'Check this carefully!'
     )
 
+    objects = TicketedEventQuerySet.as_manager()
+
     class Meta:
         ordering = ['-date']
 
     def tickets_left(self):
         if self.max_tickets:
+            # use the counts annotated by with_tickets_booked() if we have them
+            if hasattr(self, "num_tickets_booked"):
+                return self.max_tickets - self.num_tickets_booked - self.num_tickets_held
             ticket_bookings = TicketBooking.objects.filter(
                 ticketed_event__id=self.id, cancelled=False,
                 purchase_confirmed=True
@@ -103,11 +136,17 @@ class TicketedEvent(models.Model):
             booked_number = Ticket.objects.filter(
                 ticket_booking__in=ticket_bookings
             ).count()
-            return self.max_tickets - booked_number
+            return self.max_tickets - booked_number - self.tickets_held()
         else:
             # if there is no max_tickets, return an unfeasibly high number
             return 10000
 
+    def tickets_held(self):
+        """Number of tickets held by unexpired reservations"""
+        return self.ticket_reservations.active().aggregate(
+            total=Sum("quantity")
+        )["total"] or 0
+
     def bookable(self):
         return self.tickets_left() > 0
 
@@ -177,6 +216,16 @@ class TicketBooking(models.Model):
     invoice = models.ForeignKey("stripe_payments.Invoice", on_delete=models.SET_NULL, null=True, blank=True, related_name="ticket_bookings")
     checkout_time = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # for finding aborted bookings to clean up
+            models.Index(
+                fields=["date_booked"],
+                condition=Q(purchase_confirmed=False, paid=False),
+                name="ticketbooking_unconfirmed_idx",
+            ),
+        ]
+
     def set_booking_reference(self):
         self.booking_reference = shortuuid.ShortUUID().random(length=22)
 
@@ -184,6 +233,74 @@ class TicketBooking(models.Model):
         self.checkout_time = timezone.now()
         self.save()
 
+    def tickets_held(self):
+        """Number of tickets held for this booking by an unexpired reservation"""
+        if self.purchase_confirmed or self.cancelled:
+            return 0
+        try:
+            reservation = self.reservation
+        except TicketReservation.DoesNotExist:
+            return 0
+        return reservation.quantity if reservation.is_active else 0
+
+    def set_ticket_quantity(self, quantity):
+        """
+        Add or remove tickets so that this booking has quantity tickets.  Tickets on
+        an unconfirmed booking are held by a TicketReservation until the purchase
+        is confirmed or the reservation expires.
+        Raises TicketBookingError if there aren't enough tickets left.
+        """
+        with transaction.atomic():
+            # lock the event, so ticket selections for it are checked one at a time
+            ticketed_event = TicketedEvent.objects.select_for_update().get(id=self.ticketed_event_id)
+            tickets = list(self.tickets.order_by("id"))
+            # tickets on the current booking are already counted in tickets_left if the
+            # purchase is confirmed, or if they are held
+            tickets_available = ticketed_event.tickets_left() + (
+                len(tickets) if self.purchase_confirmed else self.tickets_held()
+            )
+            if quantity > tickets_available:
+                raise TicketBookingError(
+                    'Only {} tickets left for {}'.format(tickets_available, ticketed_event)
+                )
+
+            if len(tickets) < quantity:
+                Ticket.objects.bulk_create(
+                    [Ticket(ticket_booking=self) for i in range(quantity - len(tickets))]
+                )
+            elif len(tickets) > quantity:
+                Ticket.objects.filter(id__in=[ticket.id for ticket in tickets[quantity:]]).delete()
+
+            if not self.purchase_confirmed:
+                self.reservation, _created = TicketReservation.objects.update_or_create(
+                    ticket_booking=self,
+                    defaults={
+                        "ticketed_event": ticketed_event,
+                        "quantity": quantity,
+                        "expires_at": timezone.now() + TicketReservation.HOLD_DURATION,
+                    }
+                )
+
+    def confirm_purchase(self, date_booked):
+        """
+        Confirm the purchase and release the reservation; its tickets now count as booked.
+        Raises TicketBookingError if the reservation has expired and its tickets are no
+        longer available.
+        """
+        with transaction.atomic():
+            ticketed_event = TicketedEvent.objects.select_for_update().get(id=self.ticketed_event_id)
+            if not self.purchase_confirmed:
+                ticket_count = self.tickets.count()
+                tickets_available = ticketed_event.tickets_left() + self.tickets_held()
+                if ticket_count > tickets_available:
+                    raise TicketBookingError(
+                        'Only {} tickets left for {}'.format(tickets_available, ticketed_event)
+                    )
+            self.purchase_confirmed = True
+            self.date_booked = date_booked
+            self.save()
+            TicketReservation.objects.filter(ticket_booking=self).delete()
+
     @property
     def cost(self):
         return Decimal(
@@ -225,3 +342,51 @@ class Ticket(models.Model):
                     )
                 )
         super(Ticket, self).save(*args, **kwargs)
+
+
+class TicketReservationQuerySet(models.QuerySet):
+
+    def active(self):
+        """
+        Unexpired reservations; a reservation only holds tickets until its booking's
+        purchase is confirmed (or cancelled)
+        """
+        return self.filter(
+            expires_at__gt=timezone.now(),
+            ticket_booking__purchase_confirmed=False,
+            ticket_booking__cancelled=False,
+        )
+
+
+class TicketReservation(models.Model):
+    """
+    Holds tickets on an unconfirmed ticket booking while the user completes the
+    purchase, so they can't be sold to someone else in the meantime
+    """
+    HOLD_DURATION = timedelta(minutes=15)
+
+    ticket_booking = models.OneToOneField(
+        TicketBooking, related_name="reservation", on_delete=models.CASCADE
+    )
+    ticketed_event = models.ForeignKey(
+        TicketedEvent, related_name="ticket_reservations", on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = TicketReservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["ticketed_event", "expires_at"]),
+        ]
+
+    @property
+    def is_active(self):
+        return self.expires_at > timezone.now()
+
+    def __str__(self):
+        return '{} - {} ticket(s) held until {}'.format(
+            self.ticket_booking.booking_reference, self.quantity,
+            self.expires_at.strftime('%d %b %Y, %H:%M')
+        )
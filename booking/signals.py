@@ -1,8 +1,9 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from accounts.models import UserProfile
+from accounts.models import USER_INITIALS_CACHE_KEY, UserProfile
 from activitylog.models import ActivityLog
 
 
@@ -15,3 +16,14 @@ def event_post_save(sender, instance, created, *args, **kwargs):
             )
         )
         UserProfile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def clear_user_initials_cache(sender, instance, *args, **kwargs):
+    update_fields = kwargs.get("update_fields")
+    # logging in only updates last_login; don't clear the cache on every login
+    if update_fields and "first_name" not in update_fields:
+        return
+    cache.delete(USER_INITIALS_CACHE_KEY)
+
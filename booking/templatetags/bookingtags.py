@@ -9,15 +9,16 @@ from urllib.parse import urlencode
 
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from django import template
+from django.db.models import Count, F
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 
 from accounts.models import OnlineDisclaimer, has_active_disclaimer, \
     has_active_online_disclaimer, has_expired_disclaimer
-from booking.models import Banner, BlockVoucher, Booking, Event, EventVoucher, \
-    UsedBlockVoucher, UsedEventVoucher
+from booking.models import Banner, BlockVoucher, Booking, Event, shopping_basket_cache_key
 from studioadmin.utils import int_str, chaffify
 
 
@@ -248,12 +249,12 @@ def format_event_types(ev_types):
 
 @register.filter
 def times_voucher_used(voucher):
-    return UsedEventVoucher.objects.filter(voucher=voucher).count()
+    return voucher.times_used
 
 
 @register.filter
 def times_block_voucher_used(voucher):
-    return UsedBlockVoucher.objects.filter(voucher=voucher).count()
+    return voucher.times_used
 
 
 @register.filter
@@ -343,16 +344,8 @@ def voucher_expired(voucher):
     # voucher has expired if expiry date passed or has been used max times
     if voucher.expiry_date and voucher.expiry_date < timezone.now():
         return True
-    elif voucher.max_vouchers:
-        if isinstance(voucher, EventVoucher):
-            times_used = UsedEventVoucher.objects.filter(voucher=voucher)\
-                .count()
-        else:
-            times_used = UsedBlockVoucher.objects.filter(voucher=voucher)\
-                .count()
-
-        if times_used and times_used >= voucher.max_vouchers:
-            return True
+    elif voucher.max_vouchers_reached:
+        return True
 
     return False
 
@@ -374,17 +367,24 @@ def full_location(location):
 
 
 def get_shopping_basket_icon(user, menu=False):
-    bookings = user.bookings.select_related('event').filter(
-        paid=False, status='OPEN', event__date__gte=timezone.now(), no_show=False, paypal_pending=False
-    )
-    blocks = [
-        block for block in user.blocks.filter(expiry_date__gte=timezone.now(), paid=False, paypal_pending=False) if not block.full
-    ]
-    return {
-        'has_unpaid_bookings': any(bookings),
-        'count': bookings.count() + len(blocks),
-        'menu': menu
-    }
+    # Cached per user; cleared when the user's bookings or blocks are saved or deleted,
+    # and expires so that bookings for past events and expired blocks drop out
+    key = shopping_basket_cache_key(user.id)
+    basket = cache.get(key)
+    if basket is None:
+        unpaid_bookings_count = user.bookings.filter(
+            paid=False, status='OPEN', event__date__gte=timezone.now(), no_show=False, paypal_pending=False
+        ).count()
+        # unpaid blocks that aren't full
+        unpaid_blocks_count = user.blocks.filter(
+            expiry_date__gte=timezone.now(), paid=False, paypal_pending=False
+        ).annotate(booking_count=Count("bookings")).filter(booking_count__lt=F("block_type__size")).count()
+        basket = {
+            'has_unpaid_bookings': unpaid_bookings_count > 0,
+            'count': unpaid_bookings_count + unpaid_blocks_count,
+        }
+        cache.set(key, basket, timeout=600)
+    return {**basket, 'menu': menu}
 
 
 @register.simple_tag
@@ -9,6 +9,7 @@ import pytest
 
 from django.conf import settings
 from django.core import mail
+from django.core.cache import cache
 from django.urls import reverse
 from django.test import override_settings, TestCase
 from django.contrib.auth.models import Group, User
@@ -18,7 +19,8 @@ from django.utils import timezone
 
 from accounts.models import DisclaimerContent, OnlineDisclaimer, AccountBan
 
-from booking.models import Event, EventType, Booking, Block, WaitingListUser, MembershipItem, Membership, UserMembership
+from booking.models import Event, EventType, Booking, Block, WaitingListUser, MembershipItem, Membership, UserMembership, \
+    shopping_basket_cache_key
 from booking.views.shopping_basket_views import shopping_basket_bookings_total_context, \
     shopping_basket_blocks_total_context
 from common.tests.helpers import TestSetupMixin, make_data_privacy_agreement
@@ -817,6 +819,28 @@ class AjaxTests(TestSetupMixin, TestCase):
         resp = self.client.get(url)
         self.assertIn('<span class="basket-count">1</span>', resp.content.decode('utf-8'))
 
+    def test_update_shopping_basket_count_cached(self):
+        url = reverse('booking:update_shopping_basket_count')
+        resp = self.client.get(url)
+        self.assertIn('<span class="basket-count">0</span>', resp.content.decode('utf-8'))
+        self.assertEqual(cache.get(shopping_basket_cache_key(self.user.id))["count"], 0)
+
+        # saving a booking clears the cached count
+        booking = baker.make_recipe('booking.booking', event=self.event, user=self.user)
+        self.assertIsNone(cache.get(shopping_basket_cache_key(self.user.id)))
+        resp = self.client.get(url)
+        self.assertIn('<span class="basket-count">1</span>', resp.content.decode('utf-8'))
+
+        # unpaid blocks that aren't full are included
+        block = baker.make_recipe('booking.block_5', user=self.user, paid=False, start_date=timezone.now())
+        resp = self.client.get(url)
+        self.assertIn('<span class="basket-count">2</span>', resp.content.decode('utf-8'))
+
+        block.delete()
+        booking.delete()
+        resp = self.client.get(url)
+        self.assertIn('<span class="basket-count">0</span>', resp.content.decode('utf-8'))
+
     def test_toggle_waiting_list_on(self):
         url = reverse('booking:toggle_waiting_list', args=[self.event.id])
         self.assertFalse(WaitingListUser.objects.exists())
@@ -1095,14 +1095,15 @@ class BookingDeleteViewTests(TestSetupMixin, TestCase):
 
         url = reverse('booking:delete_booking', args=[booking.id])
         self.client.login(username=self.user.username, password='test')
-        self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
         # unpaid booking deleted, cancel and  waiting list emails sent
         self.assertEqual(len(mail.outbox), 2)
         waiting_list_mail = mail.outbox[1]
         self.assertEqual(waiting_list_mail.bcc, [wluser.user.email])
 
     @patch('booking.views.booking_views.send_mail')
-    @patch('booking.views.booking_views.send_waiting_list_email')
+    @patch('booking.email_helpers.send_waiting_list_email')
     def test_errors_sending_waiting_list_emails(
             self, mock_send_wl_emails, mock_send_emails):
         mock_send_emails.side_effect = Exception('Error sending mail')
@@ -1120,7 +1121,8 @@ class BookingDeleteViewTests(TestSetupMixin, TestCase):
 
         url = reverse('booking:delete_booking', args=[booking.id])
         self.client.login(username=self.user.username, password='test')
-        self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
 
         # Error emails for both cancellation and waiting list
         self.assertEqual(len(mail.outbox), 2)
@@ -1134,7 +1136,7 @@ class BookingDeleteViewTests(TestSetupMixin, TestCase):
             )
 
     @patch('booking.views.booking_views.send_mail')
-    @patch('booking.views.booking_views.send_waiting_list_email')
+    @patch('booking.email_helpers.send_waiting_list_email')
     @patch('booking.email_helpers.send_mail')
     def test_errors_sending_all_emails(self, mock_send, mock_send_wl_emails, mock_send_emails):
         mock_send.side_effect = Exception('Error sending mail')
@@ -1153,7 +1155,8 @@ class BookingDeleteViewTests(TestSetupMixin, TestCase):
 
         url = reverse('booking:delete_booking', args=[booking.id])
         self.client.login(username=self.user.username, password='test')
-        self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
         self.assertEqual(len(mail.outbox), 0)
 
         booking.refresh_from_db()
@@ -573,6 +573,8 @@ class StripeCheckoutTests(TestSetupMixin, TestCase):
             stripe_payment_intent_id="foo"
         )
         booking = baker.make(Booking, event=self.pole_class, user=self.user, invoice=invoice)
+        invoice.items_fingerprint = Invoice.get_items_fingerprint([booking])
+        invoice.save()
 
         # total is correct
         resp = self.client.post(self.url, data={"cart_bookings_total": 10})
@@ -593,6 +595,8 @@ class StripeCheckoutTests(TestSetupMixin, TestCase):
         self.gift_voucher.purchaser_email = "test@test.com"
         self.gift_voucher.invoice = invoice
         self.gift_voucher.save()
+        invoice.items_fingerprint = Invoice.get_items_fingerprint([self.gift_voucher])
+        invoice.save()
         # total is correct
         resp = self.client.post(
             self.url, 
@@ -607,6 +611,43 @@ class StripeCheckoutTests(TestSetupMixin, TestCase):
         assert invoice.amount == 10
         assert resp.context_data["cart_total"] ==10.00
 
+    @patch("booking.views.checkout_views.stripe.PaymentIntent")
+    def test_does_not_reuse_invoice_for_different_items(self, mock_payment_intent):
+        mock_payment_intent_obj = self.get_mock_payment_intent(id="foo")
+        mock_payment_intent.create.return_value = mock_payment_intent_obj
+        booking = baker.make(Booking, event=self.pole_class, user=self.user)
+        other_booking = baker.make(Booking, event__cost=10, user=self.user, paid=True)
+        # unpaid invoice for this user, but for a different set of items
+        invoice = baker.make(
+            Invoice, username=self.user.email, amount=20, paid=False,
+            items_fingerprint=Invoice.get_items_fingerprint([booking, other_booking])
+        )
+        self.client.post(self.url, data={"cart_bookings_total": 10})
+        booking.refresh_from_db()
+        assert Invoice.objects.count() == 2
+        assert booking.invoice != invoice
+        assert booking.invoice.items_fingerprint == Invoice.get_items_fingerprint([booking])
+
+    @patch("booking.views.checkout_views.stripe.PaymentIntent")
+    def test_reuses_invoice_and_reassigns_moved_items(self, mock_payment_intent):
+        mock_payment_intent_obj = self.get_mock_payment_intent(id="foo")
+        mock_payment_intent.create.return_value = mock_payment_intent_obj
+        mock_payment_intent.modify.return_value = mock_payment_intent_obj
+        booking = baker.make(Booking, event=self.pole_class, user=self.user)
+        # first checkout creates an invoice for the booking
+        self.client.post(self.url, data={"cart_bookings_total": 10})
+        booking.refresh_from_db()
+        invoice = booking.invoice
+        # booking is moved to another invoice
+        booking.invoice = baker.make(Invoice, username=self.user.email, paid=False)
+        booking.save()
+
+        # checking out again finds the original invoice by its items
+        self.client.post(self.url, data={"cart_bookings_total": 10})
+        booking.refresh_from_db()
+        assert booking.invoice == invoice
+        assert invoice.item_count() == 1
+
     def test_no_seller(self):
         Seller.objects.all().delete()
         baker.make("booking.booking", event=self.pole_class, user=self.user)
@@ -621,11 +662,13 @@ class StripeCheckoutTests(TestSetupMixin, TestCase):
         mock_payment_intent.modify.side_effect = InvalidRequestError("error", None)
         mock_payment_intent.retrieve.return_value = mock_payment_intent_obj
 
+        booking = baker.make(Booking, event=self.pole_class, user=self.user)
         invoice = baker.make(
             Invoice, username=self.user.email, amount=10, paid=False,
-            stripe_payment_intent_id="foo"
+            stripe_payment_intent_id="foo", items_fingerprint=Invoice.get_items_fingerprint([booking])
         )
-        baker.make(Booking, event=self.pole_class, user=self.user, invoice=invoice)
+        booking.invoice = invoice
+        booking.save()
         resp = self.client.post(self.url, data={"cart_bookings_total": 10})
         assert resp.context_data["preprocessing_error"] is True
 
@@ -635,11 +678,13 @@ class StripeCheckoutTests(TestSetupMixin, TestCase):
         mock_payment_intent.modify.side_effect = InvalidRequestError("error", None)
         mock_payment_intent.retrieve.return_value = mock_payment_intent_obj
 
+        booking = baker.make(Booking, event=self.pole_class, user=self.user)
         invoice = baker.make(
             Invoice, username=self.user.email, amount=30, paid=False,
-            stripe_payment_intent_id="foo"
+            stripe_payment_intent_id="foo", items_fingerprint=Invoice.get_items_fingerprint([booking])
         )
-        baker.make(Booking, event=self.pole_class, user=self.user, invoice=invoice)
+        booking.invoice = invoice
+        booking.save()
         
         resp = self.client.post(self.url, data={"cart_bookings_total": 10})
         assert resp.context_data["preprocessing_error"] is True
@@ -27,9 +27,9 @@ from paypal.standard.models import ST_PP_COMPLETED
 from accounts.models import OnlineDisclaimer
 from activitylog.models import ActivityLog
 from booking.models import AllowedGroup, Event, Block, Booking, EventType, BlockType, \
-    TicketBooking, Ticket, UserMembership
+    TicketBooking, Ticket, TicketReservation, UserMembership
 from common.tests.helpers import _add_user_email_addresses, PatchRequestMixin
-from payments.models import PaypalBookingTransaction
+from payments.models import PaypalBookingTransaction, PaypalTicketBookingTransaction
 from timetable.models import Session
 from conftest import get_mock_subscription
 from stripe_payments.tests.mock_connector import MockConnector
@@ -827,6 +827,22 @@ class CancelUnpaidBookingsTests(TestCase):
         self.assertTrue(unpaid_booking.auto_cancelled)
         self.assertFalse(paid_booking.auto_cancelled)
 
+    @patch('booking.management.commands.cancel_unpaid_bookings.timezone')
+    def test_does_not_cancel_bookings_paid_by_paypal(self, mock_tz):
+        mock_tz.now.return_value = datetime(
+            2015, 2, 10, 10, tzinfo=dt_timezone.utc
+        )
+        # unpaid booking has a completed paypal payment that hasn't been processed
+        baker.make(PaypalBookingTransaction, booking=self.unpaid, invoice_id="test")
+        baker.make(PayPalIPN, invoice="test", txn_id="test", payment_status=ST_PP_COMPLETED)
+
+        management.call_command('cancel_unpaid_bookings')
+        self.unpaid.refresh_from_db()
+        assert self.unpaid.status == 'OPEN'
+        assert self.unpaid.paid
+        assert self.unpaid.payment_confirmed
+        assert len(mail.outbox) == 0
+
     @patch('booking.management.commands.cancel_unpaid_bookings.timezone')
     def test_cancel_unpaid_bookings_no_autocanceling(self, mock_tz):
         """
@@ -1172,12 +1188,14 @@ class CancelUnpaidBookingsTests(TestCase):
                 user__email='test{}@test.com'.format(i)
             )
 
-        management.call_command('cancel_unpaid_bookings')
+        with self.captureOnCommitCallbacks(execute=True):
+            management.call_command('cancel_unpaid_bookings')
         # emails are sent to user per cancelled booking (1) and
         # one email with bcc to waiting list (1) and studio (1)
+        # waiting list email is sent on commit, after the others
         self.assertEqual(len(mail.outbox), 3)
         self.assertEqual(
-            sorted(mail.outbox[1].bcc),
+            sorted(mail.outbox[2].bcc),
             ['test0@test.com', 'test1@test.com', 'test2@test.com']
         )
 
@@ -1211,16 +1229,17 @@ class CancelUnpaidBookingsTests(TestCase):
                 user__email='test{}@test.com'.format(i)
             )
 
-        management.call_command('cancel_unpaid_bookings')
+        with self.captureOnCommitCallbacks(execute=True):
+            management.call_command('cancel_unpaid_bookings')
         # emails are sent to user per cancelled booking (2) and
         # one email with bcc to waiting list (1) and studio (1)
-        # waiting list email sent after the two user emails
+        # waiting list email is sent on commit, after the others
         self.assertEqual(len(mail.outbox), 4)
         self.assertEqual(
-            sorted(mail.outbox[2].bcc),
+            sorted(mail.outbox[3].bcc),
             ['test0@test.com', 'test1@test.com', 'test2@test.com']
         )
-        for email in [mail.outbox[0], mail.outbox[1], mail.outbox[3]]:
+        for email in [mail.outbox[0], mail.outbox[1], mail.outbox[2]]:
             self.assertEqual(email.bcc, [])
 
         self.assertEqual(Booking.objects.filter(status='CANCELLED').count(), 2)
@@ -1246,7 +1265,8 @@ class CancelUnpaidBookingsTests(TestCase):
                 user__email='test{}@test.com'.format(i)
             )
 
-        management.call_command('cancel_unpaid_bookings')
+        with self.captureOnCommitCallbacks(execute=True):
+            management.call_command('cancel_unpaid_bookings')
         # emails are sent to user per cancelled booking (1) studio (1) and waitinglist (1, with bcc)
         self.assertEqual(len(mail.outbox), 3)
 
@@ -1825,6 +1845,21 @@ class CancelUnpaidTicketBookingsTests(TestCase):
         self.assertTrue(self.unpaid.cancelled)
         self.assertFalse(self.paid.cancelled)
 
+    @patch('booking.management.commands.cancel_unpaid_ticket_bookings.timezone')
+    def test_does_not_cancel_ticket_bookings_paid_by_paypal(self, mock_tz):
+        mock_tz.now.return_value = datetime(
+            2015, 2, 11, 10, tzinfo=dt_timezone.utc
+        )
+        # unpaid ticket booking has a completed paypal payment that hasn't been processed
+        baker.make(PaypalTicketBookingTransaction, ticket_booking=self.unpaid, invoice_id="test")
+        baker.make(PayPalIPN, invoice="test", txn_id="test", payment_status=ST_PP_COMPLETED)
+
+        management.call_command('cancel_unpaid_ticket_bookings')
+        self.unpaid.refresh_from_db()
+        assert not self.unpaid.cancelled
+        assert self.unpaid.paid
+        assert len(mail.outbox) == 0
+
     @patch('booking.management.commands.cancel_unpaid_ticket_bookings.timezone')
     def test_only_cancel_unpaid_bookings_in_day_hours(self, mock_tz):
         """
@@ -2284,6 +2319,31 @@ class CancelUnpaidTicketBookingsTests(TestCase):
             1
         )
 
+    @patch('booking.management.commands.delete_unconfirmed_ticket_bookings.timezone')
+    def test_delete_expired_ticket_reservations(self, mock_tz):
+        mock_tz.now.return_value = datetime(
+            2015, 2, 11, 12, 0, tzinfo=dt_timezone.utc
+        )
+        expired, active = [
+            baker.make(
+                TicketReservation,
+                ticket_booking__ticketed_event=self.ticketed_event,
+                ticket_booking__date_booked=datetime(2015, 2, 11, 11, 30, tzinfo=dt_timezone.utc),
+                ticketed_event=self.ticketed_event,
+                quantity=1,
+                expires_at=expires_at,
+            )
+            for expires_at in [
+                datetime(2015, 2, 11, 11, 50, tzinfo=dt_timezone.utc),
+                datetime(2015, 2, 11, 12, 10, tzinfo=dt_timezone.utc),
+            ]
+        ]
+        management.call_command('delete_unconfirmed_ticket_bookings')
+        self.assertEqual(list(TicketReservation.objects.all()), [active])
+        # the expired reservation's booking is not deleted until it's over 1 hr old
+        self.assertTrue(TicketBooking.objects.filter(id=expired.ticket_booking.id).exists())
+        self.assertIn('1 expired ticket reservation(s) deleted', self.output.getvalue())
+
     @patch('booking.management.commands.delete_unconfirmed_ticket_bookings.timezone')
     def test_no_ticket_bookings_to_delete(self, mock_tz):
         mock_tz.now.return_value = datetime(
@@ -2464,6 +2524,58 @@ class BlockBookingsReportTests(PatchRequestMixin, TestCase):
             )
         )
 
+    def test_block_booking_report_multiple_users(self):
+        user2_booking_not_on_block = baker.make_recipe(
+            'booking.booking',
+            user=self.user2,
+            event__event_type=self.event_type,
+            date_booked=timezone.now() - timedelta(2),
+            paid=True, payment_confirmed=True
+        )
+        # inactive blocks are ignored
+        baker.make_recipe(
+            'booking.block_5', user=self.user2,
+            start_date=timezone.now() - timedelta(100),
+            block_type__event_type=self.event_type, paid=True,
+            _quantity=5
+        )
+        baker.make_recipe(
+            'booking.block_5', user=self.user2,
+            start_date=timezone.now() - timedelta(10),
+            block_type__event_type=self.event_type, paid=False,
+        )
+
+        # active blocks, bookings, paypal transactions, activity logs
+        with self.assertNumQueries(4):
+            management.call_command('block_bookings_report')
+
+        # one summary email for both users
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [settings.SUPPORT_EMAIL])
+        body = mail.outbox[0].body
+        assert body.startswith("2 active blocks")
+        assert f"Possible issues for user {self.user1.username}" in body
+        assert f"Possible issues for user {self.user2.username}" in body
+        assert f"paid bookings booked since the block start date but not using block: ids {user2_booking_not_on_block.id}" in body
+        self.assertEqual(
+            ActivityLog.objects.filter(log__startswith="Possible issues with bookings").count(), 2
+        )
+
+    def test_block_booking_report_full_block(self):
+        baker.make_recipe(
+            'booking.booking',
+            user=self.user1,
+            event__event_type=self.event_type,
+            block=self.user1_active_block,
+            date_booked=timezone.now() - timedelta(8),
+            _quantity=3
+        )
+        management.call_command('block_bookings_report')
+        self.assertEqual(
+            self.output.getvalue(),
+            'No issues to report for users with blocks\n'
+        )
+
     def test_block_booking_report_with_no_issues(self):
         self.user1_booking_not_on_block.delete()
         management.call_command('block_bookings_report')
@@ -3184,6 +3296,26 @@ class TestFindNoShows(TestCase):
         assert f"{3}: {user.first_name} {user.last_name} - (id {user.id})" in mail.outbox[1].body
         assert f"{user1.first_name} {user1.last_name} - (id {user1.id})" not in mail.outbox[1].body
 
+    def test_find_no_shows_ordering_and_bookings(self):
+        now = timezone.now()
+        user = baker.make(User)
+        user1 = baker.make(User)
+        for repeat_user, num_no_shows in [(user, 3), (user1, 4)]:
+            baker.make(
+                Booking, user=repeat_user, event__date=now - timedelta(3), event__name="no show class",
+                status="OPEN", no_show=True, instructor_confirmed_no_show=True, paid=True,
+                _quantity=num_no_shows
+            )
+        with self.assertNumQueries(3):
+            # aggregate, users, prefetched bookings
+            management.call_command("find_no_shows")
+        body = mail.outbox[0].body
+        user_message = f"3: {user.first_name} {user.last_name} - (id {user.id})"
+        user1_message = f"4: {user1.first_name} {user1.last_name} - (id {user1.id})"
+        # most no-shows first
+        assert body.index(user1_message) < body.index(user_message)
+        assert body.count("no show class") == 7
+
 
 @pytest.mark.django_db
 def test_update_prices(tmp_path):
@@ -3437,3 +3569,75 @@ def test_cancel_setup_pending_subscriptions_mismatched_start_date(mock_cancel, m
     assert UserMembership.objects.count() == 1
     um.refresh_from_db()
     assert um.subscription_status == "setup_pending"
+
+
+@pytest.mark.django_db
+def test_reallocate_membership_bookings_nothing_to_do(seller):
+    out = StringIO()
+    management.call_command("reallocate_membership_bookings", stdout=out)
+    assert "No memberships pending reallocation" in out.getvalue()
+
+
+@pytest.mark.django_db
+@pytest.mark.freeze_time("2024-02-26")
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+def test_reallocate_membership_bookings(seller):
+    user_membership = baker.make(
+        UserMembership, membership__name="foo", subscription_status="active",
+        start_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        end_date=datetime(2024, 3, 1, tzinfo=dt_timezone.utc),
+        reallocation_pending=True,
+    )
+    # not flagged, not reallocated
+    other_user_membership = baker.make(
+        UserMembership, membership=user_membership.membership, subscription_status="active",
+        start_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        end_date=datetime(2024, 3, 1, tzinfo=dt_timezone.utc),
+    )
+    event = baker.make_recipe("booking.future_PP", date=datetime(2024, 2, 28, tzinfo=dt_timezone.utc))
+    next_event = baker.make_recipe(
+        "booking.future_PP", event_type=event.event_type, date=datetime(2024, 3, 10, tzinfo=dt_timezone.utc)
+    )
+    baker.make(
+        "booking.MembershipItem", event_type=event.event_type, quantity=4, membership=user_membership.membership
+    )
+    booking = baker.make_recipe("booking.booking", user=user_membership.user, event=event, membership=user_membership)
+    booking_next = baker.make_recipe(
+        "booking.booking", user=user_membership.user, event=next_event, membership=user_membership
+    )
+    other_booking_next = baker.make_recipe(
+        "booking.booking", user=other_user_membership.user, event=next_event, membership=other_user_membership
+    )
+
+    management.call_command("reallocate_membership_bookings")
+    for obj in [user_membership, other_user_membership, booking, booking_next, other_booking_next]:
+        obj.refresh_from_db()
+
+    assert not user_membership.reallocation_pending
+    assert booking.membership == user_membership
+    assert booking_next.membership is None
+    assert not booking_next.paid
+    assert other_booking_next.membership == other_user_membership
+    assert ActivityLog.objects.filter(
+        log=f"Booking {booking_next.id} (user {user_membership.user.username}) for cancelled membership set to unpaid"
+    ).count() == 1
+
+    # running again does nothing
+    management.call_command("reallocate_membership_bookings")
+    assert ActivityLog.objects.filter(
+        log=f"Booking {booking_next.id} (user {user_membership.user.username}) for cancelled membership set to unpaid"
+    ).count() == 1
+
+
+@pytest.mark.django_db
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+@patch("booking.management.commands.reallocate_membership_bookings.UserMembership.reallocate_bookings")
+def test_reallocate_membership_bookings_error(mock_reallocate, seller):
+    mock_reallocate.side_effect = Exception("error")
+    user_membership = baker.make(
+        UserMembership, membership__name="foo", subscription_status="canceled", reallocation_pending=True,
+    )
+    management.call_command("reallocate_membership_bookings")
+    # still flagged for the next run
+    user_membership.refresh_from_db()
+    assert user_membership.reallocation_pending
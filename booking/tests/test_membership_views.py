@@ -173,8 +173,12 @@ def test_membership_create_post(client, seller, configured_user, purchasable_mem
 
 
 @patch("booking.models.membership_models.StripeConnector", MockConnector)
-def test_membership_checkout_no_seller(client, configured_stripe_user, purchasable_membership):
-    Seller.objects.all().delete()
+def test_membership_checkout_no_seller(
+    client, configured_stripe_user, purchasable_membership, django_capture_on_commit_callbacks
+):
+    # the cached seller is cleared when the delete is committed
+    with django_capture_on_commit_callbacks(execute=True):
+        Seller.objects.all().delete()
     # membership checkout page, with data from membership selection page
     client.force_login(configured_stripe_user)
     resp = client.post(checkout_url, {"membership": purchasable_membership.id, "backdate": 1})
@@ -13,8 +13,8 @@ from model_bakery import baker
 import pytest
 
 from booking.models import AllowedGroup, Banner, Event, EventType, Block, BlockType, BlockTypeError, \
-    Booking, TicketBooking, Ticket, TicketBookingError, BlockVoucher, \
-    EventVoucher, GiftVoucherType, FilterCategory, UsedBlockVoucher, UsedEventVoucher
+    Booking, TicketBooking, Ticket, TicketBookingError, TicketedEvent, TicketReservation, BlockVoucher, \
+    EventVoucher, GiftVoucherType, FilterCategory, UsedBlockVoucher, UsedEventVoucher, VoucherRedemptionError
 from common.tests.helpers import PatchRequestMixin
 from stripe_payments.tests.mock_connector import MockConnector
 
@@ -548,7 +548,9 @@ class BookingTests(PatchRequestMixin, TestCase):
         booking.save()
 
         assert booking.cost_with_voucher == 10
-        booking.voucher_code is None
+        # cost_with_voucher doesn't save the booking
+        booking.refresh_from_db()
+        assert booking.voucher_code == "unk"
 
         voucher = EventVoucher.objects.create(code="foo", discount=10)
         voucher.event_types.add(event.event_type)
@@ -1162,6 +1164,62 @@ class TicketBookingTests(TestCase):
         self.assertEqual(event_tickets.count(), 10)
         self.assertEqual(self.ticketed_event.tickets_left(), 5)
 
+    def test_event_tickets_left_with_tickets_booked(self):
+        other_event = baker.make_recipe('booking.ticketed_event_max10')
+        for ticketed_event, confirmed, cancelled in [
+            (self.ticketed_event, True, False),
+            (self.ticketed_event, True, True),
+            (self.ticketed_event, False, False),
+            (other_event, True, False),
+        ]:
+            ticket_booking = baker.make(
+                TicketBooking, ticketed_event=ticketed_event,
+                purchase_confirmed=confirmed, cancelled=cancelled
+            )
+            baker.make(Ticket, ticket_booking=ticket_booking, _quantity=3)
+        empty_event = baker.make_recipe('booking.ticketed_event_max10')
+
+        ticketed_events = TicketedEvent.objects.filter(
+            id__in=[self.ticketed_event.id, other_event.id, empty_event.id]
+        ).with_tickets_booked().order_by('id')
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [ticketed_event.tickets_left() for ticketed_event in ticketed_events],
+                [7, 7, 10]
+            )
+            self.assertEqual(
+                [ticketed_event.bookable() for ticketed_event in ticketed_events],
+                [True, True, True]
+            )
+
+    def test_event_tickets_left_counts_held_tickets(self):
+        ticket_booking = baker.make(TicketBooking, ticketed_event=self.ticketed_event)
+        ticket_booking.set_ticket_quantity(3)
+        self.assertEqual(ticket_booking.tickets.count(), 3)
+        self.assertEqual(ticket_booking.tickets_held(), 3)
+        self.assertEqual(self.ticketed_event.tickets_left(), 7)
+        self.assertEqual(
+            TicketedEvent.objects.with_tickets_booked().get(id=self.ticketed_event.id).tickets_left(), 7
+        )
+
+        # can't select more tickets than are left, including this booking's held tickets
+        with self.assertRaises(TicketBookingError):
+            ticket_booking.set_ticket_quantity(11)
+        ticket_booking.set_ticket_quantity(10)
+        self.assertEqual(self.ticketed_event.tickets_left(), 0)
+
+        # expired reservations don't hold tickets
+        TicketReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        ticket_booking.refresh_from_db()
+        self.assertEqual(ticket_booking.tickets_held(), 0)
+        self.assertEqual(self.ticketed_event.tickets_left(), 10)
+
+        # confirming the purchase releases the reservation and counts the tickets as booked
+        ticket_booking.set_ticket_quantity(4)
+        ticket_booking.confirm_purchase(date_booked=timezone.now())
+        self.assertFalse(TicketReservation.objects.exists())
+        self.assertEqual(self.ticketed_event.tickets_left(), 6)
+
     def test_event_tickets_left_does_not_count_unconfirmed_purchases(self):
         self.assertEqual(self.ticketed_event.max_tickets, 10)
         self.assertEqual(self.ticketed_event.tickets_left(), 10)
@@ -1396,8 +1454,108 @@ class VoucherTests(TestCase):
         voucher = baker.make(EventVoucher, code="testcode")
         self.assertEqual(str(voucher), 'testcode')
 
+    def test_get_by_code(self):
+        voucher = baker.make(EventVoucher, code="Foo")
+        assert EventVoucher.objects.get_by_code("foo") == voucher
+        assert EventVoucher.objects.get_by_code(" FOO ") == voucher
+        # cached voucher id, fetched by id
+        with self.assertNumQueries(1):
+            assert EventVoucher.objects.get_by_code("foo") == voucher
+
+        with pytest.raises(EventVoucher.DoesNotExist):
+            EventVoucher.objects.get_by_code("")
+
+    def test_get_by_code_unknown_code_cached(self):
+        with pytest.raises(EventVoucher.DoesNotExist):
+            EventVoucher.objects.get_by_code("unk")
+        with self.assertNumQueries(0):
+            with pytest.raises(EventVoucher.DoesNotExist):
+                EventVoucher.objects.get_by_code("unk")
+
+        # creating a voucher with the code clears the cached miss
+        voucher = baker.make(EventVoucher, code="unk")
+        assert EventVoucher.objects.get_by_code("unk") == voucher
+        # block vouchers are cached separately
+        with pytest.raises(BlockVoucher.DoesNotExist):
+            BlockVoucher.objects.get_by_code("unk")
+
+    def test_get_by_code_changed_code(self):
+        voucher = baker.make(BlockVoucher, code="foo")
+        assert BlockVoucher.objects.get_by_code("foo") == voucher
+        voucher.code = "bar"
+        voucher.save()
+        with pytest.raises(BlockVoucher.DoesNotExist):
+            BlockVoucher.objects.get_by_code("foo")
+        assert BlockVoucher.objects.get_by_code("bar") == voucher
+
+    def test_code_unique_case_insensitive(self):
+        baker.make(EventVoucher, code="foo")
+        voucher = EventVoucher(code="FOO", discount=10)
+        with pytest.raises(ValidationError, match="Voucher with this code already exists"):
+            voucher.validate_constraints()
 
-class GiftVoucherTypeTests(TestCase):
+    def test_times_used_updated_by_used_vouchers(self):
+        voucher = baker.make(EventVoucher)
+        block_voucher = baker.make(BlockVoucher)
+        used = baker.make(UsedEventVoucher, voucher=voucher, _quantity=2)
+        baker.make(UsedBlockVoucher, voucher=block_voucher)
+        voucher.refresh_from_db()
+        block_voucher.refresh_from_db()
+        assert voucher.times_used == 2
+        assert block_voucher.times_used == 1
+
+        used[0].delete()
+        voucher.refresh_from_db()
+        assert voucher.times_used == 1
+
+    def test_redeem(self):
+        user = baker.make_recipe("booking.user")
+        voucher = baker.make(EventVoucher, max_vouchers=2, max_per_user=1)
+        used_voucher = voucher.redeem(user, booking_id="1")
+        assert used_voucher.voucher == voucher
+        assert used_voucher.booking_id == "1"
+        # counted once
+        voucher.refresh_from_db()
+        assert voucher.times_used == 1
+
+        # max per user
+        with pytest.raises(VoucherRedemptionError, match="already been used the maximum number of times"):
+            voucher.redeem(user, booking_id="2")
+        voucher.refresh_from_db()
+        assert voucher.times_used == 1
+        assert UsedEventVoucher.objects.filter(voucher=voucher).count() == 1
+
+        voucher.redeem(baker.make_recipe("booking.user"), booking_id="3")
+        # max total
+        with pytest.raises(VoucherRedemptionError, match="reached its maximum number of uses"):
+            voucher.redeem(baker.make_recipe("booking.user"), booking_id="4")
+        voucher.refresh_from_db()
+        assert voucher.times_used == 2
+        assert voucher.max_vouchers_reached
+
+    def test_redeem_no_limits(self):
+        user = baker.make_recipe("booking.user")
+        voucher = baker.make(BlockVoucher, max_vouchers=None, max_per_user=None)
+        for i in range(3):
+            voucher.redeem(user, block_id=str(i))
+        voucher.refresh_from_db()
+        assert voucher.times_used == 3
+        assert voucher.times_used_by_user(user) == 3
+        assert not voucher.max_vouchers_reached
+
+    def test_saving_stale_voucher_keeps_times_used(self):
+        voucher = baker.make(EventVoucher, max_vouchers=None, max_per_user=None)
+        stale_voucher = EventVoucher.objects.get(id=voucher.id)
+        voucher.redeem(baker.make_recipe("booking.user"), booking_id="1")
+        baker.make(UsedEventVoucher, voucher=voucher)
+
+        stale_voucher.discount = 20
+        stale_voucher.save()
+        stale_voucher.mark_checked()
+        voucher.refresh_from_db()
+        assert voucher.discount == 20
+        assert voucher.checkout_time is not None
+        assert voucher.times_used == 2
 
     def test_event_type_or_block_type_required(self):
 
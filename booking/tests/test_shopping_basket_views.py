@@ -8,9 +8,11 @@ from urllib.parse import urlsplit
 from unittest.mock import patch
 
 from django.core import mail
+from django.db import connection
 from django.contrib.sites.models import Site
 from django.urls import reverse
 from django.test import override_settings, TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from accounts.models import DataPrivacyPolicy
@@ -64,6 +66,29 @@ class ShoppingBasketViewTests(TestSetupMixin, TestCase):
         resp = self.client.get(self.url)
         self.assertEqual(resp.status_code, 200)
 
+    def test_number_of_queries_does_not_depend_on_number_of_bookings(self):
+        self.voucher.event_types.add(*Event.objects.values_list("event_type", flat=True).distinct())
+        url = self.url + "?booking_code=foo"
+        # first request caches user/disclaimer/basket count data used by the base template
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url)
+        assert len(resp.context['voucher_applied_bookings']) == 6
+
+        baker.make_recipe(
+            'booking.booking', event__event_type__event_type='CL',
+            event__date=timezone.now() + timedelta(3),
+            event__cost=8,
+            user=self.user, _quantity=4
+        )
+        self.voucher.event_types.add(*Event.objects.values_list("event_type", flat=True).distinct())
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as more_queries:
+            resp = self.client.get(url)
+        assert len(resp.context['voucher_applied_bookings']) == 10
+        assert resp.context['total_unpaid_booking_cost'] == Decimal("72.00")
+        assert len(more_queries) == len(queries)
+
     def test_data_privacy_required(self):
         # if one exists, user must have signed it
         baker.make(DataPrivacyPolicy, version=None)
@@ -1071,6 +1096,24 @@ class SubmitZeroBookingPaymentViewTests(TestSetupMixin, TestCase):
         # no blocks to pay for, so return to booking page
         self.assertEqual(resp.url, reverse('booking:bookings'))
 
+    def test_submit_zero_booking_payment_voucher_used_up(self):
+        booking = baker.make_recipe(
+            'booking.booking', user=self.user, event=self.pc1, paid=False
+        )
+        self.gift_voucher.event_types.add(booking.event.event_type)
+        self.gift_voucher.max_vouchers = 1
+        self.gift_voucher.save()
+        # voucher was used by someone else after the basket was loaded
+        baker.make(UsedEventVoucher, voucher=self.gift_voucher)
+        resp = self.client.post(
+            self.url,
+            {'booking_code': 'gift', 'unpaid_booking_ids': json.dumps([booking.id])}
+        )
+        booking.refresh_from_db()
+        self.assertFalse(booking.paid)
+        self.assertEqual(UsedEventVoucher.objects.filter(voucher=self.gift_voucher).count(), 1)
+        self.assertEqual(resp.url, reverse('booking:shopping_basket') + '?booking_code=gift')
+
     def test_submit_zero_booking_payment_with_unpaid_block(self):
         booking = baker.make_recipe(
             'booking.booking', user=self.user, event=self.pc1, paid=False
@@ -14,7 +14,8 @@ from django.http.response import Http404
 from django.test import override_settings, TestCase
 from django.utils import timezone
 
-from booking.models import TicketedEvent, TicketBooking, Ticket, TicketedEventWaitingListUser
+from booking.models import TicketedEvent, TicketBooking, Ticket, TicketedEventWaitingListUser, \
+    TicketReservation
 from booking.views import TicketedEventListView, TicketCreateView, \
     TicketBookingListView, TicketBookingHistoryListView, TicketBookingView, \
     TicketBookingCancelView
@@ -519,6 +520,92 @@ class TicketCreateViewTests(TestSetupMixin, TestCase):
             resp.rendered_content
         )
 
+    def test_selecting_quantity_holds_tickets(self):
+        tb = baker.make(
+            TicketBooking, user=self.user, ticketed_event=self.ticketed_event
+        )
+        self._post_response(
+            self.user, self.ticketed_event,
+            {'ticket_purchase_form-quantity': 6, 'ticket_booking_id': tb.id}
+        )
+        reservation = TicketReservation.objects.get(ticket_booking=tb)
+        self.assertEqual(reservation.quantity, 6)
+        self.assertTrue(reservation.is_active)
+        self.assertEqual(self.ticketed_event.tickets_left(), 4)
+
+        # another user can't book the held tickets
+        tb1 = baker.make(
+            TicketBooking, user=self.staff_user, ticketed_event=self.ticketed_event
+        )
+        resp = self._post_response(
+            self.staff_user, self.ticketed_event,
+            {'ticket_purchase_form-quantity': 5, 'ticket_booking_id': tb1.id}
+        )
+        self.assertEqual(tb1.tickets.count(), 0)
+        self.assertIn(
+            'Cannot purchase the number of tickets requested.  Only 4 tickets '
+            'left',
+            resp.rendered_content
+        )
+
+        # confirming the purchase releases the reservation
+        self._post_response(
+            self.user, self.ticketed_event,
+            {
+                'ticket_booking_id': tb.id,
+                'ticket_formset-MIN_NUM_FORMS': 0,
+                'ticket_formset-TOTAL_FORMS': 6,
+                'ticket_formset-INITIAL_FORMS': 6,
+                **{
+                    f'ticket_formset-{i}-id': ticket.id
+                    for i, ticket in enumerate(tb.tickets.all())
+                },
+                'ticket_formset-submit': 'Confirm purchase',
+            }
+        )
+        tb.refresh_from_db()
+        self.assertTrue(tb.purchase_confirmed)
+        self.assertFalse(TicketReservation.objects.exists())
+        self.assertEqual(self.ticketed_event.tickets_left(), 4)
+
+    def test_cannot_confirm_purchase_after_reservation_expired_and_tickets_sold(self):
+        tb = baker.make(
+            TicketBooking, user=self.user, ticketed_event=self.ticketed_event
+        )
+        self._post_response(
+            self.user, self.ticketed_event,
+            {'ticket_purchase_form-quantity': 2, 'ticket_booking_id': tb.id}
+        )
+        TicketReservation.objects.filter(ticket_booking=tb).update(
+            expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        # someone else books the remaining tickets once the reservation has expired
+        tb1 = baker.make(
+            TicketBooking, user=self.staff_user, ticketed_event=self.ticketed_event,
+            purchase_confirmed=True
+        )
+        baker.make(Ticket, ticket_booking=tb1, _quantity=9)
+
+        resp = self._post_response(
+            self.user, self.ticketed_event,
+            {
+                'ticket_booking_id': tb.id,
+                'ticket_formset-MIN_NUM_FORMS': 0,
+                'ticket_formset-TOTAL_FORMS': 2,
+                'ticket_formset-INITIAL_FORMS': 2,
+                'ticket_formset-0-id': tb.tickets.all()[0].id,
+                'ticket_formset-1-id': tb.tickets.all()[1].id,
+                'ticket_formset-submit': 'Confirm purchase',
+            }
+        )
+        tb.refresh_from_db()
+        self.assertFalse(tb.purchase_confirmed)
+        self.assertIn(
+            'Your ticket reservation has expired and there are not enough tickets left '
+            'for this purchase. Only 1 tickets left.',
+            format_content(resp.rendered_content)
+        )
+
     def test_cancelling_during_ticket_booking_deletes_booking_and_tickets(self):
         tb = baker.make(
             TicketBooking, user=self.user, ticketed_event=self.ticketed_event
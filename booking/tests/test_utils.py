@@ -1,12 +1,16 @@
+import time
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from datetime import datetime, timedelta
 from datetime import timezone as dt_timezone
 
 from model_bakery import baker
 
-from booking.models import Event
-from booking.utils import create_classes, upload_timetable
+from booking.models import Event, FilterCategory
+from booking.utils import create_classes, materialize_timetable, upload_timetable
 from timetable.models import Session
 
 
@@ -234,6 +238,78 @@ class UtilsTests(TestCase):
         self.assertEqual(wed_classes.count(), 0)
         self.assertEqual(Event.objects.count(), 3)
 
+    def test_materialize_timetable_report(self):
+        start_date = datetime(2016, 3, 21, tzinfo=dt_timezone.utc) # monday
+        end_date = datetime(2016, 3, 22, tzinfo=dt_timezone.utc) # tuesday
+        category = baker.make(FilterCategory, category="Pole")
+        mon_session = baker.make_recipe('booking.mon_session', categories=[category])
+        tue_session = baker.make_recipe('booking.tue_session')
+        sessions = Session.objects.all()
+
+        report = materialize_timetable(sessions, start_date, end_date)
+        self.assertEqual(len(report["created"]), 2)
+        self.assertEqual(report["existing"], [])
+        mon_event = Event.objects.get(name=mon_session.name, date__lt=end_date)
+        self.assertEqual(list(mon_event.categories.all()), [category])
+        tue_event = Event.objects.get(name=tue_session.name, date__gte=end_date)
+        self.assertFalse(tue_event.categories.exists())
+
+        # a duplicate of an existing class
+        baker.make(
+            Event, name=tue_event.name, event_type=tue_event.event_type,
+            date=tue_event.date, location=tue_event.location
+        )
+        report = materialize_timetable(sessions, start_date, end_date)
+        self.assertEqual(report["created"], [])
+        self.assertEqual(sorted(report["existing"], key=lambda ev: ev.id), [mon_event, tue_event])
+        self.assertEqual(report["duplicates"], [{'class': tue_event, 'count': 2}])
+
+    def test_materialize_timetable_unique_slugs(self):
+        # long names are truncated in the slug, so events on different dates
+        # created together must still get different slugs
+        baker.make_recipe(
+            'booking.mon_session', name="A very long class name that fills the slug"
+        )
+        start_date = datetime(2016, 3, 21, tzinfo=dt_timezone.utc)
+        baker.make(Event, name="A very long class name that fills the slug")
+        materialize_timetable(
+            Session.objects.all(), start_date, start_date + timedelta(weeks=3)
+        )
+        slugs = Event.objects.values_list("slug", flat=True)
+        self.assertEqual(len(slugs), 5)
+        self.assertEqual(len(set(slugs)), 5)
+
+    def test_upload_12_week_timetable(self):
+        """
+        Benchmark uploading a term's timetable: the number of queries doesn't
+        depend on the number of weeks or classes
+        """
+        categories = baker.make(FilterCategory, _quantity=2)
+        for recipe in [
+            'booking.mon_session', 'booking.tue_session', 'booking.wed_session'
+        ]:
+            baker.make_recipe(recipe, categories=categories, _quantity=5)
+        session_ids = Session.objects.values_list("id", flat=True)
+        start_date = datetime(2016, 3, 21, tzinfo=dt_timezone.utc)
+
+        with CaptureQueriesContext(connection) as one_week_queries:
+            upload_timetable(start_date, start_date + timedelta(days=6), session_ids)
+        self.assertEqual(Event.objects.count(), 15)
+
+        start = time.time()
+        with CaptureQueriesContext(connection) as twelve_week_queries:
+            created, existing, _ = upload_timetable(
+                start_date, start_date + timedelta(weeks=12, days=-1), session_ids
+            )
+        elapsed = time.time() - start
+
+        self.assertEqual(len(created), 11 * 15)
+        self.assertEqual(len(existing), 15)
+        self.assertEqual(Event.objects.count(), 12 * 15)
+        self.assertEqual(Event.categories.through.objects.count(), 12 * 15 * 2)
+        self.assertEqual(len(twelve_week_queries), len(one_week_queries))
+        self.assertLess(elapsed, 5)
+
     def _start_of_day(self, date):
         return date.replace(hour=0, minute=0, second=0, microsecond=0)
 
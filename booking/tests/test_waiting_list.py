@@ -3,9 +3,11 @@ from model_bakery import baker
 from django.conf import settings
 from django.contrib.messages.storage.fallback import FallbackStorage
 from django.core import mail
+from django.core.cache import cache
 from django.urls import reverse
 from django.test import TestCase, override_settings
 
+from booking.email_helpers import _get_auto_book_user, waiting_list_email_cache_key
 from booking.models import Booking, WaitingListUser
 from common.tests.helpers import TestSetupMixin
 
@@ -28,7 +30,8 @@ class WaitingListTests(TestSetupMixin, TestCase):
 
     def _booking_delete(self, booking):
         url = reverse('booking:delete_booking', args=[booking.id])
-        self.client.post(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url)
 
     def test_waiting_list_button_on_events_list(self):
         """
@@ -607,6 +610,59 @@ class WaitingListTests(TestSetupMixin, TestCase):
             assert text in  mail.outbox[-1].body
 
 
+    def test_waiting_list_email_debounced(self):
+        """
+        Repeated cancellations for the same event in quick succession only
+        email the waiting list once
+        """
+        event = baker.make_recipe('booking.future_PC', max_participants=3)
+        baker.make_recipe('booking.booking', event=event, _quantity=2)
+        booking = baker.make_recipe('booking.booking', user=self.user, event=event)
+        baker.make_recipe(
+            'booking.waiting_list_user', event=event, user__email='test@test.com'
+        )
+
+        self._booking_delete(booking)
+        # cancel email and waiting list email
+        assert len(mail.outbox) == 2
+        assert mail.outbox[1].bcc == ['test@test.com']
+
+        booking.status = "OPEN"
+        booking.save()
+        self._booking_delete(booking)
+        # cancel email only
+        assert len(mail.outbox) == 3
+        assert mail.outbox[2].to == [self.user.email]
+
+        # waiting list is emailed again after the debounce period
+        cache.delete(waiting_list_email_cache_key(event))
+        booking.status = "OPEN"
+        booking.save()
+        self._booking_delete(booking)
+        assert len(mail.outbox) == 5
+        assert mail.outbox[4].bcc == ['test@test.com']
+
+    @override_settings(AUTO_BOOK_EMAILS=['foo@test.com', 'bar@test.com', 'baz@test.com'])
+    def test_auto_book_users_fetched_in_one_query(self):
+        event = baker.make_recipe('booking.future_PC', max_participants=3)
+        waiting_list_users = [
+            baker.make_recipe('booking.user', email=email)
+            for email in ['test@test.com', 'foo@test.com', 'bar@test.com', 'baz@test.com']
+        ]
+        # first auto book user is already booked
+        baker.make_recipe('booking.booking', event=event, user=waiting_list_users[1])
+        for user in waiting_list_users:
+            baker.make_recipe('booking.waiting_list_user', event=event, user=user)
+
+        # auto book users, delete the already booked user from the waiting list
+        with self.assertNumQueries(2):
+            user_emails = [user.email for user in waiting_list_users]
+            auto_book_user, reopen_booking = _get_auto_book_user(event, user_emails)
+        assert auto_book_user == waiting_list_users[2]
+        assert not reopen_booking
+        assert user_emails == ['test@test.com', 'bar@test.com', 'baz@test.com']
+        assert not WaitingListUser.objects.filter(event=event, user=waiting_list_users[1]).exists()
+
 class ToggleWaitingListTests(TestSetupMixin, TestCase):
 
     def test_join_waiting_list(self):
@@ -1,177 +1,258 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import operator
 import pytz
 
+from collections import defaultdict
 from datetime import timedelta, datetime, date
-from booking.models import Event, FilterCategory
-from timetable.models import Session
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from booking.models import Event
+from timetable.models import Session, TimetableUploadJob
 from activitylog.models import ActivityLog
 
 
 logger = logging.getLogger(__name__)
 
+DAYLIST = ['01MON', '02TUE', '03WED', '04THU', '05FRI', '06SAT', '07SUN']
 
-def create_classes(week='this', input_date=None):
+
+def get_timetable_slots(sessions, start_date, end_date):
     """
-    Creates a week's classes (mon-sun) from any given date.  Will create classes
-    in the past if the date given is after Monday and week is "this".
-    If no date is given, creates classes for the current week, or the next week.
+    Return a list of (session, date) for each session that falls between start_date
+    and end_date (inclusive).  Session times are Europe/London; dates are returned in UTC.
     """
-    if not input_date:
-        input_date = date.today()
-    if week == 'next':
-        input_date = input_date + timedelta(7)
+    localtz = pytz.timezone('Europe/London')
+    sessions_by_day = defaultdict(list)
+    for session in sessions:
+        sessions_by_day[session.day].append(session)
 
-    mon = input_date - timedelta(days=input_date.weekday())
-    tues = mon + timedelta(days=1)
-    wed = mon + timedelta(days=2)
-    thurs = mon + timedelta(days=3)
-    fri = mon + timedelta(days=4)
-    sat = mon + timedelta(days=5)
-    sun = mon + timedelta(days=6)
+    slots = []
+    d = start_date
+    while d <= end_date:
+        for session in sessions_by_day[DAYLIST[d.weekday()]]:
+            # create date in Europe/London, convert to UTC
+            local_date = localtz.localize(datetime.combine(d, session.time))
+            slots.append((session, local_date.astimezone(pytz.utc)))
+        d += timedelta(days=1)
+    return slots
 
-    date_dict = {
-        '01MON': mon,
-        '02TUE': tues,
-        '03WED': wed,
-        '04THU': thurs,
-        '05FRI': fri,
-        '06SAT': sat,
-        '07SUN': sun}
 
-    timetable = Session.objects.all()
+def _set_unique_slugs(events):
+    """
+    Set slugs for new events before they are bulk created.  Event slugs are only
+    checked against saved events, so events in the same batch could otherwise be
+    given the same (truncated) slug.
+    """
+    max_length = Event._meta.get_field("slug").max_length
+    base_slugs = [
+        slugify(f"{event.name} {event.date}")[:max_length].strip("-") for event in events
+    ]
+    # fetch any existing slugs that could clash, allowing for a numeric suffix
+    prefixes = {base_slug[:max_length - 4] for base_slug in base_slugs}
+    taken = set(
+        Event.objects.filter(
+            reduce(operator.or_, [Q(slug__startswith=prefix) for prefix in prefixes])
+        ).values_list("slug", flat=True)
+    )
+    for event, base_slug in zip(events, base_slugs):
+        slug = base_slug
+        i = 2
+        while slug in taken:
+            suffix = f"-{i}"
+            slug = base_slug[:max_length - len(suffix)].strip("-") + suffix
+            i += 1
+        taken.add(slug)
+        event.slug = slug
 
-    created_classes = []
-    existing_classes = []
 
-    for session in timetable:
+def materialize_timetable(sessions, start_date, end_date, override_options=None):
+    """
+    Create events for each session between start_date and end_date (inclusive).
+    An event already exists for a session if there is one with the same name,
+    event type, date and location; these are all found with a single query, and
+    missing events and their categories are bulk created.
 
-        # create date in Europe/London, convert to UTC
-        localtz = pytz.timezone('Europe/London')
-        local_date = localtz.localize(
-            datetime.combine(date_dict[session.day], session.time)
-        )
-        converted_date = local_date.astimezone(pytz.utc)
+    Returns a report dict with the lists of created and existing events, and
+    duplicates: existing events that match more than one event, as dicts of
+    {'class': event, 'count': number of matching events}
+    """
+    override_options = override_options or {}
+    sessions = list(sessions)
+    slots = get_timetable_slots(sessions, start_date, end_date)
+    report = {"created": [], "existing": [], "duplicates": []}
+    if not slots:
+        return report
+
+    def _key(name, event_type_id, event_date, location):
+        return name, event_type_id, event_date, location
 
-        cl, created = Event.objects.get_or_create(
+    existing_events = defaultdict(list)
+    for event in Event.objects.filter(
+        event_type_id__in={session.event_type_id for session in sessions},
+        name__in={session.name for session in sessions},
+        date__in={slot_date for _, slot_date in slots},
+    ).order_by("id"):
+        existing_events[_key(event.name, event.event_type_id, event.date, event.location)].append(event)
+
+    new_events = []
+    for session, slot_date in slots:
+        existing = existing_events[_key(session.name, session.event_type_id, slot_date, session.location)]
+        if existing:
+            if len(existing) > 1:
+                report["duplicates"].append({'class': existing[0], 'count': len(existing)})
+            report["existing"].append(existing[0])
+            continue
+        event = Event(
             name=session.name,
-            event_type=session.event_type,
-            date=converted_date,
+            event_type_id=session.event_type_id,
+            date=slot_date,
+            location=session.location,
             description=session.description,
             max_participants=session.max_participants,
-            location=session.location,
             contact_person=session.contact_person,
             contact_email=session.contact_email,
             cost=session.cost,
-            payment_open=session.payment_open,
+            payment_open=override_options.get("payment_open", session.payment_open),
             advance_payment_required=session.advance_payment_required,
-            booking_open=session.booking_open,
+            booking_open=override_options.get("booking_open", session.booking_open),
             payment_info=session.payment_info,
             cancellation_period=session.cancellation_period,
             external_instructor=session.external_instructor,
             email_studio_when_booked=session.email_studio_when_booked,
-            allow_booking_cancellation=session.allow_booking_cancellation,
             payment_time_allowed=session.payment_time_allowed,
-            paypal_email=session.paypal_email
+            allow_booking_cancellation=session.allow_booking_cancellation,
+            paypal_email=session.paypal_email,
+            visible_on_site=override_options.get("visible_on_site", True),
+        )
+        event.set_payment_and_booking_options()
+        # don't create the same event twice if a session is selected more than once
+        existing.append(event)
+        new_events.append((session, event))
+
+    if new_events:
+        events = [event for _, event in new_events]
+        _set_unique_slugs(events)
+        Event.objects.bulk_create(events)
+        EventCategory = Event.categories.through
+        EventCategory.objects.bulk_create(
+            [
+                EventCategory(event_id=event.id, filtercategory_id=category.id)
+                for session, event in new_events
+                for category in session.categories.all()
+            ]
         )
-        if created:
-            created_classes.append(cl)
-            for timetable_category in session.categories.all():
-                cat, _ = FilterCategory.objects.get_or_create(category=timetable_category.category)
-                cl.categories.add(cat)
-        else:
-            existing_classes.append(cl)
-
-    if created_classes:
+        report["created"] = events
+    return report
+
+
+def create_classes(week='this', input_date=None):
+    """
+    Creates a week's classes (mon-sun) from any given date.  Will create classes
+    in the past if the date given is after Monday and week is "this".
+    If no date is given, creates classes for the current week, or the next week.
+    """
+    if not input_date:
+        input_date = date.today()
+    if week == 'next':
+        input_date = input_date + timedelta(7)
+
+    mon = input_date - timedelta(days=input_date.weekday())
+    sun = mon + timedelta(days=6)
+
+    report = materialize_timetable(
+        Session.objects.prefetch_related("categories"), mon, sun
+    )
+    if report["created"]:
         ActivityLog.objects.create(
             log='Classes created from timetable for week beginning {}'.format(
                 mon.strftime('%A %d %B %Y')
             )
         )
-    return created_classes, existing_classes
+    return report["created"], report["existing"]
 
 
-def upload_timetable(start_date, end_date, session_ids, user=None, override_options=None):
+def _parse_override_options(override_options):
     override_options = override_options or {}
-    override_options = {
+    return {
         field: bool(int(value)) for field, value in override_options.items() if value != "default"
     }
-    daylist = [
-        '01MON',
-        '02TUE',
-        '03WED',
-        '04THU',
-        '05FRI',
-        '06SAT',
-        '07SUN'
-        ]
-
-    created_classes = []
-    existing_classes = []
-    duplicate_classes = []
 
-    d = start_date
-    delta = timedelta(days=1)
-    while d <= end_date:
-        sessions_to_create = Session.objects.filter(
-            day=daylist[d.weekday()], id__in=session_ids
+
+def _log_timetable_upload(start_date, end_date, user=None):
+    ActivityLog.objects.create(
+        log='Timetable uploaded for {} to {} {}'.format(
+            start_date.strftime('%a %d %B %Y'),
+            end_date.strftime('%a %d %B %Y'),
+            'by admin user {}'.format(user.username) if user else ''
         )
-        for session in sessions_to_create:
+    )
 
-            # create date in Europe/London, convert to UTC
-            localtz = pytz.timezone('Europe/London')
-            local_date = localtz.localize(datetime.combine(d,
-                session.time))
-            converted_date = local_date.astimezone(pytz.utc)
-            existing = Event.objects.filter(
-                name=session.name,
-                event_type=session.event_type,
-                date=converted_date,
-                location=session.location
-            )
-            if not existing:
-                cl = Event.objects.create(
-                    name=session.name,
-                    event_type=session.event_type,
-                    date=converted_date,
-                    location=session.location,
-                    description=session.description,
-                    max_participants=session.max_participants,
-                    contact_person=session.contact_person,
-                    contact_email=session.contact_email,
-                    cost=session.cost,
-                    payment_open=override_options.get("payment_open", session.payment_open),
-                    advance_payment_required=session.advance_payment_required,
-                    booking_open=override_options.get("booking_open", session.booking_open),
-                    payment_info=session.payment_info,
-                    cancellation_period=session.cancellation_period,
-                    external_instructor=session.external_instructor,
-                    email_studio_when_booked=session.email_studio_when_booked,
-                    payment_time_allowed=session.payment_time_allowed,
-                    allow_booking_cancellation=session.allow_booking_cancellation,
-                    paypal_email=session.paypal_email,
-                    visible_on_site=override_options.get("visible_on_site", True),
+
+def upload_timetable(start_date, end_date, session_ids, user=None, override_options=None):
+    report = materialize_timetable(
+        Session.objects.filter(id__in=session_ids).prefetch_related("categories"),
+        start_date, end_date, override_options=_parse_override_options(override_options)
+    )
+
+    if report["created"]:
+        _log_timetable_upload(start_date, end_date, user)
+
+    return report["created"], report["existing"], report["duplicates"]
+
+
+def process_timetable_upload_job(job):
+    """
+    Run a TimetableUploadJob, one week at a time.  Each week's events are created
+    in their own transaction, along with the job's progress, so a job that fails
+    part way through keeps the weeks already done; if it's retried (from the
+    TimetableUploadJob admin), it's picked up from the week that failed.
+
+    Returns the list of events created by this run.
+    """
+    sessions = list(
+        Session.objects.filter(id__in=job.session_ids).prefetch_related("categories")
+    )
+    override_options = _parse_override_options(job.override_options)
+    created = []
+    try:
+        for week_start, week_end in job.week_ranges()[job.weeks_done:]:
+            with transaction.atomic():
+                report = materialize_timetable(
+                    sessions, week_start, week_end, override_options=override_options
                 )
-                for timetable_category in session.categories.all():
-                    cat, _ = FilterCategory.objects.get_or_create(category=timetable_category.category)
-                    cl.categories.add(cat)
-                created_classes.append(cl)
-            else:
-                if existing.count() > 1:
-                    duplicate_classes.append(
-                        {'class': existing[0], 'count': existing.count()}
-                    )
-                existing_classes.append(existing[0])
-        d += delta
-
-    if created_classes:
-        ActivityLog.objects.create(
-            log='Timetable uploaded for {} to {} {}'.format(
-                start_date.strftime('%a %d %B %Y'),
-                end_date.strftime('%a %d %B %Y'),
-                'by admin user {}'.format(user.username) if user else ''
-            )
-        )
+                job.created_event_ids += [event.id for event in report["created"]]
+                job.existing_event_ids += [event.id for event in report["existing"]]
+                job.duplicates += [
+                    {"id": duplicate["class"].id, "count": duplicate["count"]}
+                    for duplicate in report["duplicates"]
+                ]
+                job.weeks_done += 1
+                job.date_last_progress = timezone.now()
+                job.save(
+                    update_fields=[
+                        "created_event_ids", "existing_event_ids", "duplicates", "weeks_done",
+                        "date_last_progress",
+                    ]
+                )
+            created.extend(report["created"])
+    except Exception as e:
+        logger.exception("Error processing timetable upload job %s", job.id)
+        job.status = TimetableUploadJob.FAILED
+        job.error = str(e)
+        job.date_completed = timezone.now()
+        job.save(update_fields=["status", "error", "date_completed"])
+        return created
 
-    return created_classes, existing_classes, duplicate_classes
+    job.status = TimetableUploadJob.COMPLETE
+    job.date_completed = timezone.now()
+    job.save(update_fields=["status", "date_completed"])
+    if job.created_event_ids:
+        _log_timetable_upload(job.start_date, job.end_date, job.user)
+    return created
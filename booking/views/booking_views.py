@@ -34,12 +34,12 @@ from payments.models import PaypalBookingTransaction
 from accounts.models import has_expired_disclaimer, has_active_disclaimer
 
 from booking.models import (
-    Block, BlockType, Booking, Event, UsedEventVoucher, EventVoucher,
+    Block, BlockType, Booking, Event, EventVoucher,
     WaitingListUser
 )
 from booking.forms import VoucherForm
 import booking.context_helpers as context_helpers
-from booking.email_helpers import send_support_email, send_waiting_list_email
+from booking.email_helpers import notify_waiting_list, send_support_email
 from booking.views.shopping_basket_views import shopping_basket_bookings_total_context
 from booking.views.views_utils import DisclaimerRequiredMixin, \
     DataPolicyAgreementRequiredMixin, \
@@ -222,10 +222,7 @@ class BookingUpdateView(
                     float(paypal_cost) * ((100 - voucher.discount) / 100)
                 ).quantize(Decimal('.05'))
                 messages.info(self.request, 'Voucher has been applied')
-                times_used = UsedEventVoucher.objects.filter(
-                    voucher=voucher, user=self.request.user
-                ).count()
-                context['times_voucher_used'] = times_used
+                context['times_voucher_used'] = voucher.times_used_by_user(self.request.user)
 
         custom = context_helpers.get_paypal_custom(
             item_type='booking',
@@ -263,7 +260,7 @@ class BookingUpdateView(
         if "apply_voucher" in form.data:
             code = form.data['code'].strip()
             try:
-                voucher = EventVoucher.objects.get(code=code)
+                voucher = EventVoucher.objects.get_by_code(code)
             except EventVoucher.DoesNotExist:
                 voucher = None
                 voucher_error = 'Invalid code' if code else 'No code provided'
@@ -645,31 +642,10 @@ class BookingDeleteView(
                     )
 
         # if applicable, email users on waiting list
-        waiting_list_users = WaitingListUser.objects.filter(
-            event=event
+        notify_waiting_list(
+            event, host='http://{}'.format(self.request.get_host()),
+            source="DeleteBookingView"
         )
-        if waiting_list_users:
-            try:
-                send_waiting_list_email(
-                    event,
-                    [wluser.user for wluser in waiting_list_users],
-                    host='http://{}'.format(self.request.get_host())
-                )
-                ActivityLog.objects.create(
-                    log='Waiting list email sent to user(s) {} for '
-                    'event {}'.format(
-                        ', '.join(
-                            [wluser.user.username for \
-                            wluser in waiting_list_users]
-                        ),
-                        event
-                    )
-                )
-            except Exception as e:
-                # send mail to tech support with Exception
-                send_support_email(e, __name__, "DeleteBookingView - waiting list email")
-                messages.error(self.request, "An error occured, please contact "
-                    "the studio for information")
 
         if delete_from_shopping_basket:
             # get rid of messages
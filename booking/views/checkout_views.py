@@ -3,7 +3,6 @@ from decimal import Decimal, InvalidOperation
 import logging
 
 from django.conf import settings
-from django.contrib.sites.models import Site
 from django.contrib import messages
 from django.template.response import TemplateResponse
 from django.shortcuts import get_object_or_404, render, HttpResponseRedirect
@@ -43,42 +42,32 @@ def get_invoice(items, item_type, user, total):
     if not items:
         assert item_type == "stripe_test"
 
-    for item in items:
-        # mark the time we've successfully proceeded to checkout for this item
-        # so we avoid cleaning it up during payment processing
-        item.mark_checked()
-
-    unpaid_item_ids = {item.id for item in items}
-
-    def _get_matching_invoice(invoices):
-        if item_type == "stripe_test":
-            return
-        for invoice in invoices:
-            if item_type == "gift_vouchers":
-                # gift_vouchers are a set of event and block gift vouchers, not a qs
-                invoice_items = invoice.gift_vouchers
-            else:
-                invoice_items = getattr(invoice, item_type).all()
-            if {item.id for item in invoice_items} == unpaid_item_ids:
-                return invoice
-
-    # check for an existing unpaid invoice for this user
-    invoices = Invoice.objects.filter(username=email, paid=False)
-    # if any exist, check for one where the items are the same
-    invoice = _get_matching_invoice(invoices)
+    # check for an existing unpaid invoice for this user with exactly the same items
+    items_fingerprint = Invoice.get_items_fingerprint(items)
+    invoice = None
+    if items_fingerprint is not None:
+        invoice = Invoice.objects.filter(
+            username=email, paid=False, items_fingerprint=items_fingerprint
+        ).order_by("-date_created").first()
 
     if invoice is None:
         invoice = Invoice.objects.create(
             invoice_id=Invoice.generate_invoice_id(), amount=Decimal(total), username=email,
-            is_stripe_test=item_type == "stripe_test"
+            is_stripe_test=item_type == "stripe_test", items_fingerprint=items_fingerprint,
         )
-        for item in items:
-            item.invoice = invoice
-            item.save()
     else:
         # If an invoice with the expected items is found, make sure its total is current
         invoice.amount = Decimal(total)
         invoice.save()
+
+    for item in items:
+        # (re)assign the item to the invoice; an item could have been moved to another
+        # invoice since this one was created.
+        # Also mark the time we've successfully proceeded to checkout for this item
+        # so we avoid cleaning it up during payment processing
+        item.invoice = invoice
+        item.mark_checked()
+    invoice.reset_items()
     return invoice
 
 
@@ -348,7 +337,7 @@ def stripe_checkout(request):
     logger.info("Stripe checkout for invoice id %s", invoice.invoice_id)
     # Create the Stripe PaymentIntent
     stripe.api_key = settings.STRIPE_SECRET_KEY
-    seller = Seller.objects.filter(site=Site.objects.get_current(request)).first()
+    seller = Seller.objects.get_current(request)
     context = {}
     if seller is None:
         logger.error("No seller found on Stripe checkout attempt")
@@ -158,7 +158,7 @@ def subscription_create(request):
         voucher = None
         if data.get("voucher_code"):
             try:
-                voucher = StripeSubscriptionVoucher.objects.get(code=data["voucher_code"])
+                voucher = StripeSubscriptionVoucher.objects.get_by_code(data["voucher_code"])
                 discounts = [{"promotion_code": voucher.promo_code_id}]
             except StripeSubscriptionVoucher.DoesNotExist:
                 ...
@@ -269,7 +269,7 @@ def validate_voucher_code(voucher_code, membership, existing_subscription_id=Fal
     if voucher_code:
         # check the basic things we can check first before asking stripe
         try:
-            voucher = StripeSubscriptionVoucher.objects.get(code=voucher_code)
+            voucher = StripeSubscriptionVoucher.objects.get_by_code(voucher_code)
         except StripeSubscriptionVoucher.DoesNotExist:
             voucher_message = f"{voucher_code} is not a valid code"
 
@@ -288,7 +288,7 @@ def validate_voucher_code(voucher_code, membership, existing_subscription_id=Fal
 
             if not voucher_message:
                 client = StripeConnector()
-                promo_code = client.get_promo_code(voucher.promo_code_id)
+                promo_code = client.get_promo_code(voucher.promo_code_id, use_cache=True)
                 if promo_code.active:       
                     voucher_message = f"Voucher valid: {voucher.description}"
                     voucher_valid = True
@@ -476,7 +476,7 @@ def ensure_subscription_up_to_date(user_membership, subscription, subscription_i
     client = StripeConnector()
 
     if subscription is None:
-        subscription = client.get_subscription(subscription_id)
+        subscription = client.get_subscription(subscription_id, use_cache=True)
         if subscription is None:
             return
 
@@ -557,11 +557,11 @@ def membership_status(request, subscription_id):
     next_month = (this_month + 1 - 12) % 12
     
     client = StripeConnector()
-    subscription = client.get_subscription(subscription_id)
+    subscription = client.get_subscription(subscription_id, use_cache=True)
     # Don't show next due date for already cancelled subscriptions, or subscriptions that are
     # cancelling in the future
     if user_membership.subscription_status != 'canceled' and not subscription.cancel_at:
-        next_invoice = client.get_upcoming_invoice(subscription_id)
+        next_invoice = client.get_upcoming_invoice(subscription_id, use_cache=True)
         invoice_date = get_utcdate_from_timestamp(next_invoice.period_end)
         if next_invoice.discounts:
             discount = next_invoice.discounts[0]
@@ -569,8 +569,9 @@ def membership_status(request, subscription_id):
             voucher = StripeSubscriptionVoucher.objects.get(promo_code_id=discount.promotion_code)
             if voucher.expiry_date and voucher.expiry_date < invoice_date:
                 client.remove_discount_from_subscription(subscription.id)
-                # Fetch the invoice again so the amount is updated
-                next_invoice = client.get_upcoming_invoice(subscription_id)
+                # Fetch the invoice again so the amount is updated (removing the discount clears
+                # the cached invoice)
+                next_invoice = client.get_upcoming_invoice(subscription_id, use_cache=True)
                 voucher_description = None
             else:
                 voucher_description = voucher.applied_description
@@ -629,7 +630,7 @@ class MembershipListView(DataPolicyAgreementRequiredMixin, LoginRequiredMixin, L
             if customer_id:
                 client = StripeConnector()
                 # check non-cancelled memberships
-                subscriptions = client.get_subscriptions_for_customer(customer_id, status=None)
+                subscriptions = client.get_subscriptions_for_customer(customer_id, status=None, use_cache=True)
                 for user_membership in queryset.exclude(subscription_status="canceled"):
                     ensure_subscription_up_to_date(user_membership, subscriptions.get(user_membership.subscription_id), user_membership.subscription_id)
 
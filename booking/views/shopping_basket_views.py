@@ -7,8 +7,10 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
-from django.db.models import Q, Sum
-from django.shortcuts import HttpResponseRedirect, render, get_object_or_404
+from django.db import transaction
+from django.db.models import Count
+from django.http import Http404
+from django.shortcuts import HttpResponseRedirect, render
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.core.mail import send_mail
@@ -20,8 +22,7 @@ from payments.forms import PayPalPaymentsShoppingBasketForm
 from accounts.models import DataPrivacyPolicy, has_active_data_privacy_agreement
 
 from booking.models import (
-    Block, BlockType, BlockVoucher, Booking, EventVoucher, UsedBlockVoucher,
-    UsedEventVoucher
+    Block, BlockType, BlockVoucher, Booking, EventVoucher, VoucherRedemptionError
 )
 from booking.forms import BookingVoucherForm, BlockVoucherForm
 import booking.context_helpers as context_helpers
@@ -33,58 +34,74 @@ from payments.helpers import (
 )
 
 
+def set_block_availability(user, bookings):
+    """
+    Set has_available_block and has_unpaid_block on each booking, using one query for
+    the user's unexpired blocks for the relevant event types, instead of querying
+    blocks for each booking
+    """
+    event_type_ids = {booking.event.event_type_id for booking in bookings}
+    available_event_type_ids = set()
+    unpaid_event_type_ids = set()
+    if event_type_ids:
+        blocks = (
+            user.blocks.filter(block_type__event_type_id__in=event_type_ids, expiry_date__gte=timezone.now())
+            .select_related("block_type")
+            .annotate(booking_count=Count("bookings"))
+        )
+        for block in blocks:
+            if block.booking_count >= block.block_type.size:
+                # block is full
+                continue
+            if block.paid:
+                available_event_type_ids.add(block.block_type.event_type_id)
+            else:
+                unpaid_event_type_ids.add(block.block_type.event_type_id)
+
+    for booking in bookings:
+        booking.has_available_block = booking.event.event_type_id in available_event_type_ids
+        booking.has_unpaid_block = booking.event.event_type_id in unpaid_event_type_ids
+
+
 def get_unpaid_bookings_context(user):
-    unpaid_bookings_all = user.bookings.filter(
-        paid=False, status='OPEN', event__date__gte=timezone.now(), no_show=False, paypal_pending=False
+    # Fetch all the user's unpaid bookings once, and split them by payment status in memory
+    unpaid_bookings_all = list(
+        user.bookings.filter(
+            paid=False, status='OPEN', event__date__gte=timezone.now(), no_show=False, paypal_pending=False
+        ).select_related("event", "event__event_type")
     )
+    unpaid_bookings_all_open = [booking for booking in unpaid_bookings_all if booking.event.payment_open]
+    unpaid_bookings_payment_not_open = [booking for booking in unpaid_bookings_all if not booking.event.payment_open]
 
+    context = {}
     if settings.PAYMENT_METHOD == "paypal":
-        unpaid_bookings_all_open = unpaid_bookings_all.filter(event__payment_open=True)
-        unpaid_bookings_payment_not_open = unpaid_bookings_all.filter(event__payment_open=False)
-        unpaid_bookings = unpaid_bookings_all_open.filter(event__paypal_email=settings.DEFAULT_PAYPAL_EMAIL)
-        unpaid_bookings_non_default_paypal = unpaid_bookings_all_open.exclude(event__paypal_email=settings.DEFAULT_PAYPAL_EMAIL)
-
-        include_warning = bool([True for bk in unpaid_bookings_all_open if not bk.can_cancel])
-        block_booking_available = bool(
-            [True for booking in unpaid_bookings if booking.has_available_block]
-        )
-        unpaid_block_booking_available = bool(
-            [True for booking in unpaid_bookings if booking.has_unpaid_block]
-        )
-        block_types_available = any(booking for booking in unpaid_bookings if any(BlockType.objects.filter(active=True, event_type=booking.event.event_type)))
-
-        return {
-            'unpaid_bookings': unpaid_bookings,
-            'unpaid_booking_ids': list(unpaid_bookings.values_list('id', flat=True)),
-            'unpaid_bookings_non_default_paypal': unpaid_bookings_non_default_paypal,
-            'unpaid_bookings_payment_not_open': unpaid_bookings_payment_not_open,
-            'include_warning': include_warning,
-            'block_booking_available': block_booking_available,
-            'block_types_available': block_types_available,
-            'unpaid_block_booking_available': unpaid_block_booking_available
-        }
+        unpaid_bookings = [
+            booking for booking in unpaid_bookings_all_open
+            if booking.event.paypal_email == settings.DEFAULT_PAYPAL_EMAIL
+        ]
+        context['unpaid_bookings_non_default_paypal'] = [
+            booking for booking in unpaid_bookings_all_open
+            if booking.event.paypal_email != settings.DEFAULT_PAYPAL_EMAIL
+        ]
     else:
-        unpaid_bookings = unpaid_bookings_all.filter(event__payment_open=True)
-        unpaid_bookings_payment_not_open = unpaid_bookings_all.filter(event__payment_open=False)
+        unpaid_bookings = unpaid_bookings_all_open
 
-        include_warning = bool([True for bk in unpaid_bookings if not bk.can_cancel])
-        block_booking_available = bool(
-            [True for booking in unpaid_bookings if booking.has_available_block]
-        )
-        unpaid_block_booking_available = bool(
-            [True for booking in unpaid_bookings if booking.has_unpaid_block]
-        )
-        block_types_available = any(booking for booking in unpaid_bookings if any(BlockType.objects.filter(active=True, event_type=booking.event.event_type)))
-
-        return {
-            'unpaid_bookings': unpaid_bookings,
-            'unpaid_booking_ids': list(unpaid_bookings.values_list('id', flat=True)),
-            'unpaid_bookings_payment_not_open': unpaid_bookings_payment_not_open,
-            'include_warning': include_warning,
-            'block_booking_available': block_booking_available,
-            'block_types_available': block_types_available,
-            'unpaid_block_booking_available': unpaid_block_booking_available
-        }
+    set_block_availability(user, unpaid_bookings)
+    event_type_ids = {booking.event.event_type_id for booking in unpaid_bookings}
+    block_types_available = bool(event_type_ids) and BlockType.objects.filter(
+        active=True, event_type_id__in=event_type_ids
+    ).exists()
+
+    context.update({
+        'unpaid_bookings': unpaid_bookings,
+        'unpaid_booking_ids': [booking.id for booking in unpaid_bookings],
+        'unpaid_bookings_payment_not_open': unpaid_bookings_payment_not_open,
+        'include_warning': any(not booking.can_cancel for booking in unpaid_bookings_all_open),
+        'block_booking_available': any(booking.has_available_block for booking in unpaid_bookings),
+        'block_types_available': block_types_available,
+        'unpaid_block_booking_available': any(booking.has_unpaid_block for booking in unpaid_bookings),
+    })
+    return context
 
 
 def remove_voucher(items):
@@ -97,7 +114,7 @@ def add_booking_voucher_context(booking_code, user, context):
     
     context['booking_code'] = booking_code
     try:
-        booking_voucher = EventVoucher.objects.get(code=booking_code)
+        booking_voucher = EventVoucher.objects.get_by_code(booking_code)
     except EventVoucher.DoesNotExist:
         booking_voucher = None
         context['booking_voucher_error'] = 'Invalid code' if booking_code else 'No code provided'
@@ -107,9 +124,7 @@ def add_booking_voucher_context(booking_code, user, context):
         booking_voucher_error = validate_voucher_code(booking_voucher, user)
         context['booking_voucher_error'] = booking_voucher_error
 
-        times_booking_voucher_used = UsedEventVoucher.objects.filter(
-            voucher=booking_voucher, user=user
-        ).count()
+        times_booking_voucher_used = booking_voucher.times_used_by_user(user)
         context['times_booking_voucher_used'] = times_booking_voucher_used
 
         valid_booking_voucher = not bool(booking_voucher_error)
@@ -131,10 +146,9 @@ def add_total_bookings_and_payment_context(request, context):
 
     if context.get('total_unpaid_booking_cost') is None:
         # no voucher, or invalid voucher
-        total_agg = unpaid_bookings.aggregate(Sum('event__cost'))
-        # pop item from the aggregate dict
-        _, total_booking_cost = total_agg.popitem()
-        context['total_unpaid_booking_cost'] = total_booking_cost
+        context['total_unpaid_booking_cost'] = (
+            sum(booking.event.cost for booking in unpaid_bookings) if unpaid_bookings else None
+        )
 
     if settings.PAYMENT_METHOD == "paypal":
         booking_code = context.get('booking_code')
@@ -197,7 +211,9 @@ def get_unpaid_block_context(user, context=None):
     context = context or {}
     unpaid_block_and_costs = [
         (block, block.block_type.cost)
-        for block in user.blocks.filter(paid=False, paypal_pending=False, expiry_date__gte=timezone.now()) if not block.full
+        for block in user.blocks.filter(paid=False, paypal_pending=False, expiry_date__gte=timezone.now())
+        .select_related("block_type").annotate(booking_count=Count("bookings"))
+        if block.booking_count < block.block_type.size
     ]
     unpaid_blocks, unpaid_block_costs = list(zip(*unpaid_block_and_costs)) \
         if unpaid_block_and_costs else ([], [0])
@@ -215,7 +231,7 @@ def add_block_voucher_context(block_code, user, context):
     context['block_code'] = block_code
 
     try:
-        block_voucher = BlockVoucher.objects.get(code=block_code)
+        block_voucher = BlockVoucher.objects.get_by_code(block_code)
     except BlockVoucher.DoesNotExist:
         block_voucher = None
         context['block_voucher_error'] = 'Invalid code' if block_code else 'No code provided'
@@ -225,9 +241,7 @@ def add_block_voucher_context(block_code, user, context):
         block_voucher_error = validate_block_voucher_code(block_voucher, user)
         context['block_voucher_error'] =  block_voucher_error
 
-        times_block_voucher_used = UsedBlockVoucher.objects.filter(
-            voucher=block_voucher, user=user
-        ).count()
+        times_block_voucher_used = block_voucher.times_used_by_user(user)
         context['times_block_voucher_used'] = times_block_voucher_used
 
         valid_block_voucher = not bool(block_voucher_error)
@@ -353,6 +367,11 @@ def shopping_basket(request):
 
 
 def apply_voucher_to_unpaid_bookings(voucher, bookings, times_used):
+    """
+    Apply voucher to bookings, up to its usage limits, and calculate the total cost.
+    bookings are expected to have their events selected; voucher codes are updated 
+    on the bookings in bulk
+    """
     check_max_per_user = False
     check_max_total = False
     max_per_user_exceeded = False
@@ -368,13 +387,12 @@ def apply_voucher_to_unpaid_bookings(voucher, bookings, times_used):
 
     if voucher.max_vouchers:
         check_max_total = True
-        max_voucher_uses_left = (
-            voucher.max_vouchers -
-            UsedEventVoucher.objects.filter(voucher=voucher).count()
-        )
+        max_voucher_uses_left = voucher.max_vouchers - voucher.times_used
 
+    valid_event_type_ids = set(voucher.event_types.values_list("id", flat=True))
+    voucher_removed_bookings = []
     for booking in bookings:
-        can_use = voucher.check_event_type(booking.event.event_type)
+        can_use = booking.event.event_type_id in valid_event_type_ids
         if check_max_per_user and uses_per_user_left <= 0:
             can_use = False
             max_per_user_exceeded = True
@@ -384,16 +402,16 @@ def apply_voucher_to_unpaid_bookings(voucher, bookings, times_used):
 
         if can_use:
             booking.voucher_code = voucher.code
-            booking.save()
-            
             voucher_applied_bookings.append(booking.id)
             if check_max_per_user:
                 uses_per_user_left -= 1
             if check_max_total:
                 max_voucher_uses_left -= 1
+            total_booking_cost += voucher.apply_discount(booking.event.cost)
         else:
             # voucher can't be used; make sure it's unset on the booking
-            booking.reset_voucher_code()
+            booking.voucher_code = None
+            voucher_removed_bookings.append(booking.id)
             # if we can't use the voucher but max_total and
             # max_per_user are not exceeded, it must be an invalid
             # event type
@@ -401,10 +419,12 @@ def apply_voucher_to_unpaid_bookings(voucher, bookings, times_used):
                 invalid_event_types.append(
                     booking.event.event_type.subtype
                 )
-        
-        # add the cost to the total; 
-        # cost_with_voucher returns the event cost if there's no voucher applied
-        total_booking_cost += booking.cost_with_voucher
+            total_booking_cost += booking.event.cost
+
+    if voucher_applied_bookings:
+        Booking.objects.filter(id__in=voucher_applied_bookings).update(voucher_code=voucher.code)
+    if voucher_removed_bookings:
+        Booking.objects.filter(id__in=voucher_removed_bookings).update(voucher_code=None)
 
     voucher_msg = []
     if invalid_event_types:
@@ -451,12 +471,11 @@ def apply_voucher_to_unpaid_blocks(voucher, blocks, times_used):
 
     if voucher.max_vouchers:
         check_max_total = True
-        max_voucher_uses_left = (
-            voucher.max_vouchers -
-            UsedBlockVoucher.objects.filter(voucher=voucher).count()
-        )
+        max_voucher_uses_left = voucher.max_vouchers - voucher.times_used
+
+    valid_block_type_ids = set(voucher.block_types.values_list("id", flat=True))
     for block in blocks:
-        can_use = voucher.check_block_type(block.block_type)
+        can_use = block.block_type_id in valid_block_type_ids
         if check_max_per_user and uses_per_user_left <= 0:
             can_use = False
             max_per_user_exceeded = True
@@ -472,6 +491,7 @@ def apply_voucher_to_unpaid_blocks(voucher, blocks, times_used):
                 uses_per_user_left -= 1
             if check_max_total:
                 max_voucher_uses_left -= 1
+            total_block_cost += voucher.apply_discount(block.block_type.cost)
         else:
             # voucher can't be used; make sure it's unset on the block
             block.reset_voucher_code()
@@ -481,10 +501,7 @@ def apply_voucher_to_unpaid_blocks(voucher, blocks, times_used):
             # event type
             if not (max_total_exceeded or max_per_user_exceeded):
                 invalid_block_types.append(str(block.block_type))
-
-        # add the cost to the total; 
-        # cost_with_voucher returns the event cost if there's no voucher applied
-        total_block_cost += block.cost_with_voucher
+            total_block_cost += block.block_type.cost
 
     voucher_msg = []
     if invalid_block_types:
@@ -591,15 +608,24 @@ def submit_zero_booking_payment(request):
     # just mark as paid here and create a UsedEventVoucher
     unpaid_booking_ids = json.loads(request.POST.get('unpaid_booking_ids'))
     booking_code = request.POST['booking_code']
-    voucher = get_object_or_404(EventVoucher, code=booking_code)
+    try:
+        voucher = EventVoucher.objects.get_by_code(booking_code)
+    except EventVoucher.DoesNotExist:
+        raise Http404
 
     unpaid_bookings = Booking.objects.filter(id__in=unpaid_booking_ids)
-    for booking in unpaid_bookings:
-        booking.paid = True
-        booking.payment_confirmed = True
-        booking.save()
-        UsedEventVoucher.objects.create(
-            voucher=voucher, user=booking.user, booking_id=booking.id
+    try:
+        with transaction.atomic():
+            for booking in unpaid_bookings:
+                booking.paid = True
+                booking.payment_confirmed = True
+                booking.save()
+                voucher.redeem(booking.user, booking_id=booking.id)
+    except VoucherRedemptionError:
+        # voucher uses ran out since the basket was loaded; nothing has been marked as paid
+        messages.error(request, f"Voucher {booking_code} cannot be used for all of these bookings")
+        return HttpResponseRedirect(
+            reverse('booking:shopping_basket') + '?{}'.format(urlencode({'booking_code': booking_code}))
         )
 
     # Return to shopping basket if there are unpaid blocks (including with a
@@ -625,14 +651,23 @@ def submit_zero_block_payment(request):
     # just mark as paid here and create a UsedBlockVoucher
     unpaid_block_ids = json.loads(request.POST.get('unpaid_block_ids'))
     block_code = request.POST['block_code']
-    voucher = get_object_or_404(BlockVoucher, code=block_code)
+    try:
+        voucher = BlockVoucher.objects.get_by_code(block_code)
+    except BlockVoucher.DoesNotExist:
+        raise Http404
 
     unpaid_blocks = Block.objects.filter(id__in=unpaid_block_ids)
-    for block in unpaid_blocks:
-        block.paid = True
-        block.save()
-        UsedBlockVoucher.objects.create(
-            voucher=voucher, user=block.user, block_id=block.id
+    try:
+        with transaction.atomic():
+            for block in unpaid_blocks:
+                block.paid = True
+                block.save()
+                voucher.redeem(block.user, block_id=block.id)
+    except VoucherRedemptionError:
+        # voucher uses ran out since the basket was loaded; nothing has been marked as paid
+        messages.error(request, f"Voucher {block_code} cannot be used for all of these blocks")
+        return HttpResponseRedirect(
+            reverse('booking:shopping_basket') + '?{}'.format(urlencode({'block_code': block_code}))
         )
 
     # Return to shopping basket if there are unpaid bookings, else return to blocks page
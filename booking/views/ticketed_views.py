@@ -14,7 +14,8 @@ from django.urls import reverse
 from django.utils import timezone
 from braces.views import LoginRequiredMixin
 
-from booking.models import TicketedEvent, TicketBooking, Ticket, TicketedEventWaitingListUser
+from booking.models import TicketedEvent, TicketBooking, TicketBookingError, \
+    TicketedEventWaitingListUser
 from booking.forms import TicketFormSet, TicketPurchaseForm
 import booking.context_helpers as context_helpers
 from booking.email_helpers import send_support_email
@@ -36,7 +37,7 @@ class TicketedEventListView(DataPolicyAgreementRequiredMixin, ListView):
     def get_queryset(self):
         return TicketedEvent.objects.filter(
             date__gte=timezone.now(), show_on_site=True, cancelled=False
-        )
+        ).with_tickets_booked()
 
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
@@ -154,35 +155,25 @@ class TicketCreateView(DataPolicyAgreementRequiredMixin, LoginRequiredMixin, Tem
         ticket_formset = context['ticket_formset']
 
         if ticket_purchase_form.has_changed():
-            # tickets on current booking are only included in the tickets_left
-            # calculation if purchase has been confirmed
-            old_tickets = self.ticket_booking.tickets.all()
-            old_ticket_count = old_tickets.count()
-
-            if self.ticket_booking.purchase_confirmed:
-                tickets_left_excl_this = self.ticketed_event.tickets_left() \
-                                            + old_ticket_count
-            else:
-                tickets_left_excl_this = self.ticketed_event.tickets_left()
-
+            old_ticket_count = self.ticket_booking.tickets.count()
             new_quantity = int(request.POST.get('ticket_purchase_form-quantity'))
 
-            if new_quantity > tickets_left_excl_this:
+            try:
+                # creates the correct number of tickets on this booking and holds
+                # them until the purchase is confirmed
+                self.ticket_booking.set_ticket_quantity(new_quantity)
+            except TicketBookingError:
+                # tickets on current booking are only included in the tickets_left
+                # calculation if purchase has been confirmed or they are held
+                if self.ticket_booking.purchase_confirmed:
+                    tickets_left_excl_this = self.ticketed_event.tickets_left() + old_ticket_count
+                else:
+                    tickets_left_excl_this = self.ticketed_event.tickets_left() + self.ticket_booking.tickets_held()
                 messages.error(
                     request, 'Cannot purchase the number of tickets requested.  '
-                             'Only {} tickets left.'.format(
-                        self.ticketed_event.tickets_left()
-                    )
+                             'Only {} tickets left.'.format(tickets_left_excl_this)
                 )
             else:
-                # create the correct number of tickets on this booking
-                if old_ticket_count < new_quantity:
-                    for i in range(new_quantity-old_ticket_count):
-                        Ticket.objects.create(ticket_booking=self.ticket_booking)
-                if old_ticket_count > new_quantity:
-                    for ticket in old_tickets[new_quantity:]:
-                        ticket.delete()
-
                 if old_ticket_count > 0:
                     ActivityLog.objects.create(
                         log="Ticket quantity updated on booking ref {}".format(
@@ -197,6 +188,19 @@ class TicketCreateView(DataPolicyAgreementRequiredMixin, LoginRequiredMixin, Tem
 
         if 'ticket_formset-submit' in request.POST:
             if ticket_formset.is_valid():
+                try:
+                    # reset the ticket_booking booked date to the date user confirms
+                    self.ticket_booking.confirm_purchase(date_booked=timezone.now())
+                except TicketBookingError:
+                    messages.error(
+                        request, 'Your ticket reservation has expired and there are not enough '
+                                 'tickets left for this purchase.  Only {} tickets left.'.format(
+                            self.ticketed_event.tickets_left()
+                        )
+                    )
+                    context['tickets'] = self.ticket_booking.tickets.all()
+                    return TemplateResponse(request, self.template_name, context)
+
                 ticket_formset.save()
 
                 # we only create the paypal form if there is a ticket cost and
@@ -226,11 +230,7 @@ class TicketCreateView(DataPolicyAgreementRequiredMixin, LoginRequiredMixin, Tem
                         )
                         context["paypalform"] = paypal_form
 
-                self.ticket_booking.purchase_confirmed = True
-                # reset the ticket_booking booked date to the date user confirms
                 context['purchase_confirmed'] = True
-                self.ticket_booking.date_booked = timezone.now()
-                self.ticket_booking.save()
                 ActivityLog.objects.create(
                     log="Ticket Purchase confirmed: event {}, user {}, "
                         "booking ref {}".format(
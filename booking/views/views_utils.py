@@ -4,7 +4,7 @@ from django.utils import timezone
 
 from accounts.models import DataPrivacyPolicy, has_active_disclaimer, has_active_data_privacy_agreement
 from activitylog.models import ActivityLog
-from booking.models import Block, UsedBlockVoucher, UsedEventVoucher
+from booking.models import Block
 
 
 class DisclaimerRequiredMixin(object):
@@ -35,9 +35,7 @@ def validate_voucher_code(voucher, user, event=None):
         return 'Voucher code has expired'
     elif voucher.members_only and not user.has_membership():
         return 'Voucher code is only redeemable by members'
-    elif voucher.max_vouchers and \
-        UsedEventVoucher.objects.filter(voucher=voucher).count() >= \
-            voucher.max_vouchers:
+    elif voucher.max_vouchers_reached:
         return 'Voucher has limited number of total uses and has now expired'
     elif not voucher.activated:
         return 'Voucher has not been activated yet'
@@ -45,9 +43,7 @@ def validate_voucher_code(voucher, user, event=None):
         return 'Voucher code is not valid until {}'.format(
             voucher.start_date.strftime("%d %b %y")
         )
-    elif voucher.max_per_user and UsedEventVoucher.objects.filter(
-            voucher=voucher, user=user
-    ).count() >= voucher.max_per_user:
+    elif voucher.max_per_user and voucher.times_used_by_user(user) >= voucher.max_per_user:
         return 'Voucher code has already been used the maximum number ' \
                'of times ({})'.format(
                 voucher.max_per_user
@@ -59,9 +55,7 @@ def validate_block_voucher_code(voucher, user):
         return 'Voucher code has expired'
     elif voucher.members_only and not user.has_membership():
         return 'Voucher code is only redeemable by members'
-    elif voucher.max_vouchers and \
-        UsedBlockVoucher.objects.filter(voucher=voucher).count() >= \
-            voucher.max_vouchers:
+    elif voucher.max_vouchers_reached:
         return 'Voucher has limited number of uses and has now expired'
     elif not voucher.activated:
         return 'Voucher has not been activated yet'
@@ -69,9 +63,7 @@ def validate_block_voucher_code(voucher, user):
         return 'Voucher code is not valid until {}'.format(
             voucher.start_date.strftime("%d %b %y")
         )
-    elif voucher.max_per_user and UsedBlockVoucher.objects.filter(
-            voucher=voucher, user=user
-    ).count() >= voucher.max_per_user:
+    elif voucher.max_per_user and voucher.times_used_by_user(user) >= voucher.max_per_user:
         return 'Voucher code has already been used the maximum number ' \
                'of times ({})'.format(
                 voucher.max_per_user
@@ -0,0 +1,98 @@
+"""
+Streaming, password-based encryption for backup files.
+
+Data is written as a series of separately encrypted frames, so that large
+exports can be encrypted and decrypted a chunk at a time without holding the
+whole file in memory.
+
+File format:
+    MAGIC | salt (16 bytes) | frame | frame | ...
+Each frame:
+    length of ciphertext (4 bytes) | final flag (1 byte) | ciphertext | tag (16 bytes)
+
+The key is derived once per file from the password and salt (PBKDF2-SHA256);
+each frame is encrypted with AES-GCM, using the frame number as the nonce.  The
+frame number and final flag are authenticated with each frame, so frames can't
+be reordered, and a file that has been truncated is detected.
+"""
+import os
+import struct
+
+from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import PBKDF2
+
+
+MAGIC = b"PIPSENC1"
+SALT_LEN = 16
+TAG_LEN = 16
+KDF_ITERATIONS = 200000
+FRAME_HEADER = struct.Struct(">IB")
+
+
+class DecryptionError(Exception):
+    pass
+
+
+def _derive_key(password, salt):
+    return PBKDF2(password, salt, 32, count=KDF_ITERATIONS, hmac_hash_module=SHA256)
+
+
+def _frame_cipher(key, index, final):
+    cipher = AES.new(key, AES.MODE_GCM, nonce=index.to_bytes(12, "big"))
+    cipher.update(index.to_bytes(8, "big") + bytes([final]))
+    return cipher
+
+
+def encrypt_chunks(password, chunks):
+    """
+    Encrypt an iterable of bytes chunks; yields the bytes to be written to the
+    output file, one frame at a time
+    """
+    salt = os.urandom(SALT_LEN)
+    key = _derive_key(password, salt)
+    yield MAGIC + salt
+
+    def _frame(index, data, final):
+        ciphertext, tag = _frame_cipher(key, index, final).encrypt_and_digest(data)
+        return FRAME_HEADER.pack(len(ciphertext), final) + ciphertext + tag
+
+    # hold back one chunk, so that the last frame can be marked as final
+    index = 0
+    previous = None
+    for chunk in chunks:
+        if previous is not None:
+            yield _frame(index, previous, False)
+            index += 1
+        previous = chunk
+    yield _frame(index, previous or b"", True)
+
+
+def decrypt_chunks(password, file):
+    """
+    Decrypt a file object written with encrypt_chunks; yields the decrypted
+    bytes chunks.  Raises DecryptionError if the password is wrong or the file
+    has been altered or truncated.
+    """
+    header = file.read(len(MAGIC) + SALT_LEN)
+    if len(header) != len(MAGIC) + SALT_LEN or not header.startswith(MAGIC):
+        raise DecryptionError("Not an encrypted backup file")
+    key = _derive_key(password, header[len(MAGIC):])
+
+    index = 0
+    while True:
+        frame_header = file.read(FRAME_HEADER.size)
+        if len(frame_header) != FRAME_HEADER.size:
+            raise DecryptionError("Encrypted file is truncated")
+        length, final = FRAME_HEADER.unpack(frame_header)
+        ciphertext = file.read(length)
+        tag = file.read(TAG_LEN)
+        if len(ciphertext) != length or len(tag) != TAG_LEN:
+            raise DecryptionError("Encrypted file is truncated")
+        try:
+            yield _frame_cipher(key, index, final).decrypt_and_verify(ciphertext, tag)
+        except ValueError:
+            raise DecryptionError("Incorrect password or corrupted file")
+        if final:
+            return
+        index += 1
@@ -3,8 +3,10 @@ import pytest
 import os
 import responses
 from unittest.mock import Mock, patch
+from uuid import uuid4
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.contrib.sites.models import Site
 
 from model_bakery import baker
@@ -16,6 +18,13 @@ from booking.models import Membership, MembershipItem
 User = get_user_model()
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # cached stripe API responses are keyed on stripe ids, which are reused across tests,
+    # and cached sellers aren't cleared by test database rollbacks
+    cache.clear()
+
+
 @pytest.fixture
 def configured_user():
     user = User.objects.create_user(
@@ -154,6 +163,7 @@ def get_mock_webhook_event(seller):
     def mock_webhook_event(**params):
         webhook_event_type = params.pop("webhook_event_type", "payment_intent.succeeded")
         seller_id = params.pop("seller_id", seller.stripe_user_id)
+        event_id = params.pop("event_id", f"evt_{uuid4().hex}")
         if webhook_event_type in ["payment_intent.succeeded", "payment_intent.payment_failed"]:
             object = get_mock_payment_intent(webhook_event_type, **params)
         elif webhook_event_type in ["customer.subscription.created", "customer.subscription.deleted", "customer.subscription.updated"]:
@@ -169,6 +179,7 @@ def get_mock_webhook_event(seller):
         if "name" in params:
             object.name = params["name"]
         mock_event = Mock(
+            id=event_id,
             account=seller_id,
             data=Mock(object=object), 
             type=webhook_event_type,
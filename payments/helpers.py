@@ -1,7 +1,13 @@
 import hashlib
 import random
 
+from django.core.cache import cache
+from django.utils import timezone
 
+from paypal.standard.ipn.models import PayPalIPN
+from paypal.standard.models import ST_PP_COMPLETED
+
+from booking.models import shopping_basket_cache_key
 from payments.models import PaypalBookingTransaction, PaypalBlockTransaction, \
     PaypalGiftVoucherTransaction, PaypalTicketBookingTransaction
 
@@ -204,3 +210,80 @@ def create_gift_voucher_paypal_transaction(voucher_type, voucher_code):
         invoice_id=invoice_id, voucher_type=voucher_type, voucher_code=voucher_code
     )
     return pbt
+
+
+def _find_completed_paypal_payments(items, transaction_model, item_field):
+    """
+    For each item (booking or ticket booking), look up its latest paypal transaction and
+    any completed IPN for that transaction's invoice; two queries in total.
+    Returns a dict of item id: (transaction, completed ipn or None), for items that
+    have a transaction
+    """
+    item_ids = {item.id for item in items}
+    # latest transaction per item, as ordered by transaction id
+    transactions = transaction_model.objects.filter(**{f"{item_field}_id__in": item_ids}).order_by(
+        f"{item_field}_id", "-transaction_id"
+    ).distinct(f"{item_field}_id")
+    transactions = {getattr(txn, f"{item_field}_id"): txn for txn in transactions}
+
+    completed_ipns = {}
+    for ipn in PayPalIPN.objects.filter(
+        invoice__in={txn.invoice_id for txn in transactions.values()}, payment_status=ST_PP_COMPLETED
+    ).order_by("id"):
+        completed_ipns.setdefault(ipn.invoice, ipn)
+
+    return {
+        item_id: (txn, completed_ipns.get(txn.invoice_id)) for item_id, txn in transactions.items()
+    }
+
+
+def _reconcile_paypal_payments(items, transaction_model, item_field, paid_fields):
+    """
+    Mark items that have actually been paid by paypal (i.e. have a completed IPN) as paid,
+    and make sure their transaction ids are set. Returns the list of items that are still unpaid.
+    """
+    if not items:
+        return []
+    payments = _find_completed_paypal_payments(items, transaction_model, item_field)
+    paid_items = {}
+    transactions_to_update = []
+    for item in items:
+        txn, ipn = payments.get(item.id, (None, None))
+        if ipn is None:
+            continue
+        for field, value in paid_fields.items():
+            setattr(item, field, value)
+        paid_items[item.id] = item
+        if txn.transaction_id != ipn.txn_id:
+            txn.transaction_id = ipn.txn_id
+            transactions_to_update.append(txn)
+
+    if paid_items:
+        type(items[0]).objects.bulk_update(paid_items.values(), list(paid_fields))
+        transaction_model.objects.bulk_update(transactions_to_update, ["transaction_id"])
+        # bulk updates bypass the save signals that clear the users' cached shopping baskets
+        cache.delete_many({shopping_basket_cache_key(item.user_id) for item in paid_items.values()})
+    return [item for item in items if item.id not in paid_items]
+
+
+def reconcile_paypal_bookings(bookings):
+    """
+    Check unpaid bookings for completed paypal payments that haven't been processed
+    (e.g. missed IPNs) and mark them as paid.  Returns the bookings that are still unpaid.
+    """
+    return _reconcile_paypal_payments(
+        list(bookings), PaypalBookingTransaction, "booking",
+        paid_fields={
+            "paid": True, "payment_confirmed": True, "paypal_pending": False,
+            "date_payment_confirmed": timezone.now(),
+        }
+    )
+
+
+def reconcile_paypal_ticket_bookings(ticket_bookings):
+    """
+    As reconcile_paypal_bookings, for ticket bookings
+    """
+    return _reconcile_paypal_payments(
+        list(ticket_bookings), PaypalTicketBookingTransaction, "ticket_booking", paid_fields={"paid": True}
+    )
@@ -2,8 +2,12 @@
 
 import logging
 
+from collections import defaultdict
+from functools import partial
+
 from django.conf import settings
 from django.core.mail import send_mail
+from django.db import transaction
 from django.utils import timezone
 from django.template.loader import get_template
 
@@ -329,6 +333,50 @@ def get_obj_legacy(ipn_obj):
         return build_obj_dict(ipn_obj, obj_type, obj_ids, voucher_code, voucher_applied_to)
 
 
+def get_paypal_transactions(ipn_obj, obj_list, transaction_model, obj_field, create_transaction):
+    """
+    Find the paypal transaction for each obj in obj_list, fetching the transactions for
+    all objs in a single query.  Creates a transaction for any obj that doesn't have one.
+    """
+    transactions = defaultdict(list)
+    for paypal_trans in transaction_model.objects.filter(
+        **{f"{obj_field}__in": obj_list}
+    ).order_by('id'):
+        transactions[getattr(paypal_trans, f"{obj_field}_id")].append(paypal_trans)
+
+    paypal_trans_list = []
+    for obj in obj_list:
+        obj_transactions = transactions[obj.id]
+        if not obj_transactions:
+            paypal_trans = create_transaction(**{"user": obj.user, obj_field: obj})
+        elif len(obj_transactions) > 1:
+            # we may have two pp transactions created if user changed their
+            # username between booking and paying (invoice_id is created and
+            # retrieved using username)
+            if ipn_obj.invoice:
+                matching = [
+                    pptrans for pptrans in obj_transactions
+                    if pptrans.invoice_id == ipn_obj.invoice
+                ]
+                if not matching:
+                    raise transaction_model.DoesNotExist(
+                        f"{transaction_model.__name__} matching query does not exist."
+                    )
+                if len(matching) > 1:
+                    raise transaction_model.MultipleObjectsReturned(
+                        f"get() returned more than one {transaction_model.__name__}"
+                    )
+                paypal_trans = matching[0]
+            else:
+                paypal_trans = obj_transactions[-1]
+        else:  # we got one paypaltrans, as we should have
+            paypal_trans = obj_transactions[0]
+        # avoid refetching the obj when the transaction is used later
+        setattr(paypal_trans, obj_field, obj)
+        paypal_trans_list.append(paypal_trans)
+    return paypal_trans_list
+
+
 def build_obj_dict(ipn_obj, obj_type, obj_ids, voucher_code, voucher_applied_to):
     from payments import helpers
     obj_list = []
@@ -336,92 +384,36 @@ def build_obj_dict(ipn_obj, obj_type, obj_ids, voucher_code, voucher_applied_to)
     invalid_ids = []
     obj_user = None
 
-    if obj_type == 'booking':
-        for id in obj_ids:
-            try:
-                obj = Booking.objects.get(id=id)
-            except Booking.DoesNotExist:
-                invalid_ids.append(id)
-                continue
-
-            paypal_trans = PaypalBookingTransaction.objects.filter(booking=obj)
-            if not paypal_trans:
-                paypal_trans = helpers.create_booking_paypal_transaction(
-                    user=obj.user, booking=obj
-                )
-            elif paypal_trans.count() > 1:
-                # we may have two ppb transactions created if user changed their
-                # username between booking and paying (invoice_id is created and
-                # retrieved using username)
-                if ipn_obj.invoice:
-                    paypal_trans = PaypalBookingTransaction.objects.get(
-                        booking=obj, invoice_id=ipn_obj.invoice
-                    )
-                else:
-                    paypal_trans = paypal_trans.latest('id')
-            else:  # we got one paypaltrans, as we should have
-                paypal_trans = paypal_trans[0]
-
-            obj_list.append(obj)
-            paypal_trans_list.append(paypal_trans)
-    elif obj_type == 'block':
-        for id in obj_ids:
-            try:
-                obj = Block.objects.get(id=id)
-            except Block.DoesNotExist:
-                invalid_ids.append(id)
-                continue
-
-            paypal_trans = PaypalBlockTransaction.objects.filter(block=obj)
-            if not paypal_trans:
-                paypal_trans = helpers.create_block_paypal_transaction(
-                    user=obj.user, block=obj
-                )
-            elif paypal_trans.count() > 1:
-                # we may have two ppb transactions created if user changed their
-                # username between booking block and paying (invoice_id is created and
-                # retrieved using username)
-                if ipn_obj.invoice:
-                    paypal_trans = PaypalBlockTransaction.objects.get(
-                        block=obj, invoice_id=ipn_obj.invoice
-                    )
-                else:
-                    paypal_trans = paypal_trans.latest('id')
-            else:  # we got one paypaltrans, as we should have
-                paypal_trans = paypal_trans[0]
-
-            obj_list.append(obj)
-            paypal_trans_list.append(paypal_trans)
+    if obj_type in ['booking', 'block']:
+        if obj_type == 'booking':
+            objs = Booking.objects.select_related('event', 'user').in_bulk(obj_ids)
+        else:
+            objs = Block.objects.select_related('block_type', 'user').in_bulk(obj_ids)
+        invalid_ids = [id for id in obj_ids if id not in objs]
+        obj_list = [objs[id] for id in obj_ids if id in objs]
+        if obj_type == 'booking':
+            paypal_trans_list = get_paypal_transactions(
+                ipn_obj, obj_list, PaypalBookingTransaction, 'booking',
+                helpers.create_booking_paypal_transaction
+            )
+        else:
+            paypal_trans_list = get_paypal_transactions(
+                ipn_obj, obj_list, PaypalBlockTransaction, 'block',
+                helpers.create_block_paypal_transaction
+            )
     elif obj_type == 'ticket_booking':
         try:
-            obj = TicketBooking.objects.get(id=obj_ids[0])
+            obj = TicketBooking.objects.select_related('ticketed_event', 'user').get(id=obj_ids[0])
         except TicketBooking.DoesNotExist:
             raise PayPalTransactionError(
                 'Ticket Booking with id {} does not exist'.format(obj_ids[0])
             )
 
-        paypal_trans = PaypalTicketBookingTransaction.objects.filter(
-            ticket_booking=obj
-        )
-        if not paypal_trans:
-            paypal_trans = helpers.create_ticket_booking_paypal_transaction(
-                user=obj.user, ticket_booking=obj
-            )
-        elif paypal_trans.count() > 1:
-            # we may have two ppb transactions created if user changed their
-            # username between booking and paying (invoice_id is created and
-            # retrieved using username)
-            if ipn_obj.invoice:
-                paypal_trans = PaypalTicketBookingTransaction.objects.get(
-                    ticket_booking=obj, invoice_id=ipn_obj.invoice
-                )
-            else:
-                paypal_trans = paypal_trans.latest('id')
-        else:  # we got one paypaltrans, as we should have
-            paypal_trans = paypal_trans[0]
-
         obj_list.append(obj)
-        paypal_trans_list.append(paypal_trans)
+        paypal_trans_list = get_paypal_transactions(
+            ipn_obj, obj_list, PaypalTicketBookingTransaction, 'ticket_booking',
+            helpers.create_ticket_booking_paypal_transaction
+        )
     elif obj_type == "gift_voucher":
         try:
             obj = BlockVoucher.objects.get(id=obj_ids[0], code=voucher_code)
@@ -469,8 +461,16 @@ def build_obj_dict(ipn_obj, obj_type, obj_ids, voucher_code, voucher_applied_to)
     }
 
 
-def process_completed_payment(obj_list, paypal_trans_list, ipn_obj, obj_type, voucher_code, voucher_applied_to):
+def process_completed_payment(
+        obj_list, paypal_trans_list, ipn_obj, obj_type, voucher_code, voucher_applied_to, pending_emails
+):
+    """
+    Mark objs as paid and record the paypal transaction id.  Should be called inside
+    a transaction; any warning emails are added to pending_emails so they can be sent
+    once the changes are committed.
+    """
     voucher_error = None
+    update_fields = ['transaction_id']
     for obj, paypal_trans in zip(obj_list, paypal_trans_list):
         if obj_type == 'booking':
             obj.payment_confirmed = True
@@ -485,7 +485,9 @@ def process_completed_payment(obj_list, paypal_trans_list, ipn_obj, obj_type, vo
                     obj.autocancelled = False
                     obj.no_show = False
                     reopened = True
-                send_payment_for_cancelled_booking_email(obj, paypal_trans, ipn_obj, reopened)
+                pending_emails.append(
+                    partial(send_payment_for_cancelled_booking_email, obj, paypal_trans, ipn_obj, reopened)
+                )
         if obj_type in ['booking', 'block']:
             obj.paypal_pending = False
         if obj_type == "gift_voucher":
@@ -508,23 +510,23 @@ def process_completed_payment(obj_list, paypal_trans_list, ipn_obj, obj_type, vo
         # trans not updated yet --> booking is marked as paid so doesn't
         # render the paypal button at all
         paypal_trans.transaction_id = ipn_obj.txn_id
-        paypal_trans.save()
 
         if voucher_code and obj_type != 'gift_voucher':
             try:
                 if obj.id in voucher_applied_to:
                     if obj_type == 'booking':
-                        voucher = EventVoucher.objects.get(code=voucher_code)
+                        voucher = EventVoucher.objects.get_by_code(voucher_code)
                         UsedEventVoucher.objects.create(
                             voucher=voucher, user=obj.user, booking_id=obj.id
                         )
                     elif obj_type == 'block':
-                        voucher = BlockVoucher.objects.get(code=voucher_code)
+                        voucher = BlockVoucher.objects.get_by_code(voucher_code)
                         UsedBlockVoucher.objects.create(
                             voucher=voucher, user=obj.user, block_id=obj.id
                         )
                     paypal_trans.voucher_code = voucher_code
-                    paypal_trans.save()
+                    if 'voucher_code' not in update_fields:
+                        update_fields.append('voucher_code')
 
             except (
                     EventVoucher.DoesNotExist, BlockVoucher.DoesNotExist
@@ -536,21 +538,31 @@ def process_completed_payment(obj_list, paypal_trans_list, ipn_obj, obj_type, vo
             # everything should be ok but email to check
             ipn_obj.invoice = paypal_trans.invoice_id
             ipn_obj.save()
-            send_mail(
-                f'WARNING! No invoice number on paypal ipn for {obj_type} id {obj.id}',
-                'Please check booking and paypal records for '
-                'paypal transaction id {}.  No invoice number on paypal'
-                ' IPN.  Invoice number has been set to {}.'.format(
-                    ipn_obj.txn_id, paypal_trans.invoice_id
-                ),
-                settings.DEFAULT_FROM_EMAIL,
-                [settings.SUPPORT_EMAIL],
-                fail_silently=False
+            pending_emails.append(
+                partial(
+                    send_mail,
+                    f'WARNING! No invoice number on paypal ipn for {obj_type} id {obj.id}',
+                    'Please check booking and paypal records for '
+                    'paypal transaction id {}.  No invoice number on paypal'
+                    ' IPN.  Invoice number has been set to {}.'.format(
+                        ipn_obj.txn_id, paypal_trans.invoice_id
+                    ),
+                    settings.DEFAULT_FROM_EMAIL,
+                    [settings.SUPPORT_EMAIL],
+                    fail_silently=False
+                )
             )
 
+    if paypal_trans_list:
+        type(paypal_trans_list[0]).objects.bulk_update(paypal_trans_list, update_fields)
     return voucher_error
 
 
+def send_pending_emails(pending_emails):
+    for send_email in pending_emails:
+        send_email()
+
+
 def payment_received(sender, **kwargs):
     ipn_obj = sender
 
@@ -606,52 +618,53 @@ def payment_received(sender, **kwargs):
                 send_processed_test_refund_emails(additional_data)
 
             else:
-                voucher_refunded = False
-                try:
-                    original_transaction = PayPalIPN.objects.get(invoice=ipn_obj.invoice, payment_status=ST_PP_COMPLETED)
-                    full_refund = original_transaction.mc_gross == ipn_obj.mc_gross
-                except PayPalIPN.DoesNotExist:
-                    full_refund = False
-                for obj, paypal_trans in zip(obj_list, paypal_trans_list):
-                    if hasattr(paypal_trans, "voucher_code"):
-                        # check for voucher on paypal trans object; delete first
-                        # UsedEventVoucher/UsedBlockVoucher if applicable
-                        used_voucher = None
-                        if obj_type == 'block':
-                            used_voucher = UsedBlockVoucher.objects.filter(
-                                voucher__code=paypal_trans.voucher_code,
-                                user=obj.user
-                            ).first()
-                        elif obj_type == 'booking' and obj.status == "CANCELLED":
-                            used_voucher = UsedEventVoucher.objects.filter(
-                                voucher__code=paypal_trans.voucher_code,
-                                user=obj.user
-                            ).first()
-                        elif obj_type == "gift_voucher":
-                            # if this is a refunded gift voucher, deactivate it
-                            obj.activated = False
+                with transaction.atomic():
+                    voucher_refunded = False
+                    try:
+                        original_transaction = PayPalIPN.objects.get(invoice=ipn_obj.invoice, payment_status=ST_PP_COMPLETED)
+                        full_refund = original_transaction.mc_gross == ipn_obj.mc_gross
+                    except PayPalIPN.DoesNotExist:
+                        full_refund = False
+                    for obj, paypal_trans in zip(obj_list, paypal_trans_list):
+                        if hasattr(paypal_trans, "voucher_code"):
+                            # check for voucher on paypal trans object; delete first
+                            # UsedEventVoucher/UsedBlockVoucher if applicable
+                            used_voucher = None
+                            if obj_type == 'block':
+                                used_voucher = UsedBlockVoucher.objects.filter(
+                                    voucher__code=paypal_trans.voucher_code,
+                                    user=obj.user
+                                ).first()
+                            elif obj_type == 'booking' and obj.status == "CANCELLED":
+                                used_voucher = UsedEventVoucher.objects.filter(
+                                    voucher__code=paypal_trans.voucher_code,
+                                    user=obj.user
+                                ).first()
+                            elif obj_type == "gift_voucher":
+                                # if this is a refunded gift voucher, deactivate it
+                                obj.activated = False
+                                obj.save()
+                            if used_voucher:
+                                voucher_refunded = True
+                                used_voucher.delete()
+                        if (obj_type == 'booking' and obj.status == "CANCELLED") or full_refund:
+                            # only set cancelled bookings or objs in fully refunded transactions to unpaid;
+                            # refund could apply to more than one booking
+                            if hasattr(obj, "payment_confirmed"):
+                                obj.payment_confirmed = False
+                            obj.paid = False
                             obj.save()
-                        if used_voucher:
-                            voucher_refunded = True
-                            used_voucher.delete()
-                    if (obj_type == 'booking' and obj.status == "CANCELLED") or full_refund:
-                        # only set cancelled bookings or objs in fully refunded transactions to unpaid;
-                        # refund could apply to more than one booking
-                        if hasattr(obj, "payment_confirmed"):
-                            obj.payment_confirmed = False
-                        obj.paid = False
-                        obj.save()
 
-                ActivityLog.objects.create(
-                    log='Transaction for {} id(s) {} for user {} has been {} from paypal; '
-                        'paypal transaction id {}, invoice id {}.{}'.format(
-                            obj_type.title(), obj_ids,
-                            obj_user,
-                            "refunded" if full_refund else "part refunded",
-                            ipn_obj.txn_id, paypal_trans_list[0].invoice_id,
-                            f' Used voucher deleted (code {paypal_trans.voucher_code}).' if voucher_refunded else ''
-                        )
-                )
+                    ActivityLog.objects.create(
+                        log='Transaction for {} id(s) {} for user {} has been {} from paypal; '
+                            'paypal transaction id {}, invoice id {}.{}'.format(
+                                obj_type.title(), obj_ids,
+                                obj_user,
+                                "refunded" if full_refund else "part refunded",
+                                ipn_obj.txn_id, paypal_trans_list[0].invoice_id,
+                                f' Used voucher deleted (code {paypal_trans.voucher_code}).' if voucher_refunded else ''
+                            )
+                    )
                 if settings.SEND_ALL_STUDIO_EMAILS:
                     send_processed_refund_emails(obj_type, obj_ids, obj_list, paypal_trans_list)
 
@@ -700,37 +713,47 @@ def payment_received(sender, **kwargs):
                 )
                 send_processed_test_confirmation_emails(additional_data)
             else:
-                voucher_error = process_completed_payment(obj_list, paypal_trans_list, ipn_obj, obj_type, voucher_code, voucher_applied_to)
+                # apply all updates in one transaction, and only send emails once
+                # they've been committed
+                pending_emails = []
+                with transaction.atomic():
+                    voucher_error = process_completed_payment(
+                        obj_list, paypal_trans_list, ipn_obj, obj_type, voucher_code, voucher_applied_to,
+                        pending_emails
+                    )
 
-                ActivityLog.objects.create(
-                    log='{} id(s) {} for user {} paid by PayPal; paypal {} ids {}'.format(
-                        obj_type.title(),
-                        obj_ids,
-                        obj_user,
-                        obj_type,
-                        ', '.join([str(pp.id) for pp in paypal_trans_list]),
+                    ActivityLog.objects.create(
+                        log='{} id(s) {} for user {} paid by PayPal; paypal {} ids {}'.format(
+                            obj_type.title(),
+                            obj_ids,
+                            obj_user,
+                            obj_type,
+                            ', '.join([str(pp.id) for pp in paypal_trans_list]),
+                        )
                     )
-                )
+                    if voucher_code and not voucher_error:
+                        ActivityLog.objects.create(
+                            log='Voucher code {} used for paypal txn {} ({} id(s) '
+                                '{}) by user {}'.format(
+                                voucher_code,
+                                ipn_obj.txn_id,
+                                obj_type,
+                                obj_ids,
+                                obj_user,
+                            )
+                        )
 
-                send_processed_payment_emails(obj_type, obj_ids, obj_list, paypal_trans_list)
+                pending_emails.append(
+                    partial(send_processed_payment_emails, obj_type, obj_ids, obj_list, paypal_trans_list)
+                )
                 if obj_type == "gift_voucher":
-                    send_gift_voucher_email(obj_list[0])
+                    pending_emails.append(partial(send_gift_voucher_email, obj_list[0]))
+                send_pending_emails(pending_emails)
 
                 if voucher_error:
                     # raise error from invalid voucher here so emails for
                     # payments are still sent
                     raise voucher_error
-                elif voucher_code:
-                    ActivityLog.objects.create(
-                        log='Voucher code {} used for paypal txn {} ({} id(s) '
-                            '{}) by user {}'.format(
-                            voucher_code,
-                            ipn_obj.txn_id,
-                            obj_type,
-                            obj_ids,
-                            obj_user,
-                        )
-                    )
 
         else:  # any other status
             if obj_type == 'paypal_test':
@@ -836,18 +859,24 @@ def payment_not_received(sender, **kwargs):
             # check if the status is completed; mark booking as paid but send warning email too
             # Don't mark as paid if the flag is duplicate transaction id
             if ipn_obj.payment_status == ST_PP_COMPLETED and 'duplicate txn_id' not in ipn_obj.flag_info.lower():
-                voucher_error = process_completed_payment(obj_list, paypal_trans_list, ipn_obj, obj_type, voucher_code, voucher_applied_to)
+                pending_emails = []
+                with transaction.atomic():
+                    voucher_error = process_completed_payment(
+                        obj_list, paypal_trans_list, ipn_obj, obj_type, voucher_code, voucher_applied_to,
+                        pending_emails
+                    )
 
-                ActivityLog.objects.create(
-                    log='{} id(s) {} for user {} paid by PayPal; paypal '
-                        '{} ids {}'.format(
-                        obj_type.title(),
-                        obj_ids,
-                        obj_user,
-                        obj_type,
-                        ', '.join([str(pp.id) for pp in paypal_trans_list]),
+                    ActivityLog.objects.create(
+                        log='{} id(s) {} for user {} paid by PayPal; paypal '
+                            '{} ids {}'.format(
+                            obj_type.title(),
+                            obj_ids,
+                            obj_user,
+                            obj_type,
+                            ', '.join([str(pp.id) for pp in paypal_trans_list]),
+                        )
                     )
-                )
+                send_pending_emails(pending_emails)
 
                 # Don't send payment emails to user, so we get the warning email and can check the payment first
                 if voucher_error:  # pragma: no cover
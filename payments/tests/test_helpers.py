@@ -6,6 +6,9 @@ import re
 from model_bakery import baker
 
 from django.test import TestCase
+
+from paypal.standard.ipn.models import PayPalIPN
+from paypal.standard.models import ST_PP_COMPLETED
 from django.utils import timezone
 
 from common.tests.helpers import PatchRequestMixin
@@ -396,3 +399,47 @@ class TestHelpers(PatchRequestMixin, TestCase):
         new_txn = helpers.create_gift_voucher_paypal_transaction(voucher_type, "1234")
         assert new_txn.id != transaction.id
         assert re.match("gift-voucher-1234-inv#\d{3}001", new_txn.invoice_id)
+
+    def test_reconcile_paypal_bookings(self):
+        bookings = baker.make_recipe('booking.booking', paid=False, paypal_pending=True, _quantity=6)
+        # no transaction
+        no_txn = bookings[0]
+        # transaction, no IPN
+        baker.make(PaypalBookingTransaction, booking=bookings[1], invoice_id="inv1")
+        # transaction, IPN not completed
+        baker.make(PaypalBookingTransaction, booking=bookings[2], invoice_id="inv2")
+        baker.make(PayPalIPN, invoice="inv2", txn_id="txn2", payment_status="Pending")
+        # transactions with completed IPNs; only the latest transaction is checked
+        for i, booking in enumerate(bookings[3:], start=3):
+            baker.make(PaypalBookingTransaction, booking=booking, invoice_id=f"old{i}", transaction_id="a")
+            baker.make(PaypalBookingTransaction, booking=booking, invoice_id=f"inv{i}")
+            baker.make(PayPalIPN, invoice=f"inv{i}", txn_id=f"txn{i}", payment_status=ST_PP_COMPLETED)
+
+        # 2 queries to find the payments, 2 to update the paid bookings and their transactions
+        with self.assertNumQueries(4):
+            unpaid = helpers.reconcile_paypal_bookings(bookings)
+        assert unpaid == bookings[:3]
+
+        for booking in bookings:
+            booking.refresh_from_db()
+        assert [booking.paid for booking in bookings] == [False] * 3 + [True] * 3
+        for i, booking in enumerate(bookings[3:], start=3):
+            assert booking.payment_confirmed
+            assert booking.date_payment_confirmed is not None
+            assert not booking.paypal_pending
+            assert PaypalBookingTransaction.objects.get(invoice_id=f"inv{i}").transaction_id == f"txn{i}"
+        assert no_txn.paypal_pending
+
+    def test_reconcile_paypal_bookings_no_bookings(self):
+        with self.assertNumQueries(0):
+            assert helpers.reconcile_paypal_bookings([]) == []
+
+    def test_reconcile_paypal_ticket_bookings(self):
+        ticket_bookings = baker.make("booking.TicketBooking", paid=False, _quantity=2)
+        baker.make(PaypalTicketBookingTransaction, ticket_booking=ticket_bookings[0], invoice_id="inv1")
+        baker.make(PayPalIPN, invoice="inv1", txn_id="txn1", payment_status=ST_PP_COMPLETED)
+
+        assert helpers.reconcile_paypal_ticket_bookings(ticket_bookings) == ticket_bookings[1:]
+        ticket_bookings[0].refresh_from_db()
+        assert ticket_bookings[0].paid
+        assert PaypalTicketBookingTransaction.objects.get(invoice_id="inv1").transaction_id == "txn1"
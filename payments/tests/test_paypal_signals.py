@@ -17,6 +17,7 @@ from payments import helpers
 from payments.models import PaypalBookingTransaction, PaypalBlockTransaction, \
     PaypalTicketBookingTransaction, PaypalGiftVoucherTransaction
 from payments.models import logger as payment_models_logger
+from payments.signals import get_obj
 
 from paypal.standard.ipn.models import PayPalIPN
 
@@ -2963,3 +2964,92 @@ class PaypalSignalTestsCancelledBooking(PaypalSignalsTestBase):
             "NOTE: Fails if SEND_ALL_STUDIO_EMAILS!=True in env/test settings"
         )
         assert mail.outbox[0].subject == 'WARNING! Payment processed for cancelled booking'
+
+
+class PaypalSignalsBulkProcessingTests(PaypalSignalsTestBase):
+
+    def test_get_obj_queries_do_not_depend_on_number_of_bookings(self):
+        user = baker.make_recipe('booking.user')
+        bookings = baker.make_recipe(
+            'booking.booking', user=user,
+            event__paypal_email=settings.DEFAULT_PAYPAL_EMAIL,
+            _quantity=5
+        )
+        invoice = helpers.create_multibooking_paypal_transaction(user, bookings)
+        ipn_obj = PayPalIPN(
+            custom='obj=booking ids={}'.format(','.join([str(booking.id) for booking in bookings])),
+            invoice=invoice
+        )
+        # one query for the bookings, one for their paypal transactions
+        with self.assertNumQueries(2):
+            obj_dict = get_obj(ipn_obj)
+        self.assertEqual(obj_dict['obj_list'], bookings)
+        self.assertEqual(
+            [pptrans.booking for pptrans in obj_dict['paypal_trans_list']], bookings
+        )
+
+    def test_get_obj_selects_transaction_by_invoice(self):
+        booking = baker.make_recipe(
+            'booking.booking_with_user', event__paypal_email=settings.DEFAULT_PAYPAL_EMAIL
+        )
+        baker.make(PaypalBookingTransaction, booking=booking, invoice_id='invoice_1')
+        pptrans = baker.make(PaypalBookingTransaction, booking=booking, invoice_id='invoice_2')
+        baker.make(PaypalBookingTransaction, booking=booking, invoice_id='invoice_3')
+
+        ipn_obj = PayPalIPN(custom=f'obj=booking ids={booking.id}', invoice='invoice_2')
+        self.assertEqual(get_obj(ipn_obj)['paypal_trans_list'], [pptrans])
+
+        # no invoice on the ipn, use the latest
+        ipn_obj = PayPalIPN(custom=f'obj=booking ids={booking.id}')
+        self.assertEqual(
+            get_obj(ipn_obj)['paypal_trans_list'],
+            [PaypalBookingTransaction.objects.latest('id')]
+        )
+
+    @patch('paypal.standard.ipn.models.PayPalIPN._postback')
+    def test_replay_recorded_ipns(self, mock_postback):
+        """
+        Replay a few hundred IPNs, each paying for a basket of two bookings
+        """
+        mock_postback.return_value = b"VERIFIED"
+        events = baker.make_recipe(
+            'booking.future_PP', paypal_email=settings.DEFAULT_PAYPAL_EMAIL, _quantity=2
+        )
+        users = baker.make_recipe('booking.user', _quantity=200)
+        recorded_ipns = []
+        for i, user in enumerate(users):
+            bookings = [
+                baker.make_recipe('booking.booking', user=user, event=event)
+                for event in events
+            ]
+            invoice = helpers.create_multibooking_paypal_transaction(user, bookings)
+            params = dict(IPN_POST_PARAMS)
+            params.update(
+                {
+                    'custom': b('obj=booking ids={}'.format(
+                        ','.join([str(booking.id) for booking in bookings])
+                    )),
+                    'invoice': b(invoice),
+                    'txn_id': b(f'test_txn_id_{i}'),
+                }
+            )
+            recorded_ipns.append(params)
+
+        for params in recorded_ipns:
+            resp = self.paypal_post(params)
+            self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(PayPalIPN.objects.count(), 200)
+        self.assertFalse(PayPalIPN.objects.filter(flag=True).exists())
+        self.assertFalse(Booking.objects.filter(paid=False).exists())
+        self.assertFalse(Booking.objects.filter(payment_confirmed=False).exists())
+        self.assertFalse(
+            PaypalBookingTransaction.objects.filter(transaction_id__isnull=True).exists()
+        )
+        # 2 emails for each ipn, to user and studio
+        self.assertEqual(
+            len(mail.outbox), 400,
+            "NOTE: Fails if SEND_ALL_STUDIO_EMAILS!=True in env/test settings"
+        )
+        for email in mail.outbox:
+            self.assertIn('Payment processed for booking id', email.subject)
@@ -3,7 +3,7 @@ from django.urls import reverse
 from django.utils.safestring import mark_safe 
 
 from booking.models import Booking, Block
-from stripe_payments.models import Invoice, StripePaymentIntent, Seller, StripeSubscriptionInvoice
+from stripe_payments.models import Invoice, StripePaymentIntent, Seller, StripeSubscriptionInvoice, StripeWebhookEvent
 
 
 from django.contrib import admin
@@ -65,6 +65,9 @@ class InvoiceAdmin(admin.ModelAdmin):
 
     inlines = (BookingInline, BlockInline, BlockVoucherInline, EventVoucherInline, TicketBookingInline)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related("payment_intents", *Invoice.ITEM_PREFETCHES)
+
     def get_username(self, obj):
         return obj.username
     get_username.short_description = "Email"
@@ -76,8 +79,10 @@ class InvoiceAdmin(admin.ModelAdmin):
     display_amount.admin_order_field = "amount"
 
     def pi(self, obj):
-        if obj.payment_intents.exists():
-            pi = obj.payment_intents.first()
+        # payment intents are prefetched
+        payment_intents = sorted(obj.payment_intents.all(), key=lambda pi: pi.pk)
+        if payment_intents:
+            pi = payment_intents[0]
             return mark_safe(
                 '<a href="{}">{}</a>'.format(
                 reverse("admin:stripe_payments_stripepaymentintent_change", args=(pi.pk,)),
@@ -104,6 +109,11 @@ class StripePaymentIntentAdmin(admin.ModelAdmin):
     list_filter = ("status", "invoice__username")
     readonly_fields = fields
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("invoice").prefetch_related(
+            *(f"invoice__{lookup}" for lookup in Invoice.ITEM_PREFETCHES)
+        )
+
     def username(self, obj):
         return obj.invoice.username
 
@@ -141,4 +151,14 @@ class StripeSubscriptionInvoiceAdmin(admin.ModelAdmin):
             return None
 
 
+@admin.register(StripeWebhookEvent)
+class StripeWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("event_id", "event_type", "date_received", "processed", "attempts")
+    list_filter = ("processed", "event_type")
+    search_fields = ("event_id",)
+    readonly_fields = (
+        "event_id", "event_type", "payload", "date_received", "processed", "date_processed", "attempts", "error"
+    )
+
+
 admin.site.register(Seller)
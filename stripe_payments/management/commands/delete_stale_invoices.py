@@ -0,0 +1,43 @@
+'''
+Delete unpaid invoices that were created more than --days days ago (default 7).
+These are left behind by users who go to the checkout and then abandon it; any items
+still on them are unlinked, and will get a new invoice if they are checked out again.
+Invoices with a payment intent that is processing or has succeeded are kept, so
+that late payments can still be matched to their invoice.
+'''
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from activitylog.models import ActivityLog
+from stripe_payments.models import Invoice, StripePaymentIntent
+from common.management import write_command_name
+
+
+IN_PROGRESS_PAYMENT_INTENT_STATUSES = ["processing", "requires_capture", "succeeded"]
+
+
+class Command(BaseCommand):
+    help = "Delete stale unpaid invoices"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=7, help="Delete unpaid invoices created more than this many days ago"
+        )
+
+    def handle(self, *args, **options):
+        write_command_name(self, __file__)
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        stale_invoices = Invoice.objects.filter(paid=False, date_created__lt=cutoff).exclude(
+            payment_intents__status__in=IN_PROGRESS_PAYMENT_INTENT_STATUSES
+        )
+        invoice_ids = list(stale_invoices.values_list("invoice_id", flat=True))
+        if invoice_ids:
+            StripePaymentIntent.objects.filter(invoice__invoice_id__in=invoice_ids).delete()
+            Invoice.objects.filter(invoice_id__in=invoice_ids).delete()
+            log = f"{len(invoice_ids)} stale unpaid invoice(s) deleted: invoice_ids {','.join(invoice_ids)}"
+            ActivityLog.objects.create(log=log)
+            self.stdout.write(log)
+        else:
+            self.stdout.write("No stale unpaid invoices to delete")
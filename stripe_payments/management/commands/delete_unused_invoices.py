@@ -10,7 +10,8 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         write_command_name(self, __file__)
-        unused_invoices = [invoice for invoice in Invoice.objects.filter(paid=False) if invoice.item_count() == 0]
+        unpaid_invoices = Invoice.objects.filter(paid=False).prefetch_related(*Invoice.ITEM_PREFETCHES)
+        unused_invoices = [invoice for invoice in unpaid_invoices if invoice.item_count() == 0]
         if unused_invoices:
             log = f"{len(unused_invoices)} unpaid unused invoice(s) deleted: invoice_ids {','.join([invoice.invoice_id for invoice in unused_invoices])}"
             for invoice in unused_invoices:
@@ -0,0 +1,66 @@
+import json
+import logging
+
+import stripe
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from activitylog.models import ActivityLog
+from stripe_payments.models import StripeWebhookEvent
+from stripe_payments.views.webhook import process_stripe_event
+from common.management import write_command_name
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Reprocess stored stripe webhook events. By default, replays all events that "
+        "have not been successfully processed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("event_ids", nargs="*", help="Stripe event ids to replay")
+        parser.add_argument(
+            "--force", action="store_true", help="Replay events even if they have already been processed"
+        )
+
+    def handle(self, *args, **options):
+        write_command_name(self, __file__)
+        webhook_events = StripeWebhookEvent.objects.order_by("date_received")
+        if options["event_ids"]:
+            webhook_events = webhook_events.filter(event_id__in=options["event_ids"])
+            missing = set(options["event_ids"]) - set(webhook_events.values_list("event_id", flat=True))
+            if missing:
+                raise CommandError(f"Stripe event(s) not found: {', '.join(sorted(missing))}")
+        if not options["force"]:
+            webhook_events = webhook_events.filter(processed=False)
+
+        if not webhook_events.exists():
+            self.stdout.write("No stripe events to replay")
+            return
+
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        for webhook_event in webhook_events:
+            try:
+                event = stripe.Event.construct_from(json.loads(webhook_event.payload), stripe.api_key)
+            except json.JSONDecodeError:
+                self.stdout.write(f"Stripe event {webhook_event.event_id}: invalid payload, skipped")
+                continue
+            if not webhook_event.claim(force=options["force"]):
+                self.stdout.write(f"Stripe event {webhook_event.event_id}: already processed or being processed, skipped")
+                continue
+            try:
+                response = process_stripe_event(event)
+            except Exception:
+                webhook_event.release()
+                raise
+            webhook_event.record_result(response)
+            if webhook_event.processed:
+                log = f"Stripe event {webhook_event.event_id} ({webhook_event.event_type}) replayed"
+                ActivityLog.objects.create(log=log)
+            else:
+                log = f"Stripe event {webhook_event.event_id} ({webhook_event.event_type}) failed: {webhook_event.error}"
+            self.stdout.write(log)
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.10 on 2026-10-19 04:19
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripe_payments', '0005_stripesubscriptioninvoice_promo_code_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('event_type', models.CharField(max_length=255)),
+                ('payload', models.TextField(help_text='Raw event payload, as received from stripe')),
+                ('date_received', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed', models.BooleanField(default=False)),
+                ('date_processed', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ('-date_received',),
+            },
+        ),
+    ]
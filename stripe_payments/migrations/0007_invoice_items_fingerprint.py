@@ -0,0 +1,42 @@
+# Generated by Django 5.1.10 on 2026-10-19 05:53
+
+from hashlib import sha256
+
+from django.db import migrations, models
+
+
+def set_items_fingerprint(apps, schema_editor):
+    # Only unpaid invoices are ever reused, so only those need a fingerprint
+    Invoice = apps.get_model("stripe_payments", "Invoice")
+    for invoice in Invoice.objects.filter(paid=False, is_stripe_test=False).prefetch_related(
+        "bookings", "blocks", "ticket_bookings", "block_gift_vouchers", "event_gift_vouchers"
+    ):
+        items = [
+            *invoice.bookings.all(), *invoice.blocks.all(), *invoice.ticket_bookings.all(),
+            *invoice.block_gift_vouchers.all(), *invoice.event_gift_vouchers.all()
+        ]
+        if items:
+            item_keys = sorted(f"{item._meta.label_lower}_{item.id}" for item in items)
+            invoice.items_fingerprint = sha256(",".join(item_keys).encode("utf-8")).hexdigest()
+            invoice.save(update_fields=["items_fingerprint"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0109_voucher_code_upper_unique'),
+        ('stripe_payments', '0006_stripewebhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='items_fingerprint',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['username', 'paid', 'items_fingerprint'], name='stripe_paym_usernam_f60448_idx'),
+        ),
+        migrations.RunPython(set_items_fingerprint, migrations.RunPython.noop),
+    ]
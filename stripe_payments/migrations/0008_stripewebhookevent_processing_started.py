@@ -0,0 +1,18 @@
+# Generated by Django 5.1.10 on 2026-10-19 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripe_payments', '0007_invoice_items_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripewebhookevent',
+            name='processing_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,14 +1,18 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from datetime import timezone as dt_timezone
 from os import environ
 
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
+from django.utils.functional import cached_property
 
-from hashlib import sha512
+from hashlib import sha256, sha512
 from shortuuid import ShortUUID
 
 
@@ -27,9 +31,15 @@ class Invoice(models.Model):
         max_length=255, null=True, blank=True, help_text="Voucher applied to invoice total"
     )
     is_stripe_test = models.BooleanField(default=False)
+    # identifies the set of items this invoice was created for, so an unpaid invoice
+    # can be reused if the user checks out the same items again
+    items_fingerprint = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
         ordering = ("-date_paid",)
+        indexes = [
+            models.Index(fields=["username", "paid", "items_fingerprint"]),
+        ]
 
     def __str__(self):
         return f"{self.invoice_id} - {self.username} - £{self.amount}{' (paid)' if self.paid else ''}"
@@ -41,6 +51,17 @@ class Invoice(models.Model):
             invoice_id = ShortUUID().random(length=22)
         return invoice_id
 
+    @classmethod
+    def get_items_fingerprint(cls, items):
+        """
+        Deterministic hash of a set of invoice items (bookings, blocks, ticket bookings
+        or gift vouchers); independent of the order of the items
+        """
+        if not items:
+            return None
+        item_keys = sorted(f"{item._meta.label_lower}_{item.id}" for item in items)
+        return sha256(",".join(item_keys).encode("utf-8")).hexdigest()
+
     def signature(self):
         return sha512((self.invoice_id + environ["INVOICE_KEY"]).encode("utf-8")).hexdigest()
 
@@ -50,19 +71,64 @@ class Invoice(models.Model):
 
     @property
     def gift_vouchers(self):
+        return set(self._items["gift_vouchers"])
+
+    # Everything needed to describe the invoice items, fetched in a fixed number of queries
+    ITEM_PREFETCHES = (
+        "bookings__event",
+        "bookings__user",
+        "blocks__block_type__event_type",
+        "blocks__user",
+        "ticket_bookings__ticketed_event",
+        "ticket_bookings__tickets",
+        "ticket_bookings__user",
+        "block_gift_vouchers",
+        "event_gift_vouchers",
+    )
+
+    @cached_property
+    def _items(self):
+        # uses the invoice's prefetched items if it was fetched with
+        # prefetch_related(*Invoice.ITEM_PREFETCHES); otherwise fetches them now
+        prefetch_related_objects([self], *self.ITEM_PREFETCHES)
         return {
-            gift_voucher for gift_voucher in set(self.block_gift_vouchers.all()) | set(self.event_gift_vouchers.all())
+            "bookings": list(self.bookings.all()),
+            "blocks": list(self.blocks.all()),
+            "gift_vouchers": list(
+                {*self.block_gift_vouchers.all(), *self.event_gift_vouchers.all()}
+            ),
+            "ticket_bookings": list(self.ticket_bookings.all()),
         }
 
+    def reset_items(self):
+        """
+        Discard the items cached on this instance; call after adding or removing
+        items, so they are re-fetched on next access
+        """
+        for attr in ["_items", "_items_dict"]:
+            self.__dict__.pop(attr, None)
+        prefetched = getattr(self, "_prefetched_objects_cache", {})
+        for lookup in ["bookings", "blocks", "ticket_bookings", "block_gift_vouchers", "event_gift_vouchers"]:
+            prefetched.pop(lookup, None)
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.reset_items()
+
     def items_summary(self):
+        items = self._items
         return {
-            "bookings": [booking.event.str_no_location() for booking in self.bookings.all()],
-            "blocks": [str(block.block_type) for block in self.blocks.all()],
-            "gift_vouchers": [gift_voucher.gift_voucher_type.name for gift_voucher in self.gift_vouchers],
-            "ticket_bookings": [str(tb.ticketed_event) for tb in self.ticket_bookings.all()],
+            "bookings": [booking.event.str_no_location() for booking in items["bookings"]],
+            "blocks": [str(block.block_type) for block in items["blocks"]],
+            "gift_vouchers": [gift_voucher.gift_voucher_type.name for gift_voucher in items["gift_vouchers"]],
+            "ticket_bookings": [str(tb.ticketed_event) for tb in items["ticket_bookings"]],
         }
 
     def items_dict(self):
+        return self._items_dict
+
+    @cached_property
+    def _items_dict(self):
         if self.is_stripe_test:
             return {
                 "stripe_test": {
@@ -71,29 +137,28 @@ class Invoice(models.Model):
                     "cost_in_p": 30,
                 }
             }
-        def _cost_str(item):
-            cost_str = f"£{item.cost_with_voucher:.2f}"
+        def _cost_str(item, cost):
+            cost_str = f"£{cost:.2f}"
             if item.voucher_code:
                 cost_str = f"{cost_str} (voucher applied: {item.voucher_code})"
             return cost_str
-         
-        bookings = {
-            f"booking_{item.id}": {
-                "name": item.event.str_no_location(), 
+
+        def _voucher_item(item, name):
+            cost = item.cost_with_voucher
+            return {
+                "name": name,
                 "voucher": item.voucher_code,
-                "cost_str": _cost_str(item),
-                "cost_in_p": int(item.cost_with_voucher * 100),
+                "cost_str": _cost_str(item, cost),
+                "cost_in_p": int(cost * 100),
                 "user": item.user,
-            } for item in self.bookings.all()
+            }
+
+        items = self._items
+        bookings = {
+            f"booking_{item.id}": _voucher_item(item, item.event.str_no_location()) for item in items["bookings"]
         }
         blocks = {
-            f"block_{item.id}": {
-                "name": str(item.block_type), 
-                "voucher": item.voucher_code,
-                "cost_str": _cost_str(item),
-                "cost_in_p": int(item.cost_with_voucher * 100),
-                "user": item.user,
-            } for item in self.blocks.all()
+            f"block_{item.id}": _voucher_item(item, str(item.block_type)) for item in items["blocks"]
         }
         ticket_bookings = {
             f"ticket_booking_{item.id}": {
@@ -102,25 +167,22 @@ class Invoice(models.Model):
                 "cost_str":f"£{item.cost:.2f}",
                 "cost_in_p": int(item.cost * 100),
                 "user": item.user,
-            } for item in self.ticket_bookings.all()
-        }
-        gift_vouchers = {
-            f"gift_voucher_{gift_voucher.id}": {
-                "name": gift_voucher.gift_voucher_type.name, 
-                "cost_str": f"£{gift_voucher.gift_voucher_type.cost:.2f}", 
-                "cost_in_p": int(gift_voucher.gift_voucher_type.cost * 100)
-            } for gift_voucher in self.gift_vouchers
+            } for item in items["ticket_bookings"]
         }
+        gift_vouchers = {}
+        for gift_voucher in items["gift_vouchers"]:
+            # gift_voucher_type is looked up from the db, so only fetch it once per voucher
+            gift_voucher_type = gift_voucher.gift_voucher_type
+            gift_vouchers[f"gift_voucher_{gift_voucher.id}"] = {
+                "name": gift_voucher_type.name, 
+                "cost_str": f"£{gift_voucher_type.cost:.2f}", 
+                "cost_in_p": int(gift_voucher_type.cost * 100)
+            }
 
         return {**bookings, **ticket_bookings, **blocks, **gift_vouchers}
 
     def _item_counts(self):
-        return {
-            "bookings": self.bookings.count(),
-            "blocks": self.blocks.count(),
-            "gift_vouchers": len(self.gift_vouchers),
-            "ticket_bookings": self.ticket_bookings.count(),
-        }
+        return {item_type: len(items) for item_type, items in self._items.items()}
 
     def item_count(self):
         if self.is_stripe_test:
@@ -156,6 +218,37 @@ class Invoice(models.Model):
         super().save()
 
 
+SELLER_CACHE_KEY = "stripe_sellers_by_site"
+# the cache is cleared when a Seller changes; the timeout limits how long a stale
+# entry can last if it's missed
+SELLER_CACHE_TIMEOUT = 60 * 5
+
+
+class SellerManager(models.Manager):
+
+    def get_for_site(self, site):
+        """
+        Return the Seller connected to this site, or None if there isn't one.
+        Sellers are held in the shared cache, so every worker process sees the same
+        values; the cache is cleared once a change to a Seller has been committed.
+        """
+        sellers = cache.get(SELLER_CACHE_KEY, {})
+        if site.id not in sellers:
+            seller = self.filter(site=site).first()
+            if seller is None:
+                # Don't cache missing sellers, so a newly connected account is picked up immediately
+                return None
+            sellers[site.id] = seller
+            cache.set(SELLER_CACHE_KEY, sellers, timeout=SELLER_CACHE_TIMEOUT)
+        return sellers[site.id]
+
+    def get_current(self, request=None):
+        return self.get_for_site(Site.objects.get_current(request))
+
+    def clear_cache(self):
+        cache.delete(SELLER_CACHE_KEY)
+
+
 class Seller(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     site = models.OneToOneField(Site, on_delete=models.CASCADE, null=True, blank=True)
@@ -163,10 +256,22 @@ class Seller(models.Model):
     stripe_access_token = models.CharField(max_length=255, blank=True)
     stripe_refresh_token = models.CharField(max_length=255, blank=True)
 
+    objects = SellerManager()
+
     def __str__(self):
         return self.user.email
 
 
+def clear_seller_cache(sender, **kwargs):
+    # clear after commit, so a request reading the seller before the change is
+    # committed can't put the old row back in the cache
+    transaction.on_commit(Seller.objects.clear_cache)
+
+
+post_save.connect(clear_seller_cache, sender=Seller)
+post_delete.connect(clear_seller_cache, sender=Seller)
+
+
 class StripePaymentIntent(models.Model):
     payment_intent_id = models.CharField(max_length=255)
     amount = models.PositiveIntegerField()
@@ -236,3 +341,65 @@ class StripeSubscriptionInvoice(models.Model):
             voucher = StripeSubscriptionVoucher.objects.filter(promo_code_id=self.promo_code_id).first()
             return voucher.code if voucher else ""
         return ""
+
+
+class StripeWebhookEvent(models.Model):
+    """
+    Record of each stripe event received by the webhook, keyed on the stripe event id.
+    Events are stored before they are processed; retried deliveries of an event that has
+    already been processed are acknowledged without processing again.
+    An event is claimed (processing_started set with a conditional update) before it's
+    processed, so a retry that arrives while the first delivery is still being processed
+    can't process it a second time.  Claims older than CLAIM_TIMEOUT are assumed to
+    belong to a worker that died, and can be claimed again.
+    Stored payloads can be reprocessed with the replay_stripe_webhook_events command.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=255)
+    payload = models.TextField(help_text="Raw event payload, as received from stripe")
+    date_received = models.DateTimeField(default=timezone.now)
+    processed = models.BooleanField(default=False)
+    date_processed = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    processing_started = models.DateTimeField(null=True, blank=True)
+
+    CLAIM_TIMEOUT = timedelta(minutes=10)
+
+    class Meta:
+        ordering = ("-date_received",)
+
+    def __str__(self):
+        return f"{self.event_id} - {self.event_type}{' (processed)' if self.processed else ''}"
+
+    def claim(self, force=False):
+        """
+        Claim the event for processing; returns False if it has already been processed
+        (unless force) or another request is processing it
+        """
+        now = timezone.now()
+        unclaimed = models.Q(processing_started__isnull=True) | models.Q(processing_started__lt=now - self.CLAIM_TIMEOUT)
+        webhook_events = StripeWebhookEvent.objects.filter(unclaimed, id=self.id)
+        if not force:
+            webhook_events = webhook_events.filter(processed=False)
+        if not webhook_events.update(processing_started=now):
+            self.refresh_from_db()
+            return False
+        self.processing_started = now
+        return True
+
+    def release(self):
+        self.processing_started = None
+        self.save(update_fields=["processing_started"])
+
+    def record_result(self, response):
+        """Update processing status from the HttpResponse returned from processing the event"""
+        self.processing_started = None
+        self.attempts += 1
+        if response.status_code == 200:
+            self.processed = True
+            self.date_processed = timezone.now()
+            self.error = None
+        else:
+            self.error = response.content.decode("utf-8")
+        self.save()
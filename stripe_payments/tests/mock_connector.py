@@ -101,7 +101,7 @@ class MockConnector:
     def update_stripe_customer(self, *args, **kwargs):
         self._record(self.update_stripe_customer, *args, **kwargs)
 
-    def get_subscription(self, subscription_id):
+    def get_subscription(self, subscription_id, use_cache=False):
         self._record(self.get_subscription, subscription_id)
         if self.no_subscription:
             return None
@@ -115,7 +115,7 @@ class MockConnector:
             discounts=[Mock(**self.discount)] if self.discount else []
         )
 
-    def get_subscriptions_for_customer(self, customer_id, status="all"):
+    def get_subscriptions_for_customer(self, customer_id, status="all", use_cache=False):
         self._record(self.get_subscriptions_for_customer, customer_id, status=status )
         return self.subscriptions
 
@@ -136,6 +136,9 @@ class MockConnector:
             default_payment_method=kwargs.get("default_payment_method")
         )
     
+    def invalidate_subscription_cache(self, subscription_id=None, customer_id=None):
+        self._record(self.invalidate_subscription_cache, subscription_id=subscription_id, customer_id=customer_id)
+
     def get_or_create_subscription_schedule(self, subscription_id):
         self._record(self.get_or_create_subscription_schedule, subscription_id)
 
@@ -187,10 +190,10 @@ class MockConnector:
     def update_promo_code(self, promo_code_id, active):
         raise NotImplementedError
     
-    def get_promo_code(self, promo_code_id):
+    def get_promo_code(self, promo_code_id, use_cache=False):
         raise NotImplementedError
 
-    def get_upcoming_invoice(self, subscription_id):
+    def get_upcoming_invoice(self, subscription_id, use_cache=False):
         raise NotImplementedError
     
     def remove_discount_from_subscription(self, subscription_id):
@@ -1,10 +1,18 @@
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
 from model_bakery import baker
 import pytest
 
 from django.core import management
+from django.core.management.base import CommandError
+from django.utils import timezone
 
-from booking.models import Block, TicketBooking, Booking, GiftVoucherType
-from ..models import Invoice, StripePaymentIntent
+from booking.models import Block, TicketBooking, Booking, GiftVoucherType, Membership
+from ..models import Invoice, StripePaymentIntent, StripeWebhookEvent
+from .mock_connector import MockConnector
 from activitylog.models import ActivityLog
 
 
@@ -65,3 +73,99 @@ def test_no_invoices_to_delete(setup_invoices):
     assert Invoice.objects.count() == 5
     management.call_command('delete_unused_invoices')
     assert Invoice.objects.count() == 5
+
+
+def test_delete_stale_invoices(setup_invoices):
+    invoice1, invoice2, invoice3, *_ = setup_invoices
+    Invoice.objects.filter(id__in=[invoice1.id, invoice2.id, invoice3.id]).update(
+        date_created=timezone.now() - timedelta(days=8)
+    )
+    # payment intent in progress for stale invoice3; not deleted
+    StripePaymentIntent.objects.filter(invoice=invoice3).update(status="processing")
+    # stale paid invoice; not deleted
+    baker.make(Invoice, paid=True, date_created=timezone.now() - timedelta(days=8))
+    block = invoice1.blocks.first()
+
+    management.call_command('delete_stale_invoices')
+    assert not Invoice.objects.filter(id__in=[invoice1.id, invoice2.id]).exists()
+    assert Invoice.objects.count() == 4
+    assert StripePaymentIntent.objects.count() == 3
+    # items are kept, but unlinked from the deleted invoice
+    block.refresh_from_db()
+    assert block.invoice is None
+    activitylog = ActivityLog.objects.latest("id")
+    assert activitylog.log.startswith("2 stale unpaid invoice(s) deleted")
+
+
+def test_delete_stale_invoices_days_option(setup_invoices):
+    Invoice.objects.update(date_created=timezone.now() - timedelta(days=3))
+    management.call_command('delete_stale_invoices')
+    assert Invoice.objects.count() == 5
+
+    management.call_command('delete_stale_invoices', days=2)
+    # only the paid invoice is left
+    assert list(Invoice.objects.values_list("paid", flat=True)) == [True]
+
+
+RECORDED_EVENTS_PATH = Path(__file__).parent / "test_files"
+
+
+@pytest.fixture
+def stored_product_updated_event():
+    payload = (RECORDED_EVENTS_PATH / "product_updated_event.json").read_text()
+    yield baker.make(
+        StripeWebhookEvent, event_id="evt_1PqRkLFxq8TlXbQy3aZcGkVz", event_type="product.updated", payload=payload
+    )
+
+
+def test_replay_stripe_webhook_events_nothing_to_replay():
+    out = StringIO()
+    management.call_command("replay_stripe_webhook_events", stdout=out)
+    assert "No stripe events to replay" in out.getvalue()
+
+
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+def test_replay_stripe_webhook_events(seller, stored_product_updated_event):
+    membership = baker.make(Membership, name="Membership 1", active=True)
+    management.call_command("replay_stripe_webhook_events")
+
+    membership.refresh_from_db()
+    assert membership.active is False
+    assert membership.name == "Membership 1 - updated"
+    stored_product_updated_event.refresh_from_db()
+    assert stored_product_updated_event.processed
+    assert stored_product_updated_event.attempts == 1
+    assert ActivityLog.objects.filter(
+        log="Stripe event evt_1PqRkLFxq8TlXbQy3aZcGkVz (product.updated) replayed"
+    ).exists()
+
+
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+def test_replay_stripe_webhook_events_processed_events(seller, stored_product_updated_event):
+    stored_product_updated_event.processed = True
+    stored_product_updated_event.save()
+    membership = baker.make(Membership, name="Membership 1", active=True)
+
+    # processed events are only replayed with --force
+    management.call_command("replay_stripe_webhook_events", "evt_1PqRkLFxq8TlXbQy3aZcGkVz")
+    membership.refresh_from_db()
+    assert membership.active is True
+
+    management.call_command("replay_stripe_webhook_events", "evt_1PqRkLFxq8TlXbQy3aZcGkVz", force=True)
+    membership.refresh_from_db()
+    assert membership.active is False
+
+
+def test_replay_stripe_webhook_events_unknown_event_id(stored_product_updated_event):
+    with pytest.raises(CommandError, match=r"Stripe event\(s\) not found: evt_unknown"):
+        management.call_command("replay_stripe_webhook_events", "evt_1PqRkLFxq8TlXbQy3aZcGkVz", "evt_unknown")
+
+
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+def test_replay_stripe_webhook_events_failed_event(seller, stored_product_updated_event):
+    baker.make(Membership, name="Membership 1", active=True)
+    with patch("stripe_payments.views.webhook.Membership.objects.filter", side_effect=Exception("Unexpected")):
+        management.call_command("replay_stripe_webhook_events")
+    stored_product_updated_event.refresh_from_db()
+    assert not stored_product_updated_event.processed
+    assert stored_product_updated_event.error == "Unexpected"
@@ -7,9 +7,14 @@ import pytest
 
 from model_bakery import baker
 
+from django.core.cache import cache
+from django.contrib.sites.models import Site
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 from conftest import get_mock_payment_intent
 from booking.models import Booking, Block, TicketBooking, Ticket
-from ..models import Invoice, Seller, StripePaymentIntent
+from ..models import Invoice, Seller, SELLER_CACHE_KEY, StripePaymentIntent
 
 pytestmark = pytest.mark.django_db
 
@@ -41,6 +46,19 @@ def test_signature():
     assert invoice.signature() == sha512("foo123test".encode("utf-8")).hexdigest()
 
 
+def test_invoice_items_fingerprint():
+    bookings = baker.make(Booking, _quantity=2)
+    fingerprint = Invoice.get_items_fingerprint(bookings)
+    assert len(fingerprint) == 64
+    # order of items doesn't matter
+    assert Invoice.get_items_fingerprint(list(reversed(bookings))) == fingerprint
+    assert Invoice.get_items_fingerprint(bookings[:1]) != fingerprint
+    # items of different types with the same id have different fingerprints
+    block = Block(id=bookings[0].id)
+    assert Invoice.get_items_fingerprint([block]) != Invoice.get_items_fingerprint(bookings[:1])
+    assert Invoice.get_items_fingerprint([]) is None
+
+
 @pytest.mark.usefixtures("invoice_keyenv")
 def test_invoice_item_count(block_gift_voucher):
     invoice = baker.make(
@@ -120,6 +138,64 @@ def test_invoice_item_types(block_gift_voucher):
     assert invoice.item_types() == ["bookings", "blocks", "gift_vouchers", "ticket_bookings"]
 
 
+@pytest.mark.usefixtures("invoice_keyenv")
+def test_invoice_items_fetched_once(django_assert_num_queries):
+    invoice = baker.make(Invoice, invoice_id="foo123")
+    baker.make(Block, block_type__cost=10, invoice=invoice, _quantity=3)
+    baker.make(Booking, event__cost=10, invoice=invoice, _quantity=3)
+    for ticket_booking in baker.make(
+        TicketBooking, ticketed_event__ticket_cost=10, invoice=invoice, _quantity=3
+    ):
+        baker.make(Ticket, ticket_booking=ticket_booking, _quantity=2)
+
+    invoice = Invoice.objects.prefetch_related(*Invoice.ITEM_PREFETCHES).get(id=invoice.id)
+    with django_assert_num_queries(0):
+        assert invoice.item_count() == 9
+        invoice.item_types()
+        invoice.items_summary()
+        invoice.items_dict()
+        invoice.items_metadata()
+
+
+@pytest.mark.usefixtures("invoice_keyenv")
+def test_invoice_items_queries_do_not_depend_on_number_of_items():
+    invoice = baker.make(Invoice, invoice_id="foo123")
+
+    def _count_queries():
+        fetched = Invoice.objects.get(id=invoice.id)
+        with CaptureQueriesContext(connection) as queries:
+            fetched.items_metadata()
+            fetched.items_summary()
+        return len(queries)
+
+    baker.make(Booking, event__cost=10, invoice=invoice)
+    baker.make(Block, block_type__cost=10, invoice=invoice)
+    num_queries = _count_queries()
+
+    baker.make(Booking, event__cost=10, invoice=invoice, _quantity=5)
+    baker.make(Block, block_type__cost=10, invoice=invoice, _quantity=5)
+    assert _count_queries() == num_queries
+
+
+@pytest.mark.usefixtures("invoice_keyenv")
+def test_invoice_reset_items():
+    invoice = baker.make(Invoice, invoice_id="foo123")
+    baker.make(Booking, invoice=invoice)
+    assert invoice.item_count() == 1
+
+    # items are cached on the instance
+    baker.make(Booking, invoice=invoice)
+    assert invoice.item_count() == 1
+    invoice.reset_items()
+    assert invoice.item_count() == 2
+
+    # and re-fetched on refresh
+    baker.make(Block, invoice=invoice)
+    invoice.refresh_from_db()
+    assert invoice.item_count() == 3
+    assert invoice.item_types() == ["bookings", "blocks"]
+
+
 @pytest.mark.usefixtures("invoice_keyenv")
 def test_invoice_for_stripe_test():
     invoice = baker.make(
@@ -142,6 +218,60 @@ def test_seller_str():
     assert str(seller) == "testuser@test.com"
 
 
+def test_seller_get_current_cached(django_assert_num_queries):
+    site = Site.objects.get_current()
+    assert Seller.objects.get_current() is None
+    seller = baker.make(Seller, site=site, stripe_user_id="id123")
+
+    assert Seller.objects.get_current() == seller
+    with django_assert_num_queries(0):
+        assert Seller.objects.get_current() == seller
+        assert Seller.objects.get_for_site(site) == seller
+
+
+def test_seller_cache_cleared_on_save_and_delete(django_capture_on_commit_callbacks):
+    site = Site.objects.get_current()
+    seller = baker.make(Seller, site=site, stripe_user_id="id123")
+    assert Seller.objects.get_current().stripe_user_id == "id123"
+
+    seller.stripe_user_id = "id456"
+    with django_capture_on_commit_callbacks(execute=True):
+        seller.save()
+    # cleared from the shared cache, so other processes don't keep the old seller
+    assert cache.get(SELLER_CACHE_KEY) is None
+    assert Seller.objects.get_current().stripe_user_id == "id456"
+
+    seller.site = None
+    with django_capture_on_commit_callbacks(execute=True):
+        seller.save()
+    assert Seller.objects.get_current() is None
+
+    seller.site = site
+    with django_capture_on_commit_callbacks(execute=True):
+        seller.save()
+    assert Seller.objects.get_current() == seller
+    with django_capture_on_commit_callbacks(execute=True):
+        seller.delete()
+    assert Seller.objects.get_current() is None
+
+
+def test_seller_cache_cleared_after_commit(django_capture_on_commit_callbacks):
+    site = Site.objects.get_current()
+    seller = baker.make(Seller, site=site, stripe_user_id="id123")
+    Seller.objects.get_current()
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        seller.site = None
+        seller.save()
+        # not cleared until the change is committed, so the old row can't be re-cached
+        # after the cache is cleared
+        assert cache.get(SELLER_CACHE_KEY) is not None
+    for callback in callbacks:
+        callback()
+    assert cache.get(SELLER_CACHE_KEY) is None
+    assert Seller.objects.get_current() is None
+
+
 def test_invoice_payment_intent_ids():
     invoice = baker.make(Invoice, invoice_id="foo123")
     stripe_pi, _ = StripePaymentIntent.update_or_create_payment_intent_instance(
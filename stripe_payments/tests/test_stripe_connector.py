@@ -11,7 +11,7 @@ from model_bakery import baker
 
 from django.utils import timezone
 
-from stripe_payments.utils import StripeConnector
+from stripe_payments.utils import StripeConnector, get_stripe_cache_metrics
 
 
 pytestmark = pytest.mark.django_db
@@ -896,6 +896,119 @@ def test_connector_remove_discount_from_subscription(seller, mocked_responses):
     assert_call_body(mocked_responses.calls[0], {})
 
 
+def test_connector_get_upcoming_invoice_cached(seller, mocked_responses):
+    mocked_responses.get(
+        "https://api.stripe.com/v1/invoices/upcoming?subscription=sub-1&expand[0]=discounts",
+        body=json.dumps(
+            {
+                "object": "invoice",
+                "customer": "cus-1",
+                "subscription": "sub-1",
+                "total": 0,
+            }
+        )
+    )
+    connector = StripeConnector()
+    # not cached by default
+    connector.get_upcoming_invoice("sub-1")
+    connector.get_upcoming_invoice("sub-1")
+    assert len(mocked_responses.calls) == 2
+
+    invoice = connector.get_upcoming_invoice("sub-1", use_cache=True)
+    assert isinstance(invoice, stripe.Invoice)
+    assert len(mocked_responses.calls) == 3
+    invoice = connector.get_upcoming_invoice("sub-1", use_cache=True)
+    assert invoice.subscription == "sub-1"
+    assert len(mocked_responses.calls) == 3
+
+    assert get_stripe_cache_metrics()["get_upcoming_invoice"] == {"hits": 1, "misses": 1}
+
+
+def test_connector_get_promo_code_invalid_not_cached(seller, mocked_responses):
+    mocked_responses.get(
+        "https://api.stripe.com/v1/promotion_codes/promo_unknown",
+        body=json.dumps(
+            {"error": {"code": "resource_missing", "type": "invalid_request_error"}}
+        ),
+        status=404
+    )
+    connector = StripeConnector()
+    assert connector.get_promo_code("promo_unknown", use_cache=True) is None
+    assert connector.get_promo_code("promo_unknown", use_cache=True) is None
+    assert len(mocked_responses.calls) == 2
+
+
+def test_connector_update_promo_code_invalidates_cache(seller, mocked_responses):
+    mocked_responses.get(
+        "https://api.stripe.com/v1/promotion_codes/promo_1",
+        body=json.dumps({"id": "promo_1", "active": True})
+    )
+    mocked_responses.post(
+        "https://api.stripe.com/v1/promotion_codes/promo_1",
+        body=json.dumps({"id": "promo_1", "active": False})
+    )
+    mocked_responses.get(
+        "https://api.stripe.com/v1/promotion_codes/promo_1",
+        body=json.dumps({"id": "promo_1", "active": False})
+    )
+    connector = StripeConnector()
+    assert connector.get_promo_code("promo_1", use_cache=True).active
+    assert connector.get_promo_code("promo_1", use_cache=True).active
+    connector.update_promo_code("promo_1", active=False)
+    assert not connector.get_promo_code("promo_1", use_cache=True).active
+    assert len(mocked_responses.calls) == 3
+
+
+def test_connector_get_subscriptions_for_customer_cached(seller, mocked_responses):
+    mocked_responses.get(
+        "https://api.stripe.com/v1/subscriptions",
+        body=json.dumps(
+            {
+                "object": "list",
+                "url": "/v1/subscriptions",
+                "has_more": False,
+                "data": [{"id": "sub-1", "object": "subscription", "customer": "cus-1"}],
+            }
+        ),
+        status=200,
+        content_type="application/json",
+    )
+    connector = StripeConnector()
+    assert list(connector.get_subscriptions_for_customer("cus-1", status=None, use_cache=True)) == ["sub-1"]
+    assert list(connector.get_subscriptions_for_customer("cus-1", status=None, use_cache=True)) == ["sub-1"]
+    assert len(mocked_responses.calls) == 1
+    # different status is fetched separately
+    connector.get_subscriptions_for_customer("cus-1", status="active", use_cache=True)
+    assert len(mocked_responses.calls) == 2
+
+    connector.invalidate_subscription_cache(customer_id="cus-1")
+    connector.get_subscriptions_for_customer("cus-1", status=None, use_cache=True)
+    assert len(mocked_responses.calls) == 3
+    assert get_stripe_cache_metrics()["get_subscriptions_for_customer"] == {"hits": 1, "misses": 3}
+
+
+def test_connector_cancel_subscription_invalidates_cache(seller, mocked_responses):
+    subscription = {"id": "sub-1", "object": "subscription", "customer": "cus-1", "status": "active"}
+    mocked_responses.get(
+        "https://api.stripe.com/v1/subscriptions/sub-1",
+        body=json.dumps(subscription)
+    )
+    mocked_responses.delete(
+        "https://api.stripe.com/v1/subscriptions/sub-1",
+        body=json.dumps({**subscription, "status": "canceled"})
+    )
+    mocked_responses.get(
+        "https://api.stripe.com/v1/subscriptions/sub-1",
+        body=json.dumps({**subscription, "status": "canceled"})
+    )
+    connector = StripeConnector()
+    assert connector.get_subscription("sub-1", use_cache=True).status == "active"
+    assert connector.get_subscription("sub-1", use_cache=True).status == "active"
+    connector.cancel_subscription("sub-1", cancel_immediately=True)
+    assert connector.get_subscription("sub-1", use_cache=True).status == "canceled"
+    assert len(mocked_responses.calls) == 3
+
+
 def assert_call_body(call, expected):
     parsed = parse_qs(call.request.body)
     assert parsed == expected
\ No newline at end of file
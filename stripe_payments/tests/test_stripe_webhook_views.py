@@ -1,19 +1,23 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from datetime import timezone as datetime_tz
+import json
+from pathlib import Path
 from unittest.mock import patch, Mock
 import pytest
 
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import mail
+from django.core import management
 from django.shortcuts import reverse
 from django.utils import timezone
 
 import stripe
 from model_bakery import baker
 
+from activitylog.models import ActivityLog
 from booking.models import Block, Membership, UserMembership, StripeSubscriptionVoucher
-from ..models import Seller, StripePaymentIntent, StripeSubscriptionInvoice
+from ..models import Seller, StripePaymentIntent, StripeSubscriptionInvoice, StripeWebhookEvent
 from .mock_connector import MockConnector
 from conftest import get_mock_subscription
 
@@ -409,6 +413,7 @@ def test_webhook_subscription_deleted(
     assert user_membership.subscription_status == "canceled"
     assert user_membership.subscription_end_date == datetime(2024, 3, 1, tzinfo=datetime_tz.utc)
     assert user_membership.end_date == datetime(2024, 4, 1, tzinfo=datetime_tz.utc)
+    assert user_membership.reallocation_pending
     # No emails sent
     assert len(mail.outbox) == 0
 
@@ -849,7 +854,14 @@ def test_webhook_subscription_updated_status_scheduled_to_cancel(
     assert user_membership.subscription_status == "active"
     assert user_membership.subscription_end_date == datetime(2024, 1, 25, tzinfo=datetime_tz.utc)
     assert user_membership.end_date == datetime(2024, 2, 1, tzinfo=datetime_tz.utc)
+    # reallocation is deferred to the reallocate_membership_bookings command
+    assert user_membership.reallocation_pending
+    booking1.refresh_from_db()
+    assert booking1.membership == user_membership
 
+    management.call_command("reallocate_membership_bookings")
+    user_membership.refresh_from_db()
+    assert not user_membership.reallocation_pending
     booking.refresh_from_db()
     booking1.refresh_from_db()
     assert booking.membership == user_membership
@@ -1178,3 +1190,108 @@ def test_webhook_product_updated_no_matching_subscription(
     membership.refresh_from_db()
     assert membership.active is False
     assert membership.name == "Membership-2"
+
+
+RECORDED_EVENTS_PATH = Path(__file__).parent / "test_files"
+
+
+def _recorded_event_payload(filename):
+    return (RECORDED_EVENTS_PATH / filename).read_text()
+
+
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+@patch("stripe_payments.views.webhook.stripe.Webhook")
+def test_webhook_recorded_event_stored_and_processed(mock_webhook, client, seller):
+    membership = baker.make(Membership, name="Membership 1", active=True)
+    payload = _recorded_event_payload("product_updated_event.json")
+    mock_webhook.construct_event.return_value = stripe.Event.construct_from(json.loads(payload), "dummy")
+
+    resp = client.post(webhook_url, data=payload, content_type="application/json", HTTP_STRIPE_SIGNATURE="foo")
+    assert resp.status_code == 200, resp.content
+    membership.refresh_from_db()
+    assert membership.active is False
+    assert membership.name == "Membership 1 - updated"
+
+    webhook_event = StripeWebhookEvent.objects.get(event_id="evt_1PqRkLFxq8TlXbQy3aZcGkVz")
+    assert webhook_event.event_type == "product.updated"
+    assert json.loads(webhook_event.payload) == json.loads(payload)
+    assert webhook_event.processed
+    assert webhook_event.attempts == 1
+
+
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+@patch("stripe_payments.views.webhook.stripe.Webhook")
+def test_webhook_duplicate_event_not_reprocessed(mock_webhook, client, seller):
+    membership = baker.make(Membership, name="Membership 1", active=True)
+    payload = _recorded_event_payload("product_updated_event.json")
+    mock_webhook.construct_event.return_value = stripe.Event.construct_from(json.loads(payload), "dummy")
+
+    resp = client.post(webhook_url, data=payload, content_type="application/json", HTTP_STRIPE_SIGNATURE="foo")
+    assert resp.status_code == 200, resp.content
+    assert ActivityLog.objects.filter(log="Stripe webhook: Membership membership-1 updated").count() == 1
+
+    # retried delivery is acknowledged without processing again
+    with patch("stripe_payments.views.webhook.process_stripe_event") as mock_process:
+        resp = client.post(webhook_url, data=payload, content_type="application/json", HTTP_STRIPE_SIGNATURE="foo")
+        assert resp.status_code == 200, resp.content
+        assert resp.content == b"Ignored: Duplicate event"
+        mock_process.assert_not_called()
+    assert StripeWebhookEvent.objects.count() == 1
+    assert ActivityLog.objects.filter(log="Stripe webhook: Membership membership-1 updated").count() == 1
+
+
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+@patch("stripe_payments.views.webhook.stripe.Webhook")
+def test_webhook_duplicate_event_in_progress_not_reprocessed(mock_webhook, client, seller):
+    membership = baker.make(Membership, name="Membership 1", active=True)
+    payload = _recorded_event_payload("product_updated_event.json")
+    mock_webhook.construct_event.return_value = stripe.Event.construct_from(json.loads(payload), "dummy")
+    # first delivery has claimed the event and is still processing it
+    webhook_event = baker.make(
+        StripeWebhookEvent, event_id="evt_1PqRkLFxq8TlXbQy3aZcGkVz", event_type="product.updated",
+        payload=payload, processing_started=timezone.now()
+    )
+
+    with patch("stripe_payments.views.webhook.process_stripe_event") as mock_process:
+        resp = client.post(webhook_url, data=payload, content_type="application/json", HTTP_STRIPE_SIGNATURE="foo")
+        # stripe will retry later
+        assert resp.status_code == 409, resp.content
+        mock_process.assert_not_called()
+    webhook_event.refresh_from_db()
+    assert not webhook_event.processed
+    assert webhook_event.attempts == 0
+
+    # a claim left by a worker that died is taken over
+    webhook_event.processing_started = timezone.now() - StripeWebhookEvent.CLAIM_TIMEOUT - timedelta(seconds=1)
+    webhook_event.save()
+    resp = client.post(webhook_url, data=payload, content_type="application/json", HTTP_STRIPE_SIGNATURE="foo")
+    assert resp.status_code == 200, resp.content
+    webhook_event.refresh_from_db()
+    assert webhook_event.processed
+    assert webhook_event.processing_started is None
+    membership.refresh_from_db()
+    assert membership.active is False
+
+
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+@patch("stripe_payments.views.webhook.stripe.Webhook")
+def test_webhook_failed_event_reprocessed_on_retry(mock_webhook, client, seller):
+    membership = baker.make(Membership, name="Membership 1", active=True)
+    payload = _recorded_event_payload("product_updated_event.json")
+    mock_webhook.construct_event.return_value = stripe.Event.construct_from(json.loads(payload), "dummy")
+
+    with patch("stripe_payments.views.webhook.Membership.objects.filter", side_effect=Exception("Unexpected")):
+        resp = client.post(webhook_url, data=payload, content_type="application/json", HTTP_STRIPE_SIGNATURE="foo")
+    assert resp.status_code == 400
+    webhook_event = StripeWebhookEvent.objects.get()
+    assert not webhook_event.processed
+    assert webhook_event.error == "Unexpected"
+
+    resp = client.post(webhook_url, data=payload, content_type="application/json", HTTP_STRIPE_SIGNATURE="foo")
+    assert resp.status_code == 200
+    webhook_event.refresh_from_db()
+    assert webhook_event.processed
+    assert webhook_event.attempts == 2
+    assert webhook_event.error is None
+    membership.refresh_from_db()
+    assert membership.active is False
@@ -3,7 +3,7 @@ import logging
 from dateutil.relativedelta import relativedelta
 
 from django.conf import settings
-from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.urls import reverse
 import stripe
 
@@ -125,6 +125,49 @@ def process_completed_stripe_payment(payment_intent, invoice, seller=None, reque
         )
 
 
+# Read-only stripe API calls that can be cached (see StripeConnector._get_cached)
+CACHED_STRIPE_METHODS = (
+    "get_or_create_stripe_price",
+    "get_promo_code",
+    "get_subscription",
+    "get_subscriptions_for_customer",
+    "get_upcoming_invoice",
+    "customer_portal_configuration",
+)
+STRIPE_CACHE_TIMEOUT = 60 * 5
+
+
+def _stripe_cache_metric_key(method_name, hit):
+    return f"stripe_cache_{'hits' if hit else 'misses'}_{method_name}"
+
+
+def record_stripe_cache_metric(method_name, hit):
+    key = _stripe_cache_metric_key(method_name, hit)
+    # add is a no-op if the key already exists
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:  # pragma: no cover
+            # key expired between add and incr
+            cache.set(key, 1, timeout=None)
+
+
+def get_stripe_cache_metrics():
+    """
+    Return hit/miss counts for each cached stripe method
+    """
+    metrics = cache.get_many(
+        [_stripe_cache_metric_key(method_name, hit) for method_name in CACHED_STRIPE_METHODS for hit in [True, False]]
+    )
+    return {
+        method_name: {
+            "hits": metrics.get(_stripe_cache_metric_key(method_name, True), 0),
+            "misses": metrics.get(_stripe_cache_metric_key(method_name, False), 0),
+        }
+        for method_name in CACHED_STRIPE_METHODS
+    }
+
+
 class StripeConnector:
     
     def __init__(self, request=None):
@@ -134,12 +177,56 @@ class StripeConnector:
         self.connected_account_id = self.get_connected_account_id(request)
 
     def get_connected_account_id(self, request=None):
-        self.connected_account = Seller.objects.filter(site=Site.objects.get_current(request=request)).first()
+        self.connected_account = Seller.objects.get_current(request=request)
         if self.connected_account:
             return self.connected_account.stripe_user_id
         else:
             raise Seller.DoesNotExist
 
+    def _cache_key(self, method_name, *key_parts):
+        return ":".join(["stripe", self.connected_account_id, method_name, *[str(part) for part in key_parts]])
+
+    def _get_cached(self, method_name, key_parts, fetch, use_cache=True, timeout=STRIPE_CACHE_TIMEOUT):
+        """
+        Return the result of fetch() (a stripe API call), from the cache if available. 
+        None results are not cached.
+        """
+        if not use_cache:
+            return fetch()
+        key = self._cache_key(method_name, *key_parts)
+        result = cache.get(key)
+        record_stripe_cache_metric(method_name, hit=result is not None)
+        if result is None:
+            result = fetch()
+            if result is not None:
+                cache.set(key, result, timeout)
+        return result
+
+    def invalidate_subscription_cache(self, subscription_id=None, customer_id=None):
+        """
+        Clear cached data for a subscription and/or a customer's subscriptions.
+        Called when we modify a subscription, and when stripe tells us it has changed.
+        """
+        keys = []
+        if subscription_id:
+            keys.extend(
+                [
+                    self._cache_key("get_subscription", subscription_id), 
+                    self._cache_key("get_upcoming_invoice", subscription_id)
+                ]
+            )
+        if customer_id:
+            keys.append(self._cache_key("get_subscriptions_for_customer", customer_id))
+        cache.delete_many(keys)
+
+    def _invalidate_for_subscription_object(self, subscription_id, subscription):
+        # subscription objects returned from stripe include the customer; use it to also clear
+        # the customer's cached subscriptions
+        customer_id = getattr(subscription, "customer", None)
+        self.invalidate_subscription_cache(
+            subscription_id=subscription_id, customer_id=customer_id if isinstance(customer_id, str) else None
+        )
+
     def get_test_clocks(self):  # pragma: no cover
         return stripe.test_helpers.TestClock.list(limit=3, stripe_account=self.connected_account_id)
     
@@ -188,7 +275,12 @@ class StripeConnector:
     def archive_stripe_price(self, price_id):
         """Archive a product"""
         # archive the price
-        stripe.Price.modify(price_id, product=None, active=False, stripe_account=self.connected_account_id)
+        price = stripe.Price.modify(price_id, product=None, active=False, stripe_account=self.connected_account_id)
+        # make sure the archived price isn't returned from the cache
+        product_id = getattr(price, "product", None)
+        unit_amount = getattr(price, "unit_amount", None)
+        if isinstance(product_id, str) and isinstance(unit_amount, int):
+            cache.delete(self._cache_key("get_or_create_stripe_price", product_id, unit_amount))
     
     def archive_stripe_product(self, product_id, price_id):
         """Archive a product"""
@@ -200,7 +292,13 @@ class StripeConnector:
 
     def get_or_create_stripe_price(self, product_id, price):
         price_in_p = int(price * 100)
-        
+        return self._get_cached(
+            "get_or_create_stripe_price", 
+            (product_id, price_in_p), 
+            lambda: self._get_or_create_stripe_price(product_id, price_in_p)
+        )
+
+    def _get_or_create_stripe_price(self, product_id, price_in_p):
         # get existing active Price for this product and amount if one exists
         matching_prices = stripe.Price.list(
             product=product_id, 
@@ -269,14 +367,33 @@ class StripeConnector:
             id=setup_intent_id, stripe_account=self.connected_account_id
         )
     
-    def get_subscription(self, subscription_id):
+    def get_subscription(self, subscription_id, use_cache=False):
+        """
+        use_cache: return cached subscription data if available; only use for
+        read-only views, where data up to STRIPE_CACHE_TIMEOUT old is acceptable
+        """
         kwargs = dict(
             id=subscription_id, stripe_account=self.connected_account_id, 
             expand=['latest_invoice.payment_intent', 'latest_invoice.discounts', 'pending_setup_intent', 'schedule', "discounts"]
         )
-        return stripe.Subscription.retrieve(**kwargs)
+        return self._get_cached(
+            "get_subscription", (subscription_id,), lambda: stripe.Subscription.retrieve(**kwargs), use_cache=use_cache
+        )
 
-    def get_subscriptions_for_customer(self, customer_id, status="all"):
+    def get_subscriptions_for_customer(self, customer_id, status="all", use_cache=False):
+        if not use_cache:
+            return self._get_subscriptions_for_customer(customer_id, status)
+        # Subscriptions for each status are cached under one key per customer, so they
+        # can be invalidated together
+        key = self._cache_key("get_subscriptions_for_customer", customer_id)
+        cached = cache.get(key, {})
+        record_stripe_cache_metric("get_subscriptions_for_customer", hit=status in cached)
+        if status not in cached:
+            cached[status] = self._get_subscriptions_for_customer(customer_id, status)
+            cache.set(key, cached, STRIPE_CACHE_TIMEOUT)
+        return cached[status]
+
+    def _get_subscriptions_for_customer(self, customer_id, status="all"):
         subscriptions = stripe.Subscription.list(
             status=status, 
             customer=customer_id, 
@@ -384,7 +501,7 @@ class StripeConnector:
             customer_id, price_id, backdate, default_payment_method
         )
         subscription = stripe.Subscription.create(**subscription_kwargs)
-
+        self.invalidate_subscription_cache(customer_id=subscription_kwargs["customer"])
         return subscription
     
     def get_or_create_subscription_schedule(self, subscription_id):
@@ -439,6 +556,7 @@ class StripeConnector:
                     ],
                 stripe_account=self.connected_account_id,
             )
+            self.invalidate_subscription_cache(subscription_id=subscription_id)
 
         return schedule
     
@@ -449,7 +567,9 @@ class StripeConnector:
         Subscriptions that start in the future are cancelled immediately
         """
         if cancel_immediately:
-            return stripe.Subscription.delete(subscription_id, stripe_account=self.connected_account_id)
+            subscription = stripe.Subscription.delete(subscription_id, stripe_account=self.connected_account_id)
+            self._invalidate_for_subscription_object(subscription_id, subscription)
+            return subscription
         # retrieve or create schedule from subscription id
         schedule = self.get_or_create_subscription_schedule(subscription_id)
         current_phase_items = [
@@ -474,6 +594,7 @@ class StripeConnector:
             expand=['subscription'],
             stripe_account=self.connected_account_id
         )
+        self._invalidate_for_subscription_object(subscription_id, schedule.subscription)
         return schedule.subscription
             
     def pause_subscription(self, subscription_id, months, pause_from):
@@ -529,17 +650,29 @@ class StripeConnector:
         return promo_code
 
     def update_promo_code(self, promo_code_id, active):
-        return stripe.PromotionCode.modify(promo_code_id, active=active, stripe_account=self.connected_account_id)
+        promo_code = stripe.PromotionCode.modify(promo_code_id, active=active, stripe_account=self.connected_account_id)
+        cache.delete(self._cache_key("get_promo_code", promo_code_id))
+        return promo_code
     
-    def get_promo_code(self, promo_code_id):
+    def get_promo_code(self, promo_code_id, use_cache=False):
+        return self._get_cached(
+            "get_promo_code", (promo_code_id,), lambda: self._get_promo_code(promo_code_id), use_cache=use_cache
+        )
+
+    def _get_promo_code(self, promo_code_id):
         try:
             return stripe.PromotionCode.retrieve(promo_code_id, stripe_account=self.connected_account_id)
         except stripe.InvalidRequestError as e:
             logger.error("Attempt to retrieve invalid promo code: %s", str(e))
 
-    def get_upcoming_invoice(self, subscription_id):
-        return stripe.Invoice.upcoming(
-            subscription=subscription_id, expand=["discounts"], stripe_account=self.connected_account_id
+    def get_upcoming_invoice(self, subscription_id, use_cache=False):
+        return self._get_cached(
+            "get_upcoming_invoice",
+            (subscription_id,),
+            lambda: stripe.Invoice.upcoming(
+                subscription=subscription_id, expand=["discounts"], stripe_account=self.connected_account_id
+            ),
+            use_cache=use_cache
         )
 
     def add_discount_to_subscription(self, subscription_id, promo_code_id=None):
@@ -554,15 +687,20 @@ class StripeConnector:
             subscription_id, discounts=discounts,
             stripe_account=self.connected_account_id,    
         )
+        self._invalidate_for_subscription_object(subscription_id, subscription)
         return subscription
     
     def remove_discount_from_subscription(self, subscription_id):
-        stripe.Subscription.delete_discount(subscription_id, stripe_account=self.connected_account_id)
+        discount = stripe.Subscription.delete_discount(subscription_id, stripe_account=self.connected_account_id)
+        self._invalidate_for_subscription_object(subscription_id, discount)
 
     def customer_portal_configuration(self):
         """
         Create a customer portal config to allow updating payment information
         """
+        return self._get_cached("customer_portal_configuration", (), self._customer_portal_configuration)
+
+    def _customer_portal_configuration(self):
         # fetch an active config and make sure it has the correct configuration
         configs = stripe.billing_portal.Configuration.list(stripe_account=self.connected_account_id, active=True)
         config_data = dict(
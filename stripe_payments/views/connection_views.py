@@ -21,8 +21,7 @@ logger = logging.getLogger(__name__)
 
 @staff_member_required
 def connect_stripe_view(request):
-    site_sellers = Seller.objects.filter(site=Site.objects.get_current(request))
-    site_seller = site_sellers.first() if site_sellers else None
+    site_seller = Seller.objects.get_current(request)
     return render(
         request, "stripe_payments/connect_stripe.html", 
         {"site_seller": site_seller, "sidenav_selection": "connect_stripe"}
@@ -24,7 +24,7 @@ from ..emails import (
     send_subscription_setup_failed_email,
 )
 from ..exceptions import StripeProcessingError
-from ..models import Seller, StripeSubscriptionInvoice
+from ..models import Seller, StripeSubscriptionInvoice, StripeWebhookEvent
 from ..utils import (
     get_invoice_from_event_metadata, 
     StripeConnector, 
@@ -54,14 +54,55 @@ def stripe_webhook(request):
         logger.error(e)
         return HttpResponse(str(e), status=400)
 
+    # Store the event before processing it. Stripe may deliver an event more than once (and retries
+    # on any non-2xx response); if we've already processed this one, just acknowledge it
+    webhook_event, _created = StripeWebhookEvent.objects.get_or_create(
+        event_id=event.id,
+        defaults={"event_type": event.type, "payload": payload.decode("utf-8", errors="replace")}
+    )
+    if not webhook_event.claim():
+        if webhook_event.processed:
+            logger.info("Stripe event %s already processed", event.id)
+            return HttpResponse("Ignored: Duplicate event", status=200)
+        # still being processed by an earlier delivery; a non-2xx response means stripe will
+        # retry later, and the retry will be acknowledged if that processing succeeded
+        logger.info("Stripe event %s is already being processed", event.id)
+        return HttpResponse("Event is already being processed", status=409)
+
+    try:
+        response = process_stripe_event(event, request=request)
+    except Exception:
+        webhook_event.release()
+        raise
+    webhook_event.record_result(response)
+    return response
+
+
+def _invalidate_subscription_cache(client, subscription_id, event_object):
+    customer_id = getattr(event_object, "customer", None)
+    client.invalidate_subscription_cache(
+        subscription_id=subscription_id if isinstance(subscription_id, str) else None,
+        customer_id=customer_id if isinstance(customer_id, str) else None,
+    )
+
+
+def process_stripe_event(event, request=None):
+    """
+    Process a verified stripe event; returns an HttpResponse to send back to stripe.
+    Unexpected errors return a 400 so that stripe retries the event.
+    """
     event_object = event.data.object
     logger.info("event type", event.type)
 
     if event.type == "account.application.authorized":
         connected_accounts = stripe.Account.list().data
+        seller_account_ids = set(
+            Seller.objects.filter(
+                stripe_user_id__in=[account.id for account in connected_accounts]
+            ).values_list("stripe_user_id", flat=True)
+        )
         for connected_account in connected_accounts:
-            seller = Seller.objects.filter(stripe_user_id=connected_account.id)
-            if not seller.exists():
+            if connected_account.id not in seller_account_ids:
                 logger.error(f"Stripe account has no associated seller on this site %s", connected_account.id)
                 # return 200 so we don't keep trying. The error log will trigger an email to support.
                 return HttpResponse("Stripe account has no associated seller on this site", status=200)
@@ -70,12 +111,11 @@ def stripe_webhook(request):
     elif event.type == "account.application.deauthorized":
         connected_accounts = stripe.Account.list().data
         connected_account_ids = [account.id for account in connected_accounts]
-        for seller in Seller.objects.all():
-            if seller.stripe_user_id not in connected_account_ids:
-                seller.site = None
-                seller.save()
-                logger.info(f"Stripe account disconnected: %s", seller.stripe_user_id)
-                ActivityLog.objects.create(log=f"Stripe account disconnected: {seller.stripe_user_id}")
+        for seller in Seller.objects.exclude(stripe_user_id__in=connected_account_ids):
+            seller.site = None
+            seller.save()
+            logger.info(f"Stripe account disconnected: %s", seller.stripe_user_id)
+            ActivityLog.objects.create(log=f"Stripe account disconnected: {seller.stripe_user_id}")
         return HttpResponse(status=200)
 
     try:
@@ -92,6 +132,13 @@ def stripe_webhook(request):
             logger.info("Mismatched seller account %s", account)
             return HttpResponse("Ignored: Mismatched seller account", status=200)
 
+        # Subscription and subscription invoice events mean our cached stripe data for the
+        # subscription (and the customer's subscriptions) is out of date
+        if event.type.startswith("customer.subscription."):
+            _invalidate_subscription_cache(client, event_object.id, event_object)
+        elif event.type.startswith("invoice."):
+            _invalidate_subscription_cache(client, getattr(event_object, "subscription", None), event_object)
+
         # try to get the invoice from the event metadata; if we can get a valid invoice, it's an
         # event related to a payment for an immediate checkout (booking, block, ticket_booking) and not for a subscription
         # Handle the payment intent and refund events
@@ -195,7 +242,8 @@ def stripe_webhook(request):
                     user_membership.subscription_end_date = get_utcdate_from_timestamp(subscription_end_date)
                     user_membership.end_date = get_first_of_next_month_from_timestamp(subscription_end_date)
                     user_membership.save()
-                    user_membership.reallocate_bookings()
+                    # bookings after the end date are reallocated by the reallocate_membership_bookings command
+                    user_membership.schedule_reallocation()
                     ActivityLog.objects.create(
                         log=f"Stripe webhook: Membership {user_membership.membership.name} for {user_membership.user} (stripe subscription id {event_object.id}, cancelled on {user_membership.subscription_end_date})"
                     )
@@ -323,7 +371,12 @@ def stripe_webhook(request):
                         send_updated_membership_email_to_support(user_membership, membership.stripe_price_id, old_price_id)
                 
                 # reallocate bookings now we're done with updating the membership
-                user_membership.reallocate_bookings()
+                # If the membership is cancelling, defer reallocation of bookings after its end date
+                # to the reallocate_membership_bookings command (these arrive in bulk at month end)
+                if user_membership.end_date:
+                    user_membership.schedule_reallocation()
+                else:
+                    user_membership.reallocate_bookings()
 
             elif event_object.status == "past_due":
                 send_subscription_past_due_email(event_object)
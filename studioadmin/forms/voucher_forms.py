@@ -12,7 +12,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 from booking.models import BlockType, BlockVoucher, EventVoucher, Membership, \
-    UsedBlockVoucher, UsedEventVoucher, EventType, StripeSubscriptionVoucher
+    EventType, StripeSubscriptionVoucher
 
 
 def validate_discount(value):
@@ -117,7 +117,8 @@ class VoucherStudioadminForm(forms.ModelForm):
                 self.fields['event_types'].queryset = visible_event_types
 
     def get_uses(self):
-        return UsedEventVoucher.objects.filter(voucher=self.instance).count()
+        # read the current count; it may have changed since the instance was fetched
+        return type(self.instance).objects.filter(id=self.instance.id).values_list("times_used", flat=True).get()
 
     def get_old_instance(self, id):
         return EventVoucher.objects.get(id=id)
@@ -266,7 +267,8 @@ class BlockVoucherStudioadminForm(VoucherStudioadminForm):
 
 
     def get_uses(self):
-        return UsedBlockVoucher.objects.filter(voucher=self.instance).count()
+        # read the current count; it may have changed since the instance was fetched
+        return type(self.instance).objects.filter(id=self.instance.id).values_list("times_used", flat=True).get()
 
     def get_old_instance(self, id):
         return BlockVoucher.objects.get(id=id)
@@ -0,0 +1,41 @@
+'''
+Cancel an event or class and its open bookings, as the studioadmin cancel
+event page does (including creating transfer blocks and emailing users and the
+studio).
+'''
+from django.core.management.base import BaseCommand, CommandError
+
+from booking.models import Event
+from common.management import write_command_name
+from studioadmin.views.cancel_event import EventCancellation
+
+
+class Command(BaseCommand):
+    help = 'Cancel an event/class and all its open bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', help="Slug of the event to cancel")
+        parser.add_argument(
+            "--refund-direct-paid", action="store_true",
+            help="Don't create transfer blocks for direct paid bookings; the studio will refund them manually"
+        )
+        parser.add_argument(
+            "--no-email", action="store_true", help="Don't send notification emails to users and the studio"
+        )
+
+    def handle(self, *args, **options):
+        write_command_name(self, __file__)
+        try:
+            event = Event.objects.select_related("event_type").get(slug=options["slug"])
+        except Event.DoesNotExist:
+            raise CommandError(f"Event with slug {options['slug']} does not exist")
+        if event.cancelled:
+            raise CommandError(f"{event} is already cancelled")
+
+        cancellation = EventCancellation(event, transfer_direct_paid=not options["refund_direct_paid"])
+        cancellation.cancel(cancelled_by="management command", send_notifications=not options["no_email"])
+        self.stdout.write(
+            '{} {} has been cancelled; {}'.format(
+                cancellation.ev_type.title(), event, cancellation.cancelled_message()
+            )
+        )
@@ -1,9 +1,14 @@
 from django.contrib.auth.models import Group, Permission
-from django.core import management
+from django.contrib.sites.models import Site
+from django.core import mail, management
+from django.core.management.base import CommandError
 from django.test import TestCase
 
+from model_bakery import baker
 
-from booking.models import AllowedGroup
+from activitylog.models import ActivityLog
+from booking.models import AllowedGroup, Block, BlockType, Booking
+from studioadmin.views.cancel_event import EventCancellation
 
 
 class CreateGroupTests(TestCase):
@@ -42,3 +47,98 @@ class CreateGroupTests(TestCase):
         new_group_ids = Group.objects.values_list('id', flat=True)
 
         self.assertCountEqual(list(group_ids), list(new_group_ids))
+
+
+class CancelEventTests(TestCase):
+
+    def setUp(self):
+        self.lesson = baker.make_recipe(
+            'booking.future_PC', cost=10, booking_open=True, payment_open=True
+        )
+        self.direct_paid = baker.make_recipe(
+            'booking.booking', event=self.lesson, paid=True, user__email="direct@test.com"
+        )
+        block = baker.make_recipe(
+            'booking.block', block_type__event_type=self.lesson.event_type, paid=True
+        )
+        self.block_paid = baker.make_recipe(
+            'booking.booking', event=self.lesson, block=block, user=block.user
+        )
+        self.block_paid.user.email = "block@test.com"
+        self.block_paid.user.save()
+
+    def test_cancel_event(self):
+        management.call_command('cancel_event', self.lesson.slug)
+        self.lesson.refresh_from_db()
+        assert self.lesson.cancelled
+        assert not self.lesson.booking_open
+        for booking in [self.direct_paid, self.block_paid]:
+            booking.refresh_from_db()
+            assert booking.status == "CANCELLED"
+            assert not booking.paid
+            assert booking.block is None
+
+        # transfer block for the direct paid booking only
+        transfer_block = Block.objects.get(transferred_booking_id=self.direct_paid.id)
+        assert transfer_block.user == self.direct_paid.user
+        assert transfer_block.paid
+        assert transfer_block.expiry_date == transfer_block.get_expiry_date()
+        assert not Block.objects.filter(transferred_booking_id=self.block_paid.id).exists()
+
+        # email to each user and the studio
+        assert len(mail.outbox) == 3
+        assert ActivityLog.objects.filter(log__contains="cancelled by admin user management command").exists()
+
+    def test_cancel_event_refund_direct_paid_no_email(self):
+        management.call_command('cancel_event', self.lesson.slug, refund_direct_paid=True, no_email=True)
+        self.direct_paid.refresh_from_db()
+        assert self.direct_paid.status == "CANCELLED"
+        # no transfer block, still marked paid so the studio can refund it
+        assert self.direct_paid.paid
+        assert not Block.objects.filter(transferred_booking_id__isnull=False).exists()
+        assert len(mail.outbox) == 0
+        assert ActivityLog.objects.filter(log__contains="Notification emails have not been sent").exists()
+
+    def test_cancel_event_query_count(self):
+        BlockType.get_transfer_block_type(self.lesson.event_type)
+        Site.objects.get_current()
+        # event, bookings, bookings reloaded with a lock, transfer block type,
+        # transfer blocks, booking updates, event update, activity log (+ savepoints)
+        with self.assertNumQueries(10):
+            management.call_command('cancel_event', self.lesson.slug, no_email=True)
+        self.lesson.cancelled = False
+        self.lesson.save()
+        Booking.objects.filter(event=self.lesson).update(status="OPEN")
+        baker.make_recipe('booking.booking', event=self.lesson, paid=True, _quantity=10)
+        # same number of queries with more bookings
+        with self.assertNumQueries(10):
+            management.call_command('cancel_event', self.lesson.slug, no_email=True)
+        assert not Booking.objects.filter(event=self.lesson, status="OPEN").exists()
+
+    def test_cancel_event_uses_current_bookings(self):
+        cancellation = EventCancellation(self.lesson)
+        assert cancellation.open_direct_paid == [self.direct_paid]
+        # bookings changed after the cancellation page was loaded
+        Booking.objects.filter(id=self.direct_paid.id).update(status="CANCELLED", paid=False)
+        block_user_booking = Booking.objects.get(id=self.block_paid.id)
+        block_user_booking.free_class = True
+        block_user_booking.save()
+
+        cancellation.cancel(cancelled_by="admin", send_notifications=False)
+        self.direct_paid.refresh_from_db()
+        # already cancelled, so not overwritten or given a transfer block
+        assert self.direct_paid.status == "CANCELLED"
+        assert not self.direct_paid.paid
+        assert not Block.objects.filter(transferred_booking_id=self.direct_paid.id).exists()
+        self.block_paid.refresh_from_db()
+        assert self.block_paid.status == "CANCELLED"
+        assert cancellation.open_bookings == [self.block_paid]
+        assert cancellation.open_free_block == [self.block_paid]
+
+    def test_cancel_event_errors(self):
+        with self.assertRaises(CommandError):
+            management.call_command('cancel_event', "unknown")
+        self.lesson.cancelled = True
+        self.lesson.save()
+        with self.assertRaises(CommandError):
+            management.call_command('cancel_event', self.lesson.slug)
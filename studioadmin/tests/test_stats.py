@@ -218,4 +218,33 @@ def test_months_to_recalculate():
     assert [m for m in months_to_recalculate(datetime(2024, 3, 2, tzinfo=UTC))] == [2, 3]
     assert [m for m in months_to_recalculate(datetime(2024, 6, 29, tzinfo=UTC))] == [5, 6]
     assert [m for m in months_to_recalculate(datetime(2024, 1, 2, tzinfo=UTC))] == [1]
-    assert [m for m in months_to_recalculate(datetime(2024, 10, 29, tzinfo=UTC), recalc_future=True)] == [9, 10, 11, 12]
\ No newline at end of file
+    assert [m for m in months_to_recalculate(datetime(2024, 10, 29, tzinfo=UTC), recalc_future=True)] == [9, 10, 11, 12]
+
+@patch("booking.models.membership_models.StripeConnector", MockConnector)
+def test_get_annual_payment_methods(seller, django_assert_num_queries):
+    event_type = baker.make(EventType, event_type="CL")
+    date = datetime(2022, 3, 1, tzinfo=UTC)
+
+    def _make_booking(**kwargs):
+        return baker.make("booking.booking", event__date=date, event__event_type=event_type, **kwargs)
+
+    _make_booking(paid=True, block=baker.make("booking.block"), _quantity=2)
+    _make_booking(paid=True, membership__membership__name="Membership")
+    _make_booking(paid=True, invoice=baker.make("stripe_payments.Invoice", paid=True, amount=10))
+    _make_booking(paid=True, invoice=baker.make("stripe_payments.Invoice", paid=True, amount=0))
+    for paypal_booking in _make_booking(paid=True, _quantity=2):
+        baker.make("payments.PaypalBookingTransaction", booking=paypal_booking, transaction_id="foo")
+    # paid, no payment method recorded
+    _make_booking(paid=True)
+    # unpaid bookings and bookings for other event types are not counted
+    _make_booking(paid=False)
+    baker.make("booking.booking", event__date=date, event__event_type__event_type="EV", paid=True)
+
+    with django_assert_num_queries(1):
+        assert get_annual_payment_methods(2022, "cl") == {
+            "block": 2,
+            "membership": 1,
+            "stripe": 2,
+            "paypal": 2,
+            "other": 1,
+        }
@@ -1318,7 +1318,7 @@ class CancelEventTests(TestCase):
                 '/studioadmin/confirm-refunded/{}'.format(id), studio_email.body
             )
 
-    @patch('studioadmin.views.events.send_mail')
+    @patch('studioadmin.views.cancel_event.send_mail')
     def test_email_errors(self, mock_send):
         mock_send.side_effect = Exception('Error sending email')
         # direct paid
@@ -576,7 +576,8 @@ class RegisterAjaxDisplayUpdateTests(TestPermissionMixin, TestCase):
         self.assertEqual(pc.spaces_left, 0)
         baker.make(WaitingListUser, user__email="waitinglist@user.com", event=self.pc)
 
-        self.client.post(self.toggle_attended_url, {'attendance': 'no-show'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.toggle_attended_url, {'attendance': 'no-show'})
         self.booking.refresh_from_db()
         self.assertFalse(self.booking.attended)
         self.assertTrue(self.booking.no_show)
@@ -13,7 +13,7 @@ from django.test import TestCase
 from booking.models import Event, FilterCategory
 from common.tests.helpers import format_content
 
-from timetable.models import Session
+from timetable.models import Session, TimetableUploadJob
 from studioadmin.tests.test_views.helpers import TestPermissionMixin
 
 
@@ -678,6 +678,82 @@ class UploadTimetableTests(TestPermissionMixin, TestCase):
         wed = Event.objects.get(name="Wed")
         assert list(wed.categories.all()) == []
 
+    @patch('studioadmin.forms.timetable_forms.timezone')
+    def test_multi_week_upload_creates_job(self, mock_tz):
+        mock_tz.now.return_value = datetime(
+            2015, 6, 1, 0, 0, tzinfo=dt_timezone.utc
+        )
+        sessions = baker.make_recipe('booking.mon_session', _quantity=2)
+        form_data = {
+            'start_date': 'Wed 03 Jun 2015',
+            'end_date': 'Mon 29 Jun 2015',
+            'sessions': [session.id for session in sessions],
+            'override_options_visible_on_site': "1",
+            'override_options_booking_open': "0",
+            'override_options_payment_open': "default",
+        }
+        resp = self.client.post(self.url, form_data)
+        # no classes created in the request
+        assert not Event.objects.exists()
+        job = TimetableUploadJob.objects.get()
+        assert resp.status_code == 302
+        assert resp.url == reverse('studioadmin:upload_timetable_job', args=(job.id,))
+        assert job.user == self.staff_user
+        assert job.status == TimetableUploadJob.PENDING
+        assert sorted(job.session_ids) == sorted(session.id for session in sessions)
+        assert job.override_options == {
+            "visible_on_site": "1", "booking_open": "0", "payment_open": "default"
+        }
+        # Wed-Sun, then 3 full weeks, then Mon 29th
+        assert job.weeks_total == 5
+        assert job.week_ranges()[0] == (datetime(2015, 6, 3).date(), datetime(2015, 6, 7).date())
+        assert job.week_ranges()[-1] == (datetime(2015, 6, 29).date(), datetime(2015, 6, 29).date())
+
+    def test_upload_timetable_job_progress(self):
+        job = baker.make(
+            TimetableUploadJob, start_date=datetime(2015, 6, 1).date(),
+            end_date=datetime(2015, 6, 28).date(), weeks_done=1
+        )
+        resp = self.client.get(reverse('studioadmin:upload_timetable_job', args=(job.id,)))
+        assert resp.templates[0].name == 'studioadmin/upload_timetable_progress.html'
+        assert "1 of 4 week(s) uploaded" in resp.content.decode()
+
+        resp = self.client.get(reverse('studioadmin:upload_timetable_job_status', args=(job.id,)))
+        assert resp.json() == {
+            'status': 'pending',
+            'weeks_done': 1,
+            'weeks_total': 4,
+            'progress': 25,
+            'classes_created': 0,
+            'finished': False,
+            'error': '',
+        }
+
+    def test_upload_timetable_job_status_requires_staff(self):
+        job = baker.make(
+            TimetableUploadJob, start_date=datetime(2015, 6, 1).date(),
+            end_date=datetime(2015, 6, 28).date()
+        )
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse('studioadmin:upload_timetable_job_status', args=(job.id,)))
+        assert resp.url == reverse('booking:permission_denied')
+
+    def test_upload_timetable_job_complete(self):
+        created = baker.make_recipe('booking.future_PC', name="new")
+        existing = baker.make_recipe('booking.future_PC', name="existing")
+        job = baker.make(
+            TimetableUploadJob, start_date=datetime(2015, 6, 1).date(),
+            end_date=datetime(2015, 6, 28).date(), weeks_done=4,
+            status=TimetableUploadJob.COMPLETE,
+            created_event_ids=[created.id], existing_event_ids=[existing.id],
+            duplicates=[{"id": existing.id, "count": 2}],
+        )
+        resp = self.client.get(reverse('studioadmin:upload_timetable_job', args=(job.id,)))
+        assert resp.templates[0].name == 'studioadmin/upload_timetable_confirmation.html'
+        assert resp.context['created_classes'] == [created]
+        assert resp.context['existing_classes'] == [existing]
+        assert resp.context['duplicate_classes'] == [{'class': existing, 'count': 2}]
+
 
 class CloneEventTests(TestPermissionMixin, TestCase):
 
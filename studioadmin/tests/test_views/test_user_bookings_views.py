@@ -257,7 +257,8 @@ class BookingEditViewTests(TestPermissionMixin, TestCase):
             'block': '',
             'free_class': False,
         }
-        self.client.post(self.url, data=data)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data=data)
         self.booking.refresh_from_db()
         assert self.booking.status == "CANCELLED"
         assert len(mail.outbox) == 1
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from datetime import timezone as dt_timezone
 from unittest.mock import Mock, patch
 
@@ -6,10 +6,13 @@ from model_bakery import baker
 import pytest
 
 from django.urls import reverse
+from django.db import connection
 from django.db.models import Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import Group, User
 from django.core import mail
+from django.core.cache import cache
 from django.utils import timezone
 
 from accounts.models import DisclaimerContent, OnlineDisclaimer
@@ -273,6 +276,33 @@ class UserListViewTests(TestPermissionMixin, TestCase):
             else:
                 self.assertFalse(opt['available'])
 
+    def test_filter_options_initials_cached(self):
+        User.objects.update(first_name="")
+        cache.clear()
+        user = baker.make_recipe('booking.user', first_name='Amy')
+
+        def _available(resp):
+            return {opt['value'] for opt in resp.context_data['filter_options'] if opt['available']}
+
+        resp = self.client.get(self.url)
+        assert _available(resp) == {'All', 'A'}
+
+        # queryset updates don't send signals, so the cached initials are used
+        User.objects.filter(id=user.id).update(first_name="Bob")
+        resp = self.client.get(self.url)
+        assert _available(resp) == {'All', 'A'}
+        # saving last_login (on login) doesn't clear the cache
+        user.last_login = timezone.now()
+        user.save(update_fields=["last_login"])
+        resp = self.client.get(self.url)
+        assert _available(resp) == {'All', 'A'}
+
+        # saving a user clears the cache
+        user.refresh_from_db()
+        user.save()
+        resp = self.client.get(self.url)
+        assert _available(resp) == {'All', 'B'}
+
     def testgroup_filter(self):
         baker.make_recipe(
             'booking.user', username='FooBar', first_name='AUser',
@@ -541,6 +571,80 @@ def test_attendance_list_with_dates(client):
     }
 
 
+@pytest.mark.django_db
+def test_attendance_list_ordering_and_query_count(client):
+    user = User.objects.create_user(username="staff", password="test")
+    user.is_staff = True
+    user.save()
+    level_class = baker.make_recipe("booking.future_PC", event_type__subtype="Pole level class", date=timezone.now())
+    practice = baker.make_recipe("booking.future_PP", event_type__subtype="Pole practice", date=timezone.now())
+
+    user1 = User.objects.create_user(username="user1", password="test")
+    user2 = User.objects.create_user(username="user2", password="test")
+    user3 = User.objects.create_user(username="user3", password="test")
+    baker.make("booking.booking", event=practice, user=user1)
+    baker.make("booking.booking", event=level_class, user=user2)
+    baker.make("booking.booking", event=practice, user=user2)
+    baker.make("booking.booking", event=level_class, user=user3)
+    # cancelled and no-show bookings are not counted
+    baker.make("booking.booking", event=practice, user=user3, status="CANCELLED")
+    baker.make(
+        "booking.booking", event=baker.make_recipe("booking.future_PP", event_type=practice.event_type, date=timezone.now()),
+        user=user3, no_show=True
+    )
+
+    url = reverse("studioadmin:users_status")
+    client.login(username=user.username, password="test")
+    with CaptureQueriesContext(connection) as queries:
+        resp = client.get(url)
+    assert resp.context["event_subtypes"] == ["Pole level class", "Pole practice"]
+    # ordered by counts, in subtype order
+    assert list(resp.context["user_counts"].items()) == [
+        (user2, {"Pole level class": 1, "Pole practice": 1}),
+        (user3, {"Pole level class": 1, "Pole practice": 0}),
+        (user1, {"Pole level class": 0, "Pole practice": 1}),
+    ]
+
+    # number of queries doesn't depend on the number of users
+    for i in range(20):
+        baker.make("booking.booking", event=practice, user=baker.make_recipe("booking.user"))
+    with CaptureQueriesContext(connection) as more_user_queries:
+        resp = client.get(url)
+    assert len(resp.context["user_counts"]) == 23
+    assert len(more_user_queries) == len(queries)
+
+
+@pytest.mark.django_db
+def test_repeat_no_shows_report(client):
+    user = User.objects.create_user(username="staff", password="test")
+    user.is_staff = True
+    user.save()
+    user1 = User.objects.create_user(username="user1", password="test")
+    user2 = User.objects.create_user(username="user2", password="test")
+    for no_show_user, num_no_shows in [(user1, 3), (user2, 2)]:
+        baker.make(
+            "booking.booking", user=no_show_user, event__date=timezone.now() - timedelta(hours=1),
+            no_show=True, instructor_confirmed_no_show=True, paid=True, _quantity=num_no_shows
+        )
+
+    url = reverse("studioadmin:repeat_no_shows")
+    client.login(username=user.username, password="test")
+    resp = client.get(url)
+    assert resp.context["sidenav_selection"] == "no_shows"
+    assert [(no_show_user, count) for no_show_user, count in resp.context["repeat_no_shows"]] == [(user1, 3)]
+    assert len(resp.context["repeat_no_shows"][0][0].no_show_bookings) == 3
+
+    # dates miss the no-shows
+    resp = client.post(url, data={"start_date": "01 Jun 2022", "end_date": "01 Oct 2022"})
+    assert resp.context["repeat_no_shows"] == []
+    assert "No repeated no-shows found" in resp.content.decode()
+
+
+def test_repeat_no_shows_report_staff_only(client):
+    url = reverse("studioadmin:repeat_no_shows")
+    resp = client.get(url)
+    assert resp.status_code == 302
+
 @pytest.mark.django_db
 @patch("booking.models.membership_models.StripeConnector", MockConnector)
 def test_user_memberships_list(client, configured_stripe_user, purchasable_membership):
@@ -40,6 +40,8 @@ from studioadmin.views import (BookingEditView,
                                toggle_subscribed,
                                unsubscribe,
                                upload_timetable_view,
+                               upload_timetable_job_view,
+                               upload_timetable_job_status,
                                choose_users_to_email,
                                user_modal_bookings_view,
                                user_blocks_view,
@@ -66,6 +68,7 @@ from studioadmin.views import (BookingEditView,
                                clone_event,
                                reactivated_block_status,
                                users_status,
+                               repeat_no_shows_report,
                                email_waiting_list,
                                all_users_banner_view, 
                                new_users_banner_view, 
@@ -161,8 +164,13 @@ urlpatterns = [
     ),
     path('timetable/upload/', upload_timetable_view,
         name='upload_timetable'),
+    path('timetable/upload/<int:job_id>/', upload_timetable_job_view,
+        name='upload_timetable_job'),
+    path('timetable/upload/<int:job_id>/status/', upload_timetable_job_status,
+        name='upload_timetable_job_status'),
     path('timetable/session/clone/<int:session_id>/', clone_timetable_session, name='clone_timetable_session'),
     path('users/attendance/', users_status, name="users_status"),
+    path('users/no-shows/', repeat_no_shows_report, name="repeat_no_shows"),
     path('users/', UserListView.as_view(), name="users"),
     path('blocks/', BlockListView.as_view(), name="blocks"),
     path('users/email/', choose_users_to_email,
@@ -21,11 +21,13 @@ from studioadmin.views.ticketed_events import cancel_ticketed_event_view, \
     TicketedEventAdminUpdateView, TicketedEventBookingsListView
 from studioadmin.views.timetable import timetable_admin_list, \
     TimetableSessionCreateView, TimetableSessionUpdateView, \
-    upload_timetable_view, clone_timetable_session
+    upload_timetable_view, clone_timetable_session, upload_timetable_job_view, \
+    upload_timetable_job_status
 from studioadmin.views.users import MailingListView, \
     toggle_subscribed, unsubscribe, \
     user_modal_bookings_view, user_blocks_view, UserListView, \
-    BookingEditPastView, BookingEditView, BookingAddView, users_status, toggle_permission, user_memberships_list
+    BookingEditPastView, BookingEditView, BookingAddView, users_status, toggle_permission, user_memberships_list, \
+    repeat_no_shows_report
 from studioadmin.views.vouchers import BlockVoucherCreateView, \
     BlockVoucherListView, BlockVoucherUpdateView, VoucherCreateView, \
     VoucherListView, VoucherUpdateView, BlockVoucherDetailView, \
@@ -61,13 +63,14 @@ __all__ = [
     'timetable_admin_list', 'TimetableSessionCreateView',
     'TimetableSessionUpdateView', 'toggle_subscribed', 'unsubscribe', 'toggle_permission',
     'upload_timetable_view', "clone_timetable_session",
+    "upload_timetable_job_view", "upload_timetable_job_status",
     'user_blocks_view', 'user_disclaimer',
     'UserListView', 'user_modal_bookings_view', 'VoucherCreateView',
     'VoucherListView', 'VoucherUpdateView',
     'BookingEditPastView', 'BookingAddView', 'BookingEditView',
     'export_mailing_list', 'booking_register_add_view',
     'ajax_toggle_attended', 'open_all_events',
-    'clone_event', 'users_status', 'email_waiting_list', 'delete_event',
+    'clone_event', 'users_status', 'repeat_no_shows_report', 'email_waiting_list', 'delete_event',
     'all_users_banner_view', 'new_users_banner_view', 'popup_notification_view',
     "InvoiceListView", "stripe_test",
     "ticketed_event_waiting_list_view", "email_ticketed_event_waiting_list",
@@ -1,23 +1,171 @@
-from booking.models import Block, BlockType
+"""
+Cancelling events and classes; used by the studioadmin cancel event view and
+the cancel_event management command.
+"""
+import logging
+
+from dateutil.relativedelta import relativedelta
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.mail import get_connection, send_mail
+from django.db import transaction
+from django.template.loader import get_template
+from django.utils import timezone
+
+from booking.email_helpers import send_support_email
+from booking.models import Block, BlockType, Booking, shopping_basket_cache_key
 from activitylog.models import ActivityLog
 
-def cancel_event(event, transfer_direct_paid=True, transfer_expired_blocks=True):
-    open_bookings = event.bookings.filter(status='OPEN', no_show=False)
-    open_free_non_block = [
-        bk for bk in open_bookings if bk.free_class and not bk.block
+
+logger = logging.getLogger(__name__)
+
+
+CANCELLED_BOOKING_FIELDS = [
+    "status", "block", "membership", "paid", "deposit_paid", "payment_confirmed",
+    "date_payment_confirmed", "free_class", "reminder_sent", "warning_sent",
+    "date_warning_sent",
+]
+
+
+class EventCancellation:
+    """
+    Cancel an event and its open bookings.
+
+    The open bookings are loaded and sorted into the categories shown on the
+    cancel event page and in the email to the studio.  cancel() reloads and locks
+    them, then updates the bookings and creates any transfer blocks in bulk, in
+    one transaction; the notification emails are queued while the bookings are
+    updated and sent over a single connection once the transaction is complete.
+    """
+
+    def __init__(self, event, transfer_direct_paid=True, host=None):
+        self.event = event
+        self.ev_type = event.event_type.readable_name.lower()
+        self.transfer_direct_paid = transfer_direct_paid
+        self.host = host or f"https://{Site.objects.get_current().domain}"
+
+        self._load_bookings()
+
+        self.notifications = []
+        self.notify = True
+        self._transfer_block_type = None
+
+    def _load_bookings(self, lock=False):
+        """
+        Load the event's open bookings and sort them into categories.  With lock,
+        the bookings are locked (for use inside cancel()'s transaction), so payments
+        or cancellations can't change them before they're updated.
+        """
+        all_open_bookings = self.event.bookings.filter(status='OPEN').select_related(
+            "user", "block", "membership"
+        ).order_by("id")
+        if lock:
+            all_open_bookings = all_open_bookings.select_for_update(of=("self",))
+        self.open_bookings = [bk for bk in all_open_bookings if not bk.no_show]
+        self.no_shows = [
+            bk for bk in all_open_bookings if bk.no_show and (bk.paid or bk.deposit_paid)
         ]
-    open_direct_paid = [
-        bk for bk in open_bookings if not bk.block
-        and not bk.free_class and bk.paid
-    ]
+        self.open_block_bookings = []
+        self.open_membership_bookings = []
+        self.open_expired_block_bookings = []
+        self.open_unpaid_bookings = []
+        self.open_free_non_block = []
+        self.open_free_block = []
+        self.open_direct_paid_deposit_only = []
+        self.open_direct_paid = []
+        for bk in self.open_bookings:
+            if bk.block and not bk.free_class:
+                if bk.block.expired:
+                    self.open_expired_block_bookings.append(bk)
+                else:
+                    self.open_block_bookings.append(bk)
+            if bk.membership:
+                self.open_membership_bookings.append(bk)
+            if not bk.deposit_paid and not bk.paid:
+                self.open_unpaid_bookings.append(bk)
+            if bk.free_class:
+                if bk.block:
+                    self.open_free_block.append(bk)
+                else:
+                    self.open_free_non_block.append(bk)
+            elif not bk.block:
+                if bk.deposit_paid and not bk.paid:
+                    self.open_direct_paid_deposit_only.append(bk)
+                if bk.paid and not bk.membership:
+                    self.open_direct_paid.append(bk)
+
+        # booking ids in each category, for checking bookings as they're cancelled
+        self.block_ids = {bk.id for bk in self.open_block_bookings}
+        self.membership_ids = {bk.id for bk in self.open_membership_bookings}
+        self.expired_block_ids = {bk.id for bk in self.open_expired_block_bookings}
+        self.free_block_ids = {bk.id for bk in self.open_free_block}
+        self.direct_paid_ids = {
+            bk.id for bk in self.open_direct_paid + self.open_free_non_block
+        }
+        self.direct_paid_deposit_only_ids = {bk.id for bk in self.open_direct_paid_deposit_only}
+
+    def get_context(self):
+        return {
+            'event': self.event,
+            'event_type': self.ev_type,
+            'open_bookings': self.open_bookings,
+            'open_direct_paid_bookings': self.open_direct_paid,
+            'open_block_bookings': self.open_block_bookings,
+            'open_membership_bookings': self.open_membership_bookings,
+            'open_expired_block_bookings': self.open_expired_block_bookings,
+            'open_deposit_only_paid_bookings': self.open_direct_paid_deposit_only,
+            'open_unpaid_bookings': self.open_unpaid_bookings,
+            'open_free_non_block_bookings': self.open_free_non_block,
+            'open_free_block_bookings': self.open_free_block,
+            'no_shows': self.no_shows,
+        }
+
+    def cancelled_message(self):
+        if self.open_bookings:
+            return 'open booking(s) have been cancelled{} Notification emails have {}been sent to {}.'.format(
+                ' and transfer blocks created for direct paid bookings.'
+                if self.transfer_direct_paid else '.',
+                '' if self.notify else 'not ',
+                ', '.join(
+                    ['{} {}'.format(booking.user.first_name, booking.user.last_name)
+                     for booking in self.open_bookings]
+                )
+            )
+        return 'there were no open bookings for this {}'.format(self.ev_type)
+
+    def _get_transfer_block_type(self):
+        # only created when it's first needed
+        if self._transfer_block_type is None:
+            self._transfer_block_type = BlockType.get_transfer_block_type(self.event.event_type)
+        return self._transfer_block_type
+
+    def _cancel_booking(self, booking):
+        """
+        Update a booking (not saved) for cancellation; returns an unsaved
+        transfer block if one is needed for the booking, and queues its
+        notification email
+        """
+        transfer_block = None
+        block_expires_soon = False
+        direct_paid = booking.id in self.direct_paid_ids
+        notification_context = {
+            'block_paid': booking.id in self.block_ids,
+            'membership_paid': booking.id in self.membership_ids,
+            'direct_paid': direct_paid or booking.id in self.direct_paid_deposit_only_ids,
+            'free_block': booking.id in self.free_block_ids,
+            'expired_block': booking.id in self.expired_block_ids,
+            'block_expiry_date': booking.block.expiry_date.strftime('%d %b %Y') if booking.block else None,
+        }
 
-    for booking in open_bookings:
-        direct_paid = booking in open_direct_paid or booking in open_free_non_block
         if booking.membership:
             booking.membership = None
             booking.paid = False
             booking.payment_confirmed = False
-        if booking.block and not booking.block.expired:
+
+        elif booking.block and not booking.block.expired:
+            block_expires_soon = booking.block.expiry_date < timezone.now() + relativedelta(months=1)
             booking.block = None
             booking.deposit_paid = False
             booking.paid = False
@@ -25,15 +173,17 @@ def cancel_event(event, transfer_direct_paid=True, transfer_expired_blocks=True)
             # in case this was paid with a free class block
             booking.free_class = False
 
-        elif (direct_paid and transfer_direct_paid) or (booking.block and booking.block.expired and transfer_expired_blocks):
+        elif (direct_paid and self.transfer_direct_paid) or (booking.block and booking.block.expired):
             # direct paid = paypal and free non-block paid
             # create transfer block and make this booking unpaid
-            if booking.event.event_type.event_type != 'EV':
-                block_type = BlockType.get_transfer_block_type(booking.event.event_type)
-                Block.objects.create(
-                    block_type=block_type, user=booking.user,
-                    transferred_booking_id=booking.id
+            if self.event.event_type.event_type != 'EV':
+                transfer_block = Block(
+                    block_type=self._get_transfer_block_type(), user=booking.user,
+                    transferred_booking_id=booking.id,
+                    # transfer blocks are free, so Block.save would mark them paid
+                    paid=True,
                 )
+                transfer_block.expiry_date = transfer_block.get_expiry_date()
 
                 booking.block = None  # need to reset block if booked
                 # with block that's now expired
@@ -42,14 +192,131 @@ def cancel_event(event, transfer_direct_paid=True, transfer_expired_blocks=True)
                 booking.payment_confirmed = False
                 booking.free_class = False
 
+        # bulk_update doesn't call Booking.save, so apply the changes it makes
+        # on cancellation
         booking.status = "CANCELLED"
-        booking.save()
+        booking.reminder_sent = False
+        booking.warning_sent = False
+        booking.date_warning_sent = None
+        if booking.block:
+            booking.block = None
+            booking.paid = False
+            booking.payment_confirmed = False
+        if booking.free_class:
+            booking.paid = True
+            booking.payment_confirmed = True
+        if booking.payment_confirmed and not booking.date_payment_confirmed:
+            booking.date_payment_confirmed = timezone.now()
+
+        self.notifications.append(
+            {
+                **notification_context,
+                'host': self.host,
+                'event_type': self.ev_type,
+                'block_expires_soon': block_expires_soon,
+                'transfer_block_created': transfer_block is not None,
+                'event': self.event,
+                'user': booking.user,
+            }
+        )
+        return transfer_block
 
-    event.cancelled = True
-    event.booking_open = False
-    event.payment_open = False
-    event.save()
+    def cancel(self, cancelled_by, send_notifications=True):
+        """
+        Cancel the event and its open bookings, and record it in the activity
+        log as cancelled by (username) cancelled_by
+        """
+        self.notifications = []
+        self.notify = send_notifications
+        with transaction.atomic():
+            # reload the bookings locked, in case any have been paid for or
+            # cancelled since they were first loaded
+            self._load_bookings(lock=True)
+            transfer_blocks = [
+                transfer_block for transfer_block in
+                (self._cancel_booking(booking) for booking in self.open_bookings)
+                if transfer_block is not None
+            ]
+            Block.objects.bulk_create(transfer_blocks)
+            Booking.objects.bulk_update(self.open_bookings, CANCELLED_BOOKING_FIELDS)
 
-    ActivityLog.objects.create(
-        log=f"Class {event} cancelled offline by admin user rebkwok; {open_bookings.count()} bookings cancelled"
-    )
+            self.event.cancelled = True
+            self.event.booking_open = False
+            self.event.payment_open = False
+            self.event.save()
+
+            ActivityLog.objects.create(
+                log="{} {} cancelled by admin user {}; {}".format(
+                    self.ev_type.title(), self.event, cancelled_by,
+                    self.cancelled_message()
+                )
+            )
+        # bulk updates bypass the save signals that clear the users' cached shopping baskets
+        cache.delete_many({shopping_basket_cache_key(booking.user_id) for booking in self.open_bookings})
+
+        if send_notifications:
+            self.send_notifications()
+
+    def send_notifications(self):
+        """
+        Send the queued notification emails to users, and the email to the
+        studio with links for confirming refunds, over one connection
+        """
+        connection = get_connection()
+        try:
+            try:
+                connection.open()
+            except Exception as e:
+                # each email will try to open the connection again, and
+                # report its own error if that fails
+                logger.error("Error opening email connection for cancelled event %s: %s", self.event.id, e)
+            for ctx in self.notifications:
+                try:
+                    send_mail('{} {} has been cancelled'.format(
+                        settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, self.ev_type.title(),
+                        ),
+                        get_template('studioadmin/email/event_cancelled.txt').render(ctx),
+                        settings.DEFAULT_FROM_EMAIL,
+                        [ctx['user'].email],
+                        html_message=get_template('studioadmin/email/event_cancelled.html').render(ctx),
+                        fail_silently=False,
+                        connection=connection,
+                    )
+                except Exception as e:
+                    # send mail to tech support with Exception
+                    send_support_email(
+                        e, __name__, "cancel event - "
+                        "send notification email to user"
+                    )
+
+            # email studio with links for confirming refunds
+            # direct paid (full and deposit only) and free non-block
+            # if action selected is not transfer, otherwise just email for
+            # deposits as we don't create
+            # transfer blocks for deposit-only
+            try:
+                ctx = {
+                    **self.get_context(),
+                    'host': self.host,
+                    'transfer_direct_paid': self.transfer_direct_paid,
+                }
+                send_mail(
+                    '{} {} has been cancelled - please review for refunds '
+                    'required'.format(
+                        settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, self.ev_type.title(),
+                    ),
+                    get_template('studioadmin/email/to_studio_event_cancelled.txt').render(ctx),
+                    settings.DEFAULT_FROM_EMAIL,
+                    [settings.DEFAULT_STUDIO_EMAIL],
+                    html_message=get_template('studioadmin/email/to_studio_event_cancelled.html').render(ctx),
+                    fail_silently=False,
+                    connection=connection,
+                )
+            except Exception as e:
+                # send mail to tech support with Exception
+                send_support_email(
+                    e, __name__, "cancel event - "
+                    "send refund notification email to studio"
+                )
+        finally:
+            connection.close()
@@ -7,13 +7,15 @@ from django.template.loader import get_template
 from booking.models import UserMembership
 
 
-def send_new_classes_email_to_members(request, new_classes):
-
+def send_new_classes_email(host, new_classes):
+    """
+    Email active members about new classes; returns the number of members emailed
+    """
     members = list(User.objects.filter(id__in=UserMembership.active_member_ids()).values_list("email", flat=True))
 
     ctx = {
         "new_classes": new_classes,
-        "host": f'http://{request.get_host()}'
+        "host": host
     }
 
     msg = EmailMultiAlternatives(
@@ -33,5 +35,10 @@ def send_new_classes_email_to_members(request, new_classes):
         "text/html"
     )
     msg.send(fail_silently=False)
-    if members:
-        messages.success(request, f"{len(members)} member(s) have been notified by email")
+    return len(members)
+
+
+def send_new_classes_email_to_members(request, new_classes):
+    members_count = send_new_classes_email(f'http://{request.get_host()}', new_classes)
+    if members_count:
+        messages.success(request, f"{members_count} member(s) have been notified by email")
@@ -8,21 +8,18 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.urls import reverse
-from django.template.loader import get_template
 from django.template.response import TemplateResponse
 from django.shortcuts import HttpResponseRedirect, get_object_or_404, HttpResponse, render, redirect
 from django.views.generic import CreateView, UpdateView
 from django.views.decorators.http import require_POST
 from django.utils import timezone
 from django.utils.safestring import mark_safe
-from django.core.mail import send_mail
 
 from braces.views import LoginRequiredMixin
-from dateutil.relativedelta import relativedelta
 
-from booking.models import Block, BlockType, EventType, Event, FilterCategory
-from booking.email_helpers import send_support_email
+from booking.models import EventType, Event, FilterCategory
 from studioadmin.forms import EventAdminForm, OnlineTutorialAdminForm, EventQuickEditForm
+from studioadmin.views.cancel_event import EventCancellation
 from studioadmin.views.email_helpers import send_new_classes_email_to_members
 from studioadmin.views.helpers import staff_required, StaffUserMixin, set_cloned_name, get_page
 from activitylog.models import ActivityLog
@@ -227,228 +224,26 @@ def cancel_event_view(request, slug):
     event = get_object_or_404(Event, slug=slug)
     ev_type = event.event_type.readable_name.lower()
 
-    all_open_bookings = event.bookings.filter(status='OPEN')
-    open_bookings = [bk for bk in all_open_bookings if not bk.no_show]
-    no_shows_all = [bk for bk in all_open_bookings if bk.no_show]
-    no_shows = [bk for bk in no_shows_all if bk.paid or bk.deposit_paid]
-    open_block_bookings = [
-        bk for bk in open_bookings if bk.block and not bk.free_class and not bk.block.expired
-    ]
-    open_membership_bookings = [
-        bk for bk in open_bookings if bk.membership
-    ]
-    open_expired_block_bookings = [
-        bk for bk in open_bookings if bk.block and not bk.free_class and bk.block.expired
-    ]
-    open_unpaid_bookings = [
-        bk for bk in open_bookings if not bk.deposit_paid and not bk.paid
-    ]
-    open_free_non_block = [
-        bk for bk in open_bookings if bk.free_class and not bk.block
-    ]
-    open_free_block = [bk for bk in open_bookings if bk.free_class and bk.block]
-    open_direct_paid_deposit_only = [
-        bk for bk in open_bookings if not bk.block
-        and not bk.free_class and bk.deposit_paid and not bk.paid
-    ]
-    open_direct_paid = [
-        bk for bk in open_bookings if not bk.block and not bk.membership
-        and not bk.free_class and bk.paid
-    ]
-
     if request.method == 'POST':
         if 'confirm' in request.POST:
-            transfer_direct_paid = request.POST.get('direct_paid_action') == 'transfer'
-
-            for booking in open_bookings:
-                transfer_block_created = False
-                block_expires_soon = False
-                block_paid = booking in open_block_bookings
-                membership_paid = booking in open_membership_bookings
-                free_block = booking in open_free_block
-                expired_block = booking in open_expired_block_bookings
-                direct_paid = booking in open_direct_paid or \
-                              booking in open_free_non_block
-                deposit_only_paid = booking in open_direct_paid_deposit_only
-                block_expiry_date = booking.block.expiry_date.strftime('%d %b %Y') \
-                    if booking.block else None
-
-                if booking.membership:
-                    booking.membership = None
-                    booking.paid = False
-                    booking.payment_confirmed = False
-
-                elif booking.block and not booking.block.expired:
-                    one_month_ahead = timezone.now() + relativedelta(months=1)
-                    if booking.block.expiry_date < one_month_ahead:
-                        block_expires_soon = True
-
-                    booking.block = None
-                    booking.deposit_paid = False
-                    booking.paid = False
-                    booking.payment_confirmed = False
-                    # in case this was paid with a free class block
-                    booking.free_class = False
-
-                elif (direct_paid and transfer_direct_paid) \
-                        or (booking.block and booking.block.expired):
-                    # direct paid = paypal and free non-block paid
-                    # create transfer block and make this booking unpaid
-                    if booking.event.event_type.event_type != 'EV':
-                        block_type = BlockType.get_transfer_block_type(booking.event.event_type)
-                        Block.objects.create(
-                            block_type=block_type, user=booking.user,
-                            transferred_booking_id=booking.id
-                        )
-                        transfer_block_created = True
-
-                        booking.block = None  # need to reset block if booked
-                        # with block that's now expired
-                        booking.deposit_paid = False
-                        booking.paid = False
-                        booking.payment_confirmed = False
-                        booking.free_class = False
-
-                booking.status = "CANCELLED"
-                booking.save()
-
-                try:
-                    # send notification email to user
-                    host = 'http://{}'.format(request.get_host())
-                    ctx = {
-                        'host': host,
-                        'event_type': ev_type,
-                        'block_paid': block_paid,
-                        'membership_paid': membership_paid,
-                        'direct_paid': direct_paid or deposit_only_paid,
-                        'free_block': free_block,
-                        'expired_block': expired_block,
-                        'block_expires_soon': block_expires_soon,
-                        'block_expiry_date': block_expiry_date,
-                        'transfer_block_created': transfer_block_created,
-                        'event': event,
-                        'user': booking.user,
-                    }
-                    send_mail('{} {} has been cancelled'.format(
-                        settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, ev_type.title(),
-                        ),
-                        get_template(
-                            'studioadmin/email/event_cancelled.txt'
-                        ).render(ctx),
-                        settings.DEFAULT_FROM_EMAIL,
-                        [booking.user.email],
-                        html_message=get_template(
-                            'studioadmin/email/event_cancelled.html'
-                            ).render(ctx),
-                        fail_silently=False)
-                except Exception as e:
-                    # send mail to tech support with Exception
-                    send_support_email(
-                        e, __name__, "cancel event - "
-                        "send notification email to user"
-                    )
-
-            event.cancelled = True
-            event.booking_open = False
-            event.payment_open = False
-            event.save()
-
-            # email studio with links for confirming refunds
-            # direct paid (full and deposit only) and free non-block
-            # if action selected is not transfer, otherwise just email for
-            # deposits as we don't create
-            # transfer blocks for deposit-only
-            try:
-                host = 'http://{}'.format(request.get_host())
-                # send email to studio
-                ctx = {
-                    'host': host,
-                    'event_type': ev_type,
-                    'transfer_direct_paid': transfer_direct_paid,
-                    'open_bookings': open_bookings,
-                    'open_membership_bookings': open_membership_bookings,
-                    'open_direct_paid_bookings': open_direct_paid,
-                    'open_block_bookings': open_block_bookings,
-                    'open_expired_block_bookings': open_expired_block_bookings,
-                    'open_deposit_only_paid_bookings': open_direct_paid_deposit_only,
-                    'open_unpaid_bookings': open_unpaid_bookings,
-                    'open_free_non_block_bookings': open_free_non_block,
-                    'open_free_block_bookings': open_free_block,
-                    'no_shows': no_shows,
-                    'event': event,
-                }
-                send_mail(
-                    '{} {} has been cancelled - please review for refunds '
-                    'required'.format(
-                        settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, ev_type.title(),
-                    ),
-                    get_template(
-                        'studioadmin/email/to_studio_event_cancelled.txt'
-                    ).render(ctx),
-                    settings.DEFAULT_FROM_EMAIL,
-                    [settings.DEFAULT_STUDIO_EMAIL],
-                    html_message=get_template(
-                        'studioadmin/email/to_studio_event_cancelled.html'
-                        ).render(ctx),
-                    fail_silently=False)
-            except Exception as e:
-                # send mail to tech support with Exception
-                send_support_email(
-                    e, __name__, "cancel event - "
-                    "send refund notification email to studio"
-                )
-
-            if open_bookings:
-                booking_cancelled_msg = 'open ' \
-                                        'booking(s) have been cancelled{} ' \
-                                        'Notification emails have been ' \
-                                        'sent to {}.'.format(
-                    ' and transfer blocks created for direct paid bookings.'
-                    if request.POST.get('direct_paid_action') == 'transfer'
-                    else '.',
-                    ', '.join(
-                        ['{} {}'.format(booking.user.first_name,
-                                        booking.user.last_name)
-                         for booking in open_bookings]
-                        )
-                    )
-            else:
-                booking_cancelled_msg = 'there were ' \
-                                        'no open bookings for this {}'.format(
-                    ev_type
-                )
+            cancellation = EventCancellation(
+                event,
+                transfer_direct_paid=request.POST.get('direct_paid_action') == 'transfer',
+                host='http://{}'.format(request.get_host()),
+            )
+            cancellation.cancel(cancelled_by=request.user.username)
             messages.info(
                 request,
                 '{} has been cancelled; '.format(
                     ev_type.title()
-                ) + booking_cancelled_msg
+                ) + cancellation.cancelled_message()
             )
-
-            ActivityLog.objects.create(
-                log="{} {} cancelled by admin user {}; {}".format(
-                    ev_type.title(), event, request.user.username,
-                    booking_cancelled_msg
-                )
-            )
-
             return HttpResponseRedirect(event.event_type.get_admin_list_url())
         elif 'cancel' in request.POST:
             return HttpResponseRedirect(event.event_type.get_admin_list_url())
 
-    context = {
-        'event': event,
-        'event_type': ev_type,
-        'open_bookings': bool(open_bookings),
-        'open_direct_paid_bookings': open_direct_paid,
-        'open_block_bookings': open_block_bookings,
-        'open_membership_bookings': open_membership_bookings,
-        'open_expired_block_bookings': open_expired_block_bookings,
-        'open_deposit_only_paid_bookings': open_direct_paid_deposit_only,
-        'open_unpaid_bookings': open_unpaid_bookings,
-        'open_free_non_block_bookings': open_free_non_block,
-        'open_free_block_bookings': open_free_block,
-        'no_shows': no_shows
-    }
+    context = EventCancellation(event).get_context()
+    context['open_bookings'] = bool(context['open_bookings'])
 
     return TemplateResponse(
         request, 'studioadmin/cancel_event.html', context
@@ -8,7 +8,6 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.contrib.sites.models import Site
 from django.urls import reverse
 from django.template.loader import get_template
 from django.template.response import TemplateResponse
@@ -262,7 +261,7 @@ class InvoiceListView(LoginRequiredMixin, StaffUserMixin, ListView):
     model = Invoice
     context_object_name = "invoices"
     template_name = "studioadmin/invoices.html"
-    queryset = Invoice.objects.filter(paid=True)
+    queryset = Invoice.objects.filter(paid=True).prefetch_related(*Invoice.ITEM_PREFETCHES)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -286,8 +285,7 @@ class SubscriptionInvoiceListView(LoginRequiredMixin, StaffUserMixin, ListView):
 @login_required
 @staff_required
 def stripe_test(request):
-    site_sellers = Seller.objects.filter(site=Site.objects.get_current(request))
-    site_seller = site_sellers.first() if site_sellers else None
+    site_seller = Seller.objects.get_current(request)
     return TemplateResponse(
         request, "studioadmin/stripe_test.html", 
         {"sidenav_selection": "stripe_test", "seller": site_seller}
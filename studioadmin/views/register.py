@@ -19,7 +19,7 @@ from django.views.decorators.http import require_http_methods
 
 from braces.views import LoginRequiredMixin
 
-from booking.email_helpers import send_waiting_list_email
+from booking.email_helpers import notify_waiting_list
 from booking.models import Event, Booking, Block, BlockType, WaitingListUser
 from studioadmin.forms import StatusFilter,  RegisterDayForm, AddRegisterBookingForm
 from studioadmin.views.helpers import is_instructor_or_staff, \
@@ -423,19 +423,10 @@ def ajax_toggle_attended(request, booking_id):
 
         if attendance == 'no-show' and booking.event.date > (timezone.now() + timedelta(hours=1)):
             # Only send waiting list emails if marking booking as no-show more than 1 hr before the event start
-            waiting_list_users = WaitingListUser.objects.filter(event=booking.event)
-            if waiting_list_users:
-                send_waiting_list_email(
-                    booking.event,
-                    [wluser.user for wluser in waiting_list_users],
-                    host='http://{}'.format(request.get_host())
-                )
-                ActivityLog.objects.create(
-                    log='Waiting list email sent to user(s) {} for event {}'.format(
-                        ',  '.join([wluser.user.username for wluser in waiting_list_users]),
-                        booking.event
-                    )
-                )
+            notify_waiting_list(
+                booking.event, host='http://{}'.format(request.get_host()),
+                source="ajax_toggle_attended"
+            )
 
     if booking.instructor_confirmed_no_show:
         status_text = "No-show"
@@ -442,18 +442,19 @@ def get_annual_payment_methods(year, event_types):
 
     if data is None or year == datetime.now().year:
         logger.debug(f"cache miss: {cache_key}")
-        paid_bookings = Booking.objects.filter(event__event_type__event_type__in=event_types, event__date__year=year, paid=True)
-        block = paid_bookings.filter(block__isnull=False).count()
-        membership = paid_bookings.filter(membership__isnull=False).count()
-        # stripe
-        stripe = paid_bookings.filter(invoice__paid=True).count()
-        paypal = paid_bookings.filter(paypalbookingtransaction__transaction_id__isnull=False).count()
+        paid_bookings = Booking.objects.filter(
+            event__event_type__event_type__in=event_types, event__date__year=year, paid=True
+        ).with_payment_method()
+        counts = dict(
+            paid_bookings.order_by().values("payment_method").annotate(count=Count("id")).values_list("payment_method", "count")
+        )
         data = {
-            "block": block,
-            "membership": membership,
-            "stripe": stripe,
-            "paypal": paypal,
-            "other": paid_bookings.count() - block - membership - stripe - paypal
+            "block": counts.get("Block", 0),
+            "membership": counts.get("Membership", 0),
+            # bookings paid with a 100% voucher are paid via a (zero-amount) stripe invoice
+            "stripe": counts.get("Stripe", 0) + counts.get("Voucher", 0),
+            "paypal": counts.get("PayPal", 0),
+            "other": counts.get("", 0),
         }
         cache.set(cache_key, data)
     return data
@@ -42,13 +42,13 @@ class TicketedEventAdminListView(
 
         queryset = TicketedEvent.objects.filter(
                 date__gte=timezone.now()
-            ).order_by('date')
+            ).with_tickets_booked().order_by('date')
 
         if self.request.method == 'POST':
             if "past" in self.request.POST:
                 queryset = TicketedEvent.objects.filter(
                     date__lte=timezone.now()
-                ).order_by('date')
+                ).with_tickets_booked().order_by('date')
                 context['show_past'] = True
             elif "upcoming" in self.request.POST:
                 queryset = queryset
@@ -4,6 +4,7 @@ from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 
+from django.http import JsonResponse
 from django.urls import reverse
 from django.shortcuts import HttpResponseRedirect, render, get_object_or_404
 from django.views.generic import CreateView, UpdateView
@@ -12,7 +13,7 @@ from braces.views import LoginRequiredMixin
 
 from booking import utils
 from booking.models import Event, FilterCategory
-from timetable.models import Session
+from timetable.models import Session, TimetableUploadJob
 from studioadmin.forms import TimetableSessionFormSet, SessionAdminForm, \
     DAY_CHOICES, UploadTimetableForm
 from studioadmin.views.email_helpers import send_new_classes_email_to_members
@@ -236,6 +237,18 @@ class TimetableSessionCreateView(
         return reverse('studioadmin:timetable')
 
 
+def _format_override_options(override_options):
+    def _format_override_option(value):
+        value = int(value)
+        return "yes" if value == 1 else "no"
+    return ', '.join(
+        [
+            f'{key.replace("_", " ")} ({_format_override_option(value)})'
+            for key, value in override_options.items() if value != "default"
+        ]
+    )
+
+
 @login_required
 @staff_required
 def upload_timetable_view(request,
@@ -254,13 +267,24 @@ def upload_timetable_view(request,
                 "payment_open": form.cleaned_data['override_options_payment_open']
             }
 
+            if (end_date - start_date).days + start_date.weekday() > 6:
+                # more than one week; upload in the background, one week at a time
+                job = TimetableUploadJob.objects.create(
+                    user=request.user,
+                    start_date=start_date,
+                    end_date=end_date,
+                    session_ids=[session.id for session in session_ids],
+                    override_options=override_options,
+                    host=f'http://{request.get_host()}',
+                )
+                return HttpResponseRedirect(
+                    reverse('studioadmin:upload_timetable_job', args=(job.id,))
+                )
+
             created_classes, existing_classes, duplicate_classes = \
                 utils.upload_timetable(
                     start_date, end_date, session_ids, request.user, override_options=override_options
                 )
-            def _format_override_option(value):
-                value = int(value)
-                return "yes" if value == 1 else "no"
 
             context = {'start_date': start_date,
                        'end_date': end_date,
@@ -268,7 +292,7 @@ def upload_timetable_view(request,
                        'existing_classes': existing_classes,
                        'duplicate_classes': duplicate_classes,
                        'sidenav_selection': 'upload_timetable',
-                       'override_options': ', '.join([f'{key.replace("_", " ")} ({_format_override_option(value)})' for key, value in override_options.items() if value != "default"]),
+                       'override_options': _format_override_options(override_options),
                        }
 
             visible_created_classes = [
@@ -314,6 +338,54 @@ def upload_timetable_view(request,
     )
 
 
+@login_required
+@staff_required
+def upload_timetable_job_view(request, job_id):
+    job = get_object_or_404(TimetableUploadJob, pk=job_id)
+    context = {
+        'job': job,
+        'start_date': job.start_date,
+        'end_date': job.end_date,
+        'sidenav_selection': 'upload_timetable',
+        'override_options': _format_override_options(job.override_options),
+    }
+    if job.status != TimetableUploadJob.COMPLETE:
+        return render(request, 'studioadmin/upload_timetable_progress.html', context)
+
+    events = Event.objects.in_bulk(
+        job.created_event_ids + job.existing_event_ids
+        + [duplicate["id"] for duplicate in job.duplicates]
+    )
+    context.update(
+        {
+            'created_classes': [events[event_id] for event_id in job.created_event_ids if event_id in events],
+            'existing_classes': [events[event_id] for event_id in job.existing_event_ids if event_id in events],
+            'duplicate_classes': [
+                {'class': events[duplicate["id"]], 'count': duplicate["count"]}
+                for duplicate in job.duplicates if duplicate["id"] in events
+            ],
+        }
+    )
+    return render(request, 'studioadmin/upload_timetable_confirmation.html', context)
+
+
+@login_required
+@staff_required
+def upload_timetable_job_status(request, job_id):
+    job = get_object_or_404(TimetableUploadJob, pk=job_id)
+    return JsonResponse(
+        {
+            'status': job.status,
+            'weeks_done': job.weeks_done,
+            'weeks_total': job.weeks_total,
+            'progress': job.progress,
+            'classes_created': len(job.created_event_ids),
+            'finished': job.is_finished,
+            'error': job.error,
+        }
+    )
+
+
 @login_required
 @staff_required
 def clone_timetable_session(request, session_id):
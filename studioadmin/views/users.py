@@ -22,8 +22,9 @@ from django.core.mail import send_mail
 
 from braces.views import LoginRequiredMixin
 
+from accounts.models import get_first_name_initials
 from booking.models import AllowedGroup, Booking,  Block, BlockType, EventType, WaitingListUser
-from booking.email_helpers import send_support_email,  send_waiting_list_email
+from booking.email_helpers import notify_waiting_list, send_support_email
 
 from common.mailchimp_utils import update_mailchimp
 from common.views import _set_pagination_context
@@ -45,9 +46,8 @@ NAME_FILTERS = (
 )
 
 
-def _get_name_filter_available(queryset):
-    names_list = queryset.distinct().values_list('first_name', flat=True)
-    letter_set = set([name[0].lower() for name in names_list if name])
+def _get_name_filter_available(queryset=None):
+    letter_set = get_first_name_initials(queryset)
 
     name_filter_options = []
     for option in NAME_FILTERS:
@@ -70,22 +70,24 @@ class UserListView(LoginRequiredMixin,  InstructorOrStaffUserMixin,  ListView):
     context_object_name = 'users'
 
     def get_queryset(self):
+        # Searches and the initial filter use the upper(name) indexes on
+        # auth_user (see accounts migration 0029); ordering by id as well as
+        # first_name keeps pagination stable
+        self.filtered = False
+        queryset = User.objects.all().order_by('first_name', 'id')
         reset = self.request.GET.get('reset')
-        if reset:
-            queryset = User.objects.all().order_by('first_name')
-        else:
+        if not reset:
             search_text = self.request.GET.get('search')
             filter = self.request.GET.get('filter', self.request.GET.get('pfilter'))
             group_name = self.request.GET.get('group_filter', self.request.GET.get('pgroup_filter'))
 
-            if group_name and group_name.lower() != 'all' and not reset:
+            if group_name and group_name.lower() != 'all':
                 try:
                     group = Group.objects.get(name__iexact=group_name)
-                    queryset = group.user_set.all().order_by('first_name')
+                    queryset = queryset.filter(groups=group)
+                    self.filtered = True
                 except Group.DoesNotExist:
-                    queryset = User.objects.all().order_by('first_name')
-            else:
-                queryset = User.objects.all().order_by('first_name')
+                    pass
 
             if search_text:
                 queryset = queryset.filter(
@@ -93,15 +95,17 @@ class UserListView(LoginRequiredMixin,  InstructorOrStaffUserMixin,  ListView):
                     Q(last_name__icontains=search_text) |
                     Q(username__icontains=search_text)
                 )
+                self.filtered = True
 
             if filter and filter.lower() != 'all':
                 queryset = queryset.filter(first_name__istartswith=filter)
+                self.filtered = True
 
         return queryset
 
     def get_context_data(self):
         context = super(UserListView,  self).get_context_data()
-        queryset = self.get_queryset()
+        queryset = self.object_list
         paginator = Paginator(queryset, 30)
 
         page = get_page(self.request, paginator)
@@ -114,7 +118,10 @@ class UserListView(LoginRequiredMixin,  InstructorOrStaffUserMixin,  ListView):
 
         search_text = self.request.GET.get('search',  '')
         reset = self.request.GET.get('reset')
-        context['filter_options'] = _get_name_filter_available(queryset)
+        # initials for all users are cached
+        context['filter_options'] = _get_name_filter_available(
+            queryset if self.filtered else None
+        )
 
         if reset:
             search_text = ''
@@ -126,8 +133,8 @@ class UserListView(LoginRequiredMixin,  InstructorOrStaffUserMixin,  ListView):
 
         form = UserListSearchForm(initial={'search': search_text})
         context['form'] = form
-        num_results = queryset.count()
-        total_users = User.objects.count()
+        num_results = paginator.count
+        total_users = User.objects.count() if self.filtered else num_results
         context['num_results'] = num_results
         context['total_users'] = total_users
 
@@ -135,9 +142,11 @@ class UserListView(LoginRequiredMixin,  InstructorOrStaffUserMixin,  ListView):
         return context
 
 
-@login_required
-@staff_required
-def users_status(request):
+def _get_attendance_date_range(request):
+    """
+    Return the start and end dates from the attendance search form data, and the
+    form.  Defaults to the beginning of the current month until now.
+    """
     date_format = '%d %b %Y'
     if request.method == "POST":
         start_date_str = request.POST.get('start_date')
@@ -159,51 +168,61 @@ def users_status(request):
         end_date_str = end_date.strftime(date_format)
     else:
         end_date = datetime.strptime(end_date_str, date_format).replace(hour=23, minute=59, tzinfo=dt_timezone.utc)
-        
+
     form = AttendanceSearchForm(
         {"start_date": start_date_str, "end_date": end_date_str}
     )
+    return start_date, end_date, form
+
+
+@login_required
+@staff_required
+def users_status(request):
+    start_date, end_date, form = _get_attendance_date_range(request)
     bookings = Booking.objects \
         .filter(event__date__gte=start_date, status="OPEN", no_show=False)\
         .filter(event__date__lte=end_date)
 
-    users_with_bookings = bookings.distinct("user_id")
     subtype_order = {
         "Pole level class": 1,
         "Pole practice": 2,
         "Private": 3
     }
     event_subtypes = list(
-        bookings.distinct("event__event_type__subtype")
-        .values_list("event__event_type__subtype", flat=True)
+        bookings.order_by().values_list("event__event_type__subtype", flat=True).distinct()
     )
     event_subtypes.sort(key=lambda x: subtype_order.get(x, 9))
-    default_user_dict = {subtype: 0 for subtype in event_subtypes}
-
-    counts_by_user = {}
-    for booking in users_with_bookings:
-        user = booking.user
-        counts = bookings.filter(user_id=user.id) \
-            .values("event__event_type__subtype") \
-            .annotate(count=Count("event__event_type__subtype"))
-        user_dict = {**default_user_dict}
-        for count_item in counts:
-            user_dict[count_item["event__event_type__subtype"]] = count_item["count"]
-        counts_by_user[user] = user_dict
-
-    sorted_counts = dict(
-        sorted(
-            counts_by_user.items(),
-            key=lambda x: tuple(x[1][subtype] for subtype in event_subtypes),
-            reverse=True
-        )
+
+    # One row per user, with a count for each event subtype; ordered by the
+    # counts, in subtype order, and paginated in the db
+    booking_filter = Q(
+        bookings__event__date__gte=start_date,
+        bookings__event__date__lte=end_date,
+        bookings__status="OPEN",
+        bookings__no_show=False
     )
+    subtype_counts = {
+        f"subtype_count_{i}": Count(
+            "bookings", filter=booking_filter & Q(bookings__event__event_type__subtype=subtype)
+        )
+        for i, subtype in enumerate(event_subtypes)
+    }
+    users = User.objects.filter(booking_filter).annotate(**subtype_counts).order_by(
+        *[f"-{count_name}" for count_name in subtype_counts], "username"
+    ).only("id", "username", "first_name", "last_name")
 
-    paginator = Paginator(list(sorted_counts.items()), 100)
+    paginator = Paginator(users, 100)
     page = get_page(request, paginator)
+    user_counts = {
+        user: {
+            subtype: getattr(user, f"subtype_count_{i}")
+            for i, subtype in enumerate(event_subtypes)
+        }
+        for user in page.object_list
+    }
 
     context = {
-        "user_counts": dict(page.object_list),
+        "user_counts": user_counts,
         "event_subtypes": event_subtypes,
         "number_of_subtypes": len(event_subtypes),
         "form": form,
@@ -219,6 +238,21 @@ def users_status(request):
     )
 
 
+@login_required
+@staff_required
+def repeat_no_shows_report(request):
+    start_date, end_date, form = _get_attendance_date_range(request)
+    repeat_no_shows = Booking.objects.confirmed_no_shows(
+        start_date, end_date
+    ).repeat_no_shows(min_no_shows=3)
+    context = {
+        "repeat_no_shows": repeat_no_shows,
+        "form": form,
+        "sidenav_selection": "no_shows",
+    }
+    return render(request, "studioadmin/repeat_no_shows.html", context)
+
+
 @login_required
 @staff_required
 def toggle_subscribed(request,  user_id):
@@ -273,12 +307,12 @@ def user_modal_bookings_view(request, user_id, past=False):
     user = get_object_or_404(User,  id=user_id)
 
     if past:
-        all_bookings = Booking.objects.select_related('event', 'user')\
+        all_bookings = Booking.objects.with_payment_method().select_related('event', 'user')\
             .filter(
                 user=user, event__date__lt=timezone.now()
             ).order_by('-event__date')
     else:
-        all_bookings = Booking.objects.select_related('event', 'user')\
+        all_bookings = Booking.objects.with_payment_method().select_related('event', 'user')\
         .filter(
             user=user, event__date__gt=timezone.now()
         ).order_by('event__date')
@@ -665,29 +699,10 @@ def process_user_booking_updates(form, request):
                         request,  'Note: this booking has been cancelled. The booking has automatically '
                         'been marked as unpaid (refunded).')
 
-                waiting_list_users = WaitingListUser.objects.filter(
-                    event=booking.event
+                notify_waiting_list(
+                    booking.event, host='http://{}'.format(request.get_host()),
+                    source="process_user_booking_updates"
                 )
-                if waiting_list_users:
-                    send_waiting_list_email(
-                        booking.event,
-                        [wluser.user for \
-                            wluser in waiting_list_users],
-                        host='http://{}'.format(
-                            request.get_host()
-                        )
-                    )
-                    ActivityLog.objects.create(
-                        log='Waiting list email sent to '
-                        'user(s) {} for event {}'.format(
-                            ',  '.join(
-                                [wluser.user.username \
-                                    for wluser in \
-                                    waiting_list_users]
-                            ),
-                            booking.event
-                        )
-                    )
 
             if action == 'created' or action == 'reopened':
                 try:
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django import forms
-from timetable.models import Session
+from timetable.models import Session, TimetableUploadJob
 from ckeditor.widgets import CKEditorWidget
 
 
@@ -19,4 +19,30 @@ class SessionAdmin(admin.ModelAdmin):
     form = SessionForm
 
 
+class TimetableUploadJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'start_date', 'end_date', 'user', 'status', 'weeks_done',
+        'weeks_total', 'date_created'
+    )
+    list_filter = ('status',)
+    readonly_fields = (
+        'weeks_total', 'weeks_done', 'created_event_ids', 'existing_event_ids',
+        'duplicates', 'error', 'date_started', 'date_last_progress', 'date_completed'
+    )
+    model = TimetableUploadJob
+
+    actions = ['retry_failed_jobs']
+
+    def retry_failed_jobs(self, request, queryset):
+        # failed jobs keep the weeks already done, so they're resumed from the
+        # week that failed
+        retried = queryset.filter(status=TimetableUploadJob.FAILED).update(
+            status=TimetableUploadJob.PENDING, error="", date_completed=None
+        )
+        self.message_user(request, '{} failed job(s) queued to retry'.format(retried))
+
+    retry_failed_jobs.short_description = "Retry selected failed jobs"
+
+
 admin.site.register(Session, SessionAdmin)
+admin.site.register(TimetableUploadJob, TimetableUploadJobAdmin)
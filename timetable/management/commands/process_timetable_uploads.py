@@ -0,0 +1,68 @@
+'''
+Run pending timetable upload jobs (multi-week uploads from studioadmin).
+Jobs are processed one week at a time, each week in its own transaction, and
+job progress is updated as each week is done so it can be polled by the
+upload progress page.
+Jobs are claimed with skip_locked, so more than one worker can run at once.
+Running jobs that haven't recorded progress for longer than
+TimetableUploadJob.STALE_TIMEOUT are claimed again and resumed from the next
+unprocessed week.
+'''
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from booking.utils import process_timetable_upload_job
+from common.management import write_command_name
+from studioadmin.views.email_helpers import send_new_classes_email
+from timetable.models import TimetableUploadJob
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Process pending timetable upload jobs"
+
+    def claim_next_job(self):
+        with transaction.atomic():
+            stale = timezone.now() - TimetableUploadJob.STALE_TIMEOUT
+            job = TimetableUploadJob.objects.select_for_update(skip_locked=True, of=("self",)).filter(
+                Q(status=TimetableUploadJob.PENDING)
+                | Q(status=TimetableUploadJob.RUNNING, date_last_progress__lt=stale)
+            ).select_related("user").first()
+            if job is not None:
+                job.status = TimetableUploadJob.RUNNING
+                job.date_started = job.date_last_progress = timezone.now()
+                job.save(update_fields=["status", "date_started", "date_last_progress"])
+        return job
+
+    def handle(self, *args, **options):
+        write_command_name(self, __file__)
+        processed = 0
+        job = self.claim_next_job()
+        while job is not None:
+            created = process_timetable_upload_job(job)
+            processed += 1
+            self.stdout.write(
+                f"Timetable upload job {job.id} {job.status}: "
+                f"{len(job.created_event_ids)} class(es) created, "
+                f"{job.weeks_done}/{job.weeks_total} week(s) processed"
+            )
+            visible_created = [event for event in created if event.visible_on_site]
+            if visible_created:
+                try:
+                    send_new_classes_email(job.host, visible_created)
+                except Exception as e:
+                    # the classes are created; don't stop the remaining jobs
+                    logger.error(
+                        "Error sending new classes email for timetable upload job %s: %s",
+                        job.id, e
+                    )
+            job = self.claim_next_job()
+
+        if not processed:
+            self.stdout.write("No timetable upload jobs to process")
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.10 on 2026-10-19 06:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetable', '0024_remove_session_location_index_alter_session_location'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimetableUploadJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('session_ids', models.JSONField(default=list)),
+                ('override_options', models.JSONField(default=dict)),
+                ('host', models.CharField(blank=True, default='', max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('complete', 'Complete'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10)),
+                ('weeks_total', models.PositiveIntegerField(default=0)),
+                ('weeks_done', models.PositiveIntegerField(default=0)),
+                ('created_event_ids', models.JSONField(default=list)),
+                ('existing_event_ids', models.JSONField(default=list)),
+                ('duplicates', models.JSONField(default=list)),
+                ('error', models.TextField(blank=True, default='')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_started', models.DateTimeField(blank=True, null=True)),
+                ('date_completed', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('date_created',),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.10 on 2026-10-19 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetable', '0025_timetableuploadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timetableuploadjob',
+            name='date_last_progress',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,4 +1,7 @@
+from datetime import timedelta
+
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.db import models
 
 from booking.models import EventType, Event, FilterCategory
@@ -69,3 +72,88 @@ class Session(models.Model):
             dict(self.DAY_CHOICES)[self.day], self.time.strftime("%H:%M"),
             self.name, self.location
         )
+
+
+class TimetableUploadJob(models.Model):
+    """
+    A timetable upload that spans more than one week.  These are run by the
+    process_timetable_uploads management command, one week at a time, so that
+    term-length uploads don't need to be done within a single request.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETE = "complete"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (COMPLETE, "Complete"),
+        (FAILED, "Failed"),
+    )
+    # running jobs that haven't recorded any progress for longer than this are
+    # assumed to have been interrupted (e.g. the worker was killed), and can be
+    # claimed again
+    STALE_TIMEOUT = timedelta(minutes=30)
+
+    user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    session_ids = models.JSONField(default=list)
+    override_options = models.JSONField(default=dict)
+    # host for links in the new classes email to members
+    host = models.CharField(max_length=255, blank=True, default="")
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True
+    )
+    weeks_total = models.PositiveIntegerField(default=0)
+    weeks_done = models.PositiveIntegerField(default=0)
+    created_event_ids = models.JSONField(default=list)
+    existing_event_ids = models.JSONField(default=list)
+    # list of {"id": event id, "count": number of matching events}
+    duplicates = models.JSONField(default=list)
+    error = models.TextField(blank=True, default="")
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_started = models.DateTimeField(null=True, blank=True)
+    # updated when the job is claimed and with each week's progress
+    date_last_progress = models.DateTimeField(null=True, blank=True)
+    date_completed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("date_created",)
+
+    def __str__(self):
+        return "Timetable upload {} to {} ({})".format(
+            self.start_date.strftime('%d %b %Y'),
+            self.end_date.strftime('%d %b %Y'),
+            self.status
+        )
+
+    def save(self, *args, **kwargs):
+        if not self.weeks_total:
+            self.weeks_total = len(self.week_ranges())
+        super().save(*args, **kwargs)
+
+    def week_ranges(self):
+        """
+        Split the upload into (start, end) dates for each week (Mon-Sun),
+        limited to the job's start and end dates
+        """
+        ranges = []
+        week_start = self.start_date
+        while week_start <= self.end_date:
+            week_end = min(
+                week_start + timedelta(days=6 - week_start.weekday()), self.end_date
+            )
+            ranges.append((week_start, week_end))
+            week_start = week_end + timedelta(days=1)
+        return ranges
+
+    @property
+    def is_finished(self):
+        return self.status in [self.COMPLETE, self.FAILED]
+
+    @property
+    def progress(self):
+        if not self.weeks_total:
+            return 100
+        return int(self.weeks_done * 100 / self.weeks_total)
@@ -1,10 +1,17 @@
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from django.core import mail
 from django.test import TestCase
+from django.urls import reverse
 from django.core import management
+from django.utils import timezone
 from allauth.socialaccount.models import SocialApp
 from model_bakery import baker
 
-from booking.models import EventType
-from timetable.models import Session
+from activitylog.models import ActivityLog
+from booking.models import Event, EventType
+from timetable.models import Session, TimetableUploadJob
 
 
 class ManagementCommandsTests(TestCase):
@@ -65,6 +72,128 @@ class ManagementCommandsTests(TestCase):
         self.assertEqual(EventType.objects.all().count(), 1)
 
 
+class ProcessTimetableUploadsTests(TestCase):
+
+    def setUp(self):
+        self.sessions = [
+            baker.make_recipe('booking.mon_session', name="Mon"),
+            baker.make_recipe('booking.wed_session', name="Wed"),
+        ]
+        self.user = baker.make_recipe('booking.user', username="admin")
+
+    def make_job(self, **kwargs):
+        return TimetableUploadJob.objects.create(
+            user=self.user,
+            start_date=date(2015, 6, 3),
+            end_date=date(2015, 6, 29),
+            session_ids=[session.id for session in self.sessions],
+            override_options={
+                "visible_on_site": "1", "booking_open": "0", "payment_open": "default"
+            },
+            host="http://test.com",
+            **kwargs
+        )
+
+    def test_no_jobs(self):
+        management.call_command('process_timetable_uploads')
+        assert not Event.objects.exists()
+
+    def test_process_job(self):
+        job = self.make_job()
+        assert job.weeks_total == 5
+        management.call_command('process_timetable_uploads')
+        job.refresh_from_db()
+        assert job.status == TimetableUploadJob.COMPLETE
+        assert job.weeks_done == 5
+        assert job.progress == 100
+        assert job.date_started is not None
+        assert job.date_last_progress >= job.date_started
+        assert job.date_completed is not None
+        # Wed 3rd; Mon/Wed for 3 full weeks; Mon 29th
+        assert Event.objects.count() == 8
+        assert not Event.objects.filter(booking_open=True).exists()
+        assert sorted(job.created_event_ids) == sorted(Event.objects.values_list("id", flat=True))
+        assert ActivityLog.objects.filter(
+            log="Timetable uploaded for Wed 03 June 2015 to Mon 29 June 2015 by admin user admin"
+        ).exists()
+        # members and studio emailed once for the whole upload
+        assert len(mail.outbox) == 1
+        assert "http://test.com" in mail.outbox[0].alternatives[0][0]
+
+        # running again does nothing
+        management.call_command('process_timetable_uploads')
+        assert Event.objects.count() == 8
+        assert len(mail.outbox) == 1
+
+    def test_process_job_with_existing_classes(self):
+        self.make_job()
+        management.call_command('process_timetable_uploads')
+        job = self.make_job()
+        management.call_command('process_timetable_uploads')
+        job.refresh_from_db()
+        assert job.status == TimetableUploadJob.COMPLETE
+        assert job.created_event_ids == []
+        assert len(job.existing_event_ids) == 8
+        assert Event.objects.count() == 8
+
+    def test_failed_job_keeps_completed_weeks(self):
+        job = self.make_job()
+        with patch(
+            "booking.utils.materialize_timetable",
+            side_effect=[{"created": [], "existing": [], "duplicates": []}, Exception("Error")]
+        ):
+            management.call_command('process_timetable_uploads')
+        job.refresh_from_db()
+        assert job.status == TimetableUploadJob.FAILED
+        assert job.weeks_done == 1
+        assert job.error == "Error"
+
+        # a failed job can be retried from the admin, and is resumed from the week
+        # it failed on
+        superuser = baker.make_recipe('booking.user', username="superuser", is_staff=True, is_superuser=True)
+        self.client.force_login(superuser)
+        self.client.post(
+            reverse('admin:timetable_timetableuploadjob_changelist'),
+            {'action': 'retry_failed_jobs', '_selected_action': [job.id]}
+        )
+        job.refresh_from_db()
+        assert job.status == TimetableUploadJob.PENDING
+        assert job.error == ""
+        management.call_command('process_timetable_uploads')
+        job.refresh_from_db()
+        assert job.status == TimetableUploadJob.COMPLETE
+        assert job.weeks_done == 5
+        # no events created for the first week, which was mocked
+        assert Event.objects.count() == 7
+
+    def test_stale_running_job_is_resumed(self):
+        job = self.make_job(
+            status=TimetableUploadJob.RUNNING,
+            date_started=timezone.now() - timedelta(hours=2),
+            date_last_progress=timezone.now() - timedelta(hours=1),
+            weeks_done=1,
+        )
+        management.call_command('process_timetable_uploads')
+        job.refresh_from_db()
+        assert job.status == TimetableUploadJob.COMPLETE
+        assert job.weeks_done == 5
+        # resumed from the second week; Mon/Wed for 3 full weeks; Mon 29th
+        assert Event.objects.count() == 7
+
+    def test_running_job_with_recent_progress_is_not_claimed(self):
+        # started long ago, but still making progress
+        job = self.make_job(
+            status=TimetableUploadJob.RUNNING,
+            date_started=timezone.now() - timedelta(hours=2),
+            date_last_progress=timezone.now() - timedelta(minutes=5),
+        )
+        management.call_command('process_timetable_uploads')
+        job.refresh_from_db()
+        assert job.status == TimetableUploadJob.RUNNING
+        assert job.weeks_done == 0
+        assert not Event.objects.exists()
+
+
 class ModelTests(TestCase):
 
     def test_pre_save_without_cost(self):